@@ -0,0 +1,125 @@
+import os
+import json
+import hashlib
+import functools
+
+from flask import Response, request, abort
+
+from data import get_data_version
+from query import QUERY_COLUMNS, aggregate
+from export import SUM_COLUMNS, list_arg, request_filters
+
+
+# Seconds clients and proxies may reuse a response before revalidating it with its ETag
+API_MAX_AGE = int(os.environ.get('INCIDENTLYTICS_API_MAX_AGE', '60'))
+
+
+
+
+def etag_for(path, args, version):
+
+    """
+    Return the ETag of an API response.
+
+    A response is determined by the dataset version and the request (path and
+    query arguments, in any order), so their digest addresses its content and can be
+    compared with If-None-Match before anything is computed.
+    """
+
+    arguments = sorted((name, value) for name in args for value in args.getlist(name))
+    key = json.dumps([version, path, arguments])
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+
+
+def cached_json(function):
+
+    """
+    Decorator turning a function returning a JSON value into a conditional GET endpoint.
+
+    The response carries the ETag of `etag_for` and a Cache-Control max-age of
+    `API_MAX_AGE`; a request whose If-None-Match holds that ETag gets a 304 without
+    running the function. Responses set no cookie, so proxies can store them.
+    The aggregates cover the dataset only, not the live incidents received since
+    it was written (see `live`), so that its version identifies them.
+    """
+
+    @functools.wraps(function)
+    def endpoint():
+        version = get_data_version()
+        etag = etag_for(request.path, request.args, version)
+
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            body = {'data_version': version, **function()}
+            response = Response(json.dumps(body, default=str), mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = API_MAX_AGE
+        return response
+
+    return endpoint
+
+
+
+
+def _records(frame):
+    return frame.to_dict(orient='records')
+
+
+
+
+def monthly_casualties():
+    # Average casualties per accident and month, the series of `tools.monthly_casualties`
+    country = request.args.get('country') or None
+    monthly = aggregate(['Year', 'Month_Num'], countries=[country] if country else None, sums=['Casualties'])
+    monthly['Month'] = monthly['Year'].astype(str) + '-' + monthly['Month_Num'].astype(str).str.zfill(2)
+    monthly['Average Casualties'] = monthly['Casualties'] / monthly['Count']
+    return {'country': country, 'months': _records(monthly[['Month', 'Count', 'Casualties', 'Average Casualties']])}
+
+
+
+
+def counts():
+    # Accidents (and sums) per group of `by`, under the Home filters
+    by = list_arg('by') or ['Country']
+    sums = list_arg('sums') or []
+    unknown = [column for column in by if column not in QUERY_COLUMNS] + [column for column in sums if column not in SUM_COLUMNS]
+    if unknown:
+        abort(400, f"unknown columns: {', '.join(unknown)}")
+    return {'by': by, 'groups': _records(aggregate(by, sums=sums, **request_filters()))}
+
+
+
+
+def severity():
+    # Accidents per severity under the Home filters, with their share of the selection
+    breakdown = aggregate(['Severity'], **request_filters())
+    breakdown['Share'] = breakdown['Count'] / max(int(breakdown['Count'].sum()), 1)
+    return {'severity': _records(breakdown)}
+
+
+
+
+def init_api(server, prefix='/api/v1'):
+
+    """
+    Install the read-only JSON API on the Flask server.
+
+    GET {prefix}/monthly-casualties?country=...
+        Accidents, casualties and average casualties per month (all countries by default).
+
+    GET {prefix}/counts?by=Country&sums=Casualties
+        Accidents (and sums) per group, `by` defaulting to Country.
+
+    GET {prefix}/severity
+        Accidents and their share per severity.
+
+    The counts and severity endpoints take the Home filters (start_date, end_date,
+    country, weather). Every response holds the `data_version` it was computed from.
+    """
+
+    for name, function in [('monthly-casualties', monthly_casualties), ('counts', counts), ('severity', severity)]:
+        server.add_url_rule(f'{prefix}/{name}', f'api_{function.__name__}', cached_json(function))
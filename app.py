@@ -1,16 +1,37 @@
+import os
+import importlib
+import threading
 import dash_mantine_components as dmc
 import dash_bootstrap_components as dbc 
 from dash import Dash, html, dcc, Input, Output
 
 # User-Defined Modules
-from pages.page1_home import create_insights_layout 
-from pages.page2_trends import create_trends_layout
-from pages.page3_forecast import create_forecast_layout 
+from data import get_data_version
+from artifacts import load_artifact
+from catalog import get_catalog, dropdown_options
+from profiling import stage
+from metrics import init_metrics, instrument
+from compression import init_compression
+from coalescing import tab_store
+from export import init_export
+from api import init_api
 
 # Initialize the dash application
 app = Dash(__name__, external_stylesheets=[dbc.themes.COSMO], suppress_callback_exceptions=True)
 server = app.server
 
+# Gzip/brotli responses and payload budget warnings; installed first so that it runs last
+init_compression(server)
+
+# Per-callback latency metrics (/metrics) and Server-Timing headers
+init_metrics(server)
+
+# Streaming downloads of the filtered incidents and aggregates (/export)
+init_export(server)
+
+# Read-only JSON aggregates with ETags (/api/v1/...)
+init_api(server)
+
 # ----------------- Application Layouts ----------------- #
 
 # Top Navigation Bar Style
@@ -183,6 +204,26 @@ sidebar = html.Div([
             )
         ], className="mb-4"),
         
+        # Approximate Results Toggle
+        html.Div([
+            dbc.Switch(
+                id='approx-toggle',
+                label="Approximate results (faster, with 95% error bounds)",
+                value=False,
+                style={'color': '#001f3f', 'font-weight': '600'}
+            )
+        ], className="mb-4"),
+        
+        # Download of the filtered incidents
+        html.Div([
+            html.A(
+                "Download filtered incidents (CSV)",
+                id="export-link",
+                href="/export",
+                style={'color': '#001f3f', 'font-weight': '600'}
+            )
+        ], className="mb-4"),
+
         # Clear Filters Button
         html.Div([
             dbc.Button(
@@ -202,12 +243,8 @@ sidebar = html.Div([
 
 # Empty Sidebar (for other pages)
  
-# App Layout
-app.layout = dmc.MantineProvider([
-    dcc.Location(id="page-url"),
-    navbar,
-    html.Div(id="main-layout"),
-    dcc.Markdown("""
+# Styles of the custom components
+app_styles = dcc.Markdown("""
         <style>
         .nav-link-custom:hover {
             background-color: #FFD700 !important;
@@ -241,29 +278,81 @@ app.layout = dmc.MantineProvider([
         }
         </style>
     """, dangerously_allow_html=True)
-])
+
+# App Layout
+def serve_layout():
+    # Served anew to every page load, so that each browser tab gets its own id.
+    # pandas is imported on first use, and plotly serializes a response with whatever pandas
+    # module it finds, even one another thread is still importing: the first request of a
+    # tab completes (or waits for) the import before any of its callbacks runs
+    import pandas
+
+    return dmc.MantineProvider([
+        dcc.Location(id="page-url"),
+        tab_store(),
+        navbar,
+        html.Div(id="main-layout"),
+        app_styles
+    ])
+
+app.layout = serve_layout
 
 # -------------------------------------------------- Page Layouts -------------------------------------------------- #
 
-home_layout = create_insights_layout()
-forecast_layout = create_forecast_layout()
-trends_layout=create_trends_layout()
+# Route -> (page module, layout factory)
+page_registry = {
+    "/": ("pages.page1_home", "create_insights_layout"),
+    "/trends": ("pages.page2_trends", "create_trends_layout"),
+    "/TimeSeries": ("pages.page3_forecast", "create_forecast_layout"),
+}
+
+# Dash only collects callbacks registered before the first request, so the page
+# modules are imported here; they load no data or models at import time.
+for module_name, _ in page_registry.values():
+    importlib.import_module(module_name)
+
+# Built layouts keyed by route -> (data version, layout)
+_page_layouts = {}
+_page_lock = threading.Lock()
+
+def get_page_layout(pathname):
+    # Build a page (its data, models and layout) the first time its route is hit
+    version = get_data_version()
+    cached = _page_layouts.get(pathname)
+    if cached is None or cached[0] != version:
+        with _page_lock:
+            cached = _page_layouts.get(pathname)
+            if cached is None or cached[0] != version:
+                module_name, factory_name = page_registry[pathname]
+                module = importlib.import_module(module_name)
+                for artifact_name in getattr(module, 'page_artifacts', []):
+                    load_artifact(artifact_name)
+                with stage(f'layout build: {pathname}'):
+                    cached = (version, getattr(module, factory_name)())
+                _page_layouts[pathname] = cached
+    return cached[1]
+
+def prewarm_pages():
+    # Build every page ahead of its first visit, Home first
+    for pathname in page_registry:
+        get_page_layout(pathname)
 
 @app.callback(
     Output("main-layout", "children"),
     Input("page-url", "pathname")
 )
+@instrument
 def display_page(pathname):
     if pathname == "/":
         # Home page: sidebar with filters
         return html.Div([
             sidebar,
-            html.Div(home_layout, style=content_style)
+            html.Div(get_page_layout(pathname), style=content_style)
         ])
     elif pathname == "/trends":
         # Trends page: empty sidebar for alignment
         return html.Div([ 
-            html.Div(trends_layout, style={**content_style,'margin-left': 'auto','margin-right': 'auto'}),
+            html.Div(get_page_layout(pathname), style={**content_style,'margin-left': 'auto','margin-right': 'auto'}),
         ])
     elif pathname == "/TimeSeries":
         # Forecast page: no sidebar, with analytics globe background
@@ -273,7 +362,7 @@ def display_page(pathname):
             "padding": "70px"  # Match the forecast layout padding
         }
         return html.Div(
-            forecast_layout,
+            get_page_layout(pathname),
             style=forecast_content_style
         )
     else:
@@ -285,6 +374,10 @@ def display_page(pathname):
             )
         ])
 
+# Optional background prewarm so the first visit of each page is served warm
+if os.environ.get("INCIDENTLYTICS_PREWARM") == "1":
+    threading.Thread(target=prewarm_pages, name="page-prewarm", daemon=True).start()
+
 # Initialize filter options callback
 @app.callback(
     [Output('date-picker', 'start_date'),
@@ -295,17 +388,17 @@ def display_page(pathname):
      Output('weather-dropdown', 'options')],
     Input('page-url', 'pathname')
 )
+@instrument
 def initialize_filters(pathname):
-    # Import here to avoid circular import
-    from pages.page1_home import df
-    
+    catalog = get_catalog()
+
     return (
-        df['Date'].min(),
-        df['Date'].max(), 
-        df['Date'].min(),
-        df['Date'].max(),
-        [{'label': c, 'value': c} for c in sorted(df['Country'].unique())],
-        [{'label': w, 'value': w} for w in sorted(df['Weather Condition'].unique())]
+        catalog['date_min'],
+        catalog['date_max'],
+        catalog['date_min'],
+        catalog['date_max'],
+        dropdown_options('Country'),
+        dropdown_options('Weather Condition')
     )
 
 # Clear filters callback
@@ -315,10 +408,28 @@ def initialize_filters(pathname):
     Input('clear-filters-btn', 'n_clicks'),
     prevent_initial_call=True
 )
+@instrument
 def clear_filters(n_clicks):
     if n_clicks:
         return None, None
     return None, None
 
+# Export link callback
+@app.callback(
+    Output('export-link', 'href'),
+    [Input('date-picker', 'start_date'),
+     Input('date-picker', 'end_date'),
+     Input('country-dropdown', 'value'),
+     Input('weather-dropdown', 'value')]
+)
+@instrument
+def update_export_link(start_date, end_date, countries, weather):
+    from urllib.parse import urlencode
+
+    params = [('start_date', start_date), ('end_date', end_date)]
+    params += [('country', country) for country in countries or []]
+    params += [('weather', condition) for condition in weather or []]
+    return '/export?' + urlencode([(name, value) for name, value in params if value])
+
 if __name__ == "__main__":
     app.run()
\ No newline at end of file
@@ -0,0 +1,270 @@
+import threading
+
+import numpy as np
+
+from data import DATASET_PATH, get_data_version, load_accidents
+from profiling import stage
+from metrics import phase
+from coalescing import shared
+
+
+# Incidents kept per (month, country) stratum
+SAMPLE_PER_STRATUM = 500
+
+# Selections whose months and countries hold fewer incidents are answered exactly
+APPROX_MIN_ROWS = 200_000
+
+# Normal quantile of the reported confidence intervals (95%)
+CONFIDENCE_Z = 1.96
+
+# Seed of the sampling keys, so that restarts serve the same estimates
+SAMPLE_SEED = 0
+
+# Largest (stratum x group) tables counted densely; finer groupings are compacted first
+MAX_DENSE_CELLS = 4_000_000
+
+# Columns identifying a stratum
+STRATUM_COLUMNS = ['Year', 'Month_Num', 'Country']
+
+# Built samples keyed by path -> (data version, StratifiedSample)
+_sample_cache = {}
+_sample_lock = threading.Lock()
+
+
+
+
+class StratifiedSample:
+
+    """
+    Uniform reservoir samples of the incidents of every (month, country) stratum.
+
+    Each incident draws a random key and every stratum keeps the `size` incidents with
+    the smallest keys, which is a uniform sample without replacement of the stratum, like
+    a reservoir. Samples of two batches merge by keeping the smallest keys again, so
+    incidents can be added batch by batch (from the Parquet store, or as they arrive).
+
+    Args:
+
+    size : int
+        The number of incidents kept per stratum.
+    """
+
+    def __init__(self, size=SAMPLE_PER_STRATUM, seed=SAMPLE_SEED):
+        self.size = size
+        self._rng = np.random.default_rng(seed)
+        # Sampled rows, their stratum and the strata table, replaced as a whole on every add
+        self._state = None
+        self._lock = threading.Lock()
+
+    def add(self, incidents):
+
+        """
+        Count new incidents into the strata populations and merge them into the samples.
+
+        Args:
+
+        incidents : pandas.DataFrame
+            Preprocessed rows with at least the columns of `query.QUERY_COLUMNS`.
+        """
+
+        import pandas as pd
+        from query import QUERY_COLUMNS
+
+        with self._lock:
+            incidents = incidents[QUERY_COLUMNS].reset_index(drop=True).assign(_key=self._rng.random(len(incidents)))
+            population = incidents.groupby(STRATUM_COLUMNS, observed=True).size()
+            if self._state is not None:
+                old = self._state
+                incidents = pd.concat([old['rows'], incidents], ignore_index=True)
+                population = old['strata']['Population'].add(population, fill_value=0).astype(np.int64)
+
+            # Keep the `size` smallest keys of every stratum
+            stratum = incidents.groupby(STRATUM_COLUMNS, observed=True).ngroup().to_numpy()
+            order = np.lexsort((incidents['_key'].to_numpy(), stratum))
+            ordered = stratum[order]
+            rank = np.arange(len(order)) - np.searchsorted(ordered, ordered, 'left')
+            kept = np.sort(order[rank < self.size])
+            rows = incidents.take(kept).reset_index(drop=True)
+
+            strata = rows.groupby(STRATUM_COLUMNS, observed=True).size().rename('n').to_frame()
+            strata['Population'] = population.reindex(strata.index).to_numpy()
+            n, total = strata['n'].to_numpy(dtype=float), strata['Population'].to_numpy(dtype=float)
+            strata['weight'] = total / n
+            # N^2 (1 - n / N) / (n (n - 1)), times the sum of squared deviations, is the variance of N * mean
+            strata['variance_factor'] = np.where(n > 1, total ** 2 * (1 - n / total) / (n * np.maximum(n - 1, 1)), 0.0)
+            year, month = (strata.index.get_level_values(level).to_numpy() for level in STRATUM_COLUMNS[:2])
+            strata['month_index'] = year * 12 + month
+
+            self._state = {'rows': rows, 'stratum': stratum[kept], 'strata': strata, 'codes': {}}
+
+    def _codes(self, state, column):
+        # Sorted factorization of a sampled column, computed once per state
+        import pandas as pd
+
+        if column not in state['codes']:
+            state['codes'][column] = pd.factorize(state['rows'][column], sort=True)
+        return state['codes'][column]
+
+    def population(self, start_date=None, end_date=None, countries=None):
+        # Incidents in the strata touched by the filters (an upper bound of the selection)
+        import pandas as pd
+
+        if self._state is None:
+            return 0
+        strata = self._state['strata']
+        keep = np.ones(len(strata), dtype=bool)
+        if start_date:
+            start = pd.Timestamp(start_date)
+            keep &= strata['month_index'].to_numpy() >= start.year * 12 + start.month
+        if end_date:
+            end = pd.Timestamp(end_date)
+            keep &= strata['month_index'].to_numpy() <= end.year * 12 + end.month
+        if countries:
+            keep &= np.isin(strata.index.get_level_values('Country'), list(countries))
+        return int(strata['Population'].to_numpy()[keep].sum())
+
+    def estimate(self, by, start_date=None, end_date=None, countries=None, weather=None, sums=()):
+
+        """
+        Estimate the counts (and sums) of the incidents matching the filters, per group.
+
+        Returns:
+
+        result : pandas.DataFrame
+            The columns `by`, 'Count', `sums` and the half-widths of their confidence
+            intervals ('Count Error', '<sum> Error'), sorted by the grouping columns.
+
+        Notes
+        -----
+        - Each stratum's total is estimated from its sample by expansion (N_h / n_h) with
+          the finite-population variance N_h^2 (1 - n_h / N_h) s_h^2 / n_h; strata
+          estimates are independent, so totals and variances add up over strata.
+        - Fully sampled strata contribute exactly and without error.
+        """
+
+        import pandas as pd
+
+        state = self._state
+        rows, strata = state['rows'], state['strata']
+
+        matching = np.ones(len(rows), dtype=bool)
+        if start_date:
+            matching &= (rows['Date'] >= start_date).to_numpy()
+        if end_date:
+            matching &= (rows['Date'] <= end_date).to_numpy()
+        if weather:
+            matching &= rows['Weather Condition'].isin(weather).to_numpy()
+        if countries:
+            matching &= rows['Country'].isin(countries).to_numpy()
+        selected = np.flatnonzero(matching)
+
+        # Group of every selected row, in the sorted order of the grouping columns
+        group = np.zeros(len(selected), dtype=np.int64)
+        uniques = []
+        for column in by:
+            codes, values = self._codes(state, column)
+            group = group * len(values) + codes[selected]
+            uniques.append(values)
+        groups = np.arange(np.prod([len(values) for values in uniques], dtype=np.int64))
+        if len(strata) * len(groups) > MAX_DENSE_CELLS:
+            groups, group = np.unique(group, return_inverse=True)
+
+        # (stratum, group) tables of the sums of y and y^2, with y the indicator (count) or the value (sums)
+        shape = (len(strata), len(groups))
+        cell = state['stratum'][selected] * len(groups) + group
+        counts = np.bincount(cell, minlength=shape[0] * shape[1]).reshape(shape)
+        present = counts.any(axis=0)
+        n = strata['n'].to_numpy(dtype=float)[:, None]
+
+        result = {}
+        for column, values, codes in zip(by, uniques, np.unravel_index(groups[present], [len(values) for values in uniques])):
+            result[column] = values.take(codes)
+
+        errors = {}
+        for column in ['Count', *sums]:
+            if column == 'Count':
+                total = squares = counts
+            else:
+                y = rows[column].to_numpy(dtype=float)[selected]
+                total = np.bincount(cell, weights=y, minlength=shape[0] * shape[1]).reshape(shape)
+                squares = np.bincount(cell, weights=y ** 2, minlength=shape[0] * shape[1]).reshape(shape)
+            # Squared deviations of y over the whole stratum sample (non-matching rows count as 0)
+            deviations = np.maximum(squares - total ** 2 / n, 0)
+            estimate = strata['weight'].to_numpy() @ total
+            variance = strata['variance_factor'].to_numpy() @ deviations
+            result[column] = np.round(estimate[present]).astype(np.int64)
+            errors[f'{column} Error'] = CONFIDENCE_Z * np.sqrt(variance[present])
+
+        return pd.DataFrame({**result, **errors})
+
+
+
+
+def get_sample(path=DATASET_PATH):
+
+    """
+    Return the stratified sample of the dataset, built once per data version.
+
+    With the 'parquet' query backend the sample is merged batch by batch from the
+    store, without loading the dataset in memory.
+    """
+
+    from query import get_backend, QUERY_COLUMNS
+
+    version = get_data_version(path)
+    cached = _sample_cache.get(path)
+    if cached is None or cached[0] != version:
+        with _sample_lock:
+            cached = _sample_cache.get(path)
+            if cached is None or cached[0] != version:
+                with stage('stratified sample build'):
+                    sample = StratifiedSample()
+                    if get_backend() == 'parquet':
+                        from store import open_store
+                        for batch in open_store(path).to_batches(columns=QUERY_COLUMNS, batch_size=1_000_000):
+                            batch = batch.to_pandas()
+                            for column in batch.columns[batch.dtypes == 'category']:
+                                batch[column] = batch[column].astype('str')
+                            sample.add(batch)
+                    else:
+                        sample.add(load_accidents(path))
+                cached = _sample_cache[path] = (version, sample)
+    return cached[1]
+
+
+
+
+@shared
+def estimate(by, start_date=None, end_date=None, countries=None, weather=None, sums=(), top=None, approximate=True):
+
+    """
+    Count the accidents matching the dashboard filters, grouped by `by`, with error bounds.
+
+    Same arguments and result as `query.aggregate`, plus the half-width of the 95%
+    confidence interval of every count and sum ('Count Error', '<sum> Error').
+
+    Notes
+    -----
+    - With `approximate` the result is estimated from the stratified samples; without
+      it, or when the selected months and countries hold fewer than `APPROX_MIN_ROWS`
+      incidents, the exact result is returned with zero errors.
+    - Groups without any sampled incident are missing from an estimate.
+    """
+
+    from query import aggregate
+
+    if approximate:
+        sample = get_sample()
+        approximate = sample.population(start_date, end_date, countries) >= APPROX_MIN_ROWS
+
+    if not approximate:
+        result = aggregate(by, start_date, end_date, countries, weather, sums, top)
+        for column in ['Count', *sums]:
+            result[f'{column} Error'] = 0.0
+        return result
+
+    with phase('aggregate'):
+        result = sample.estimate(by, start_date, end_date, countries, weather, sums)
+        if top is not None:
+            result = result.sort_values('Count', ascending=False, kind='stable').head(top).reset_index(drop=True)
+    return result
@@ -0,0 +1,56 @@
+import os
+import threading
+
+from data import get_data_version
+from profiling import stage
+
+
+# Directory holding the trained models and their feature-column pickles
+MODELS_DIR = 'models'
+
+# Cache of loaded artifacts keyed by path -> (file version, object)
+_artifact_cache = {}
+_artifact_lock = threading.Lock()
+
+
+
+
+def load_artifact(name, models_dir=MODELS_DIR):
+
+    """
+    Load a pickled model artifact on first use and keep it in memory.
+
+    Args:
+
+    name : str
+        The artifact file name without the '.pkl' extension (e.g. 'assessment_model').
+
+    models_dir : str, optional
+        The directory holding the artifacts.
+
+    Returns:
+
+    artifact : object
+        The unpickled object (a trained model or a list of feature columns).
+
+    Notes
+    -----
+    - The artifact is reloaded only when its file changes on disk, so retrained
+      models are picked up without restarting the dashboard.
+    """
+
+    path = os.path.join(models_dir, f'{name}.pkl')
+    version = get_data_version(path)
+
+    cached = _artifact_cache.get(path)
+    if cached is None or cached[0] != version:
+        with _artifact_lock:
+            cached = _artifact_cache.get(path)
+            if cached is None or cached[0] != version:
+                # joblib (and xgboost, through the pickles) is imported on first use
+                from joblib import load
+                with stage(f'model load: {name}'):
+                    cached = (version, load(path))
+                _artifact_cache[path] = cached
+
+    return cached[1]
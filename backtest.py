@@ -0,0 +1,210 @@
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Forecasting models: name -> (features function in tools, model artifact, target column)
+BACKTEST_MODELS = {
+    'accidents': ('get_accidents_features', 'accidents_forecasting_model', 'AccidentsCount'),
+    'casualties': ('get_casualties_features', 'casualties_forecasting_model', 'Casualties'),
+}
+
+# Default number of months forecast from every origin
+DEFAULT_HORIZON = 6
+
+# Forecast origins evaluated per pool task
+ORIGINS_PER_TASK = 8
+
+# Monthly series of the worker process: (model name, series name) -> monthly_counts
+_worker_series = {}
+
+
+
+
+def build_series(accidents_df, models, by_country=False):
+
+    """
+    Build the monthly feature frames backtested for each model.
+
+    Args:
+
+    accidents_df : pandas.DataFrame
+        The preprocessed accidents.
+
+    models : list of str
+        Names from `BACKTEST_MODELS`.
+
+    by_country : bool
+        Also backtest every country's own monthly series besides the global one.
+
+    Returns:
+
+    series : dict
+        (model name, series name) -> the monthly_counts frame of `tools.get_*_features`,
+        computed once and shared by every fold of the series.
+    """
+
+    import tools
+
+    groups = [('global', accidents_df)]
+    if by_country:
+        groups += [(country, frame) for country, frame in accidents_df.groupby('Country', observed=True)]
+
+    series = {}
+    for model in models:
+        features = getattr(tools, BACKTEST_MODELS[model][0])
+        for name, frame in groups:
+            monthly_counts, _ = features(frame)
+            series[(model, name)] = monthly_counts
+    return series
+
+
+
+
+def _init_worker(series):
+    # Runs once per pool process: the feature frames are received once, not per task
+    _worker_series.update(series)
+
+
+
+
+def _backtest_origins(model, name, origins, horizon):
+    # Forecast `horizon` months from each origin of one series and pair them with the actual values
+    from artifacts import load_artifact
+    from tools import forecast_interval
+
+    monthly_counts = _worker_series[(model, name)]
+    _, artifact, target = BACKTEST_MODELS[model]
+    estimator = load_artifact(artifact)
+
+    rows = []
+    for origin in origins:
+        known = monthly_counts.iloc[:origin + 1]
+        # The values of the origin month and the 2 before it, as the lag features hold them
+        last_known = [known['lag_2'].iloc[-1], known['lag_1'].iloc[-1], known[target].iloc[-1]]
+        steps = min(horizon, len(monthly_counts) - origin - 1)
+        _, predictions = forecast_interval(estimator, known, steps, last_known)
+        for step, prediction in enumerate(predictions, start=1):
+            actual = monthly_counts[target].iloc[origin + step]
+            rows.append((model, name, origin, step, float(actual), float(prediction)))
+    return rows
+
+
+
+
+def run_backtest(models=tuple(BACKTEST_MODELS), horizon=DEFAULT_HORIZON, by_country=False, workers=None):
+
+    """
+    Evaluate the forecasting models from every forecast origin of their history.
+
+    From each month of a series (the origin), the model forecasts the next `horizon`
+    months recursively with `tools.forecast_interval`, from the values known at the
+    origin only, and every forecast is compared with the actual value.
+
+    Args:
+
+    models : list of str
+        Names from `BACKTEST_MODELS`.
+
+    horizon : int
+        The number of months forecast from each origin.
+
+    by_country : bool
+        Also evaluate every country's own monthly series.
+
+    workers : int, optional
+        The number of worker processes (default: one per CPU).
+
+    Returns:
+
+    forecasts : pandas.DataFrame
+        One row per (model, series, origin, horizon) with its 'actual' and 'predicted' values.
+
+    Notes
+    -----
+    - Origins are split in chunks of `ORIGINS_PER_TASK` across a process pool; each
+      worker receives the feature frames once and loads each model once.
+    - The trained models are evaluated as they are (no refitting per origin), so the
+      origins inside their training period measure in-sample errors.
+    """
+
+    import pandas as pd
+    from data import load_accidents
+
+    series = build_series(load_accidents(), list(models), by_country)
+
+    tasks = []
+    for (model, name), monthly_counts in series.items():
+        origins = list(range(len(monthly_counts) - 1))
+        for start in range(0, len(origins), ORIGINS_PER_TASK):
+            tasks.append((model, name, origins[start:start + ORIGINS_PER_TASK], horizon))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(series,)) as pool:
+        futures = [pool.submit(_backtest_origins, *task) for task in tasks]
+        rows = [row for future in futures for row in future.result()]
+
+    return pd.DataFrame(rows, columns=['model', 'series', 'origin', 'horizon', 'actual', 'predicted'])
+
+
+
+
+def error_by_horizon(forecasts):
+
+    """
+    Summarize backtest forecasts into error tables.
+
+    Returns:
+
+    errors : pandas.DataFrame
+        Per model, series and horizon: the number of forecasts, MAE, RMSE, MAPE (%)
+        and bias (mean of predicted - actual), over every origin.
+    """
+
+    import numpy as np
+
+    forecasts = forecasts.assign(
+        error=forecasts['predicted'] - forecasts['actual'],
+        percent=100 * (forecasts['predicted'] - forecasts['actual']).abs() / forecasts['actual'].where(forecasts['actual'] != 0),
+    )
+    grouped = forecasts.groupby(['model', 'series', 'horizon'])
+    errors = grouped.size().rename('forecasts').to_frame()
+    errors['MAE'] = grouped['error'].apply(lambda error: error.abs().mean())
+    errors['RMSE'] = grouped['error'].apply(lambda error: np.sqrt((error ** 2).mean()))
+    errors['MAPE'] = grouped['percent'].mean()
+    errors['bias'] = grouped['error'].mean()
+    return errors.reset_index()
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest the forecasting models over rolling forecast origins.")
+    parser.add_argument('--models', nargs='+', choices=list(BACKTEST_MODELS), default=list(BACKTEST_MODELS),
+                        help="models to evaluate")
+    parser.add_argument('--horizon', type=int, default=DEFAULT_HORIZON, help="months forecast from each origin")
+    parser.add_argument('--by-country', action='store_true', help="also backtest every country's own series")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--output', help="also write every forecast to this CSV file")
+    parser.add_argument('--json', action='store_true', help="print the error tables as JSON")
+    args = parser.parse_args()
+
+    forecasts = run_backtest(args.models, args.horizon, args.by_country, args.workers)
+    errors = error_by_horizon(forecasts)
+
+    if args.output:
+        forecasts.to_csv(args.output, index=False)
+    if args.json:
+        json.dump(errors.to_dict(orient='records'), sys.stdout, indent=2)
+        print()
+        return
+
+    for model, table in errors.groupby('model'):
+        print(f"\n{model} ({BACKTEST_MODELS[model][1]}.pkl)")
+        print(table.drop(columns='model').to_string(index=False, float_format=lambda value: f'{value:.2f}'))
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+
+# Root of the repository (the dashboard resolves its data and model paths from here)
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Stored results that new runs are compared against
+BASELINE_PATH = os.path.join(ROOT_DIR, 'benchmark_baseline.json')
+
+# Default dataset sizes (rows) to benchmark
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+
+
+
+
+def triggered_by(prop_id, function):
+    # Run a callback that reads `dash.ctx` as if `prop_id` ('component.property') had fired it
+    from contextvars import copy_context
+    from dash._utils import AttributeDict
+    from dash._callback_context import context_value
+
+    def run():
+        context_value.set(AttributeDict(triggered_inputs=[{'prop_id': prop_id, 'value': None}]))
+        return function()
+
+    return lambda: copy_context().run(run)
+
+
+
+
+def benchmark_cases():
+
+    """
+    Build the list of (name, function) cases timed against the loaded dataset.
+
+    The dataset must already be loaded through `data.load_accidents`.
+    """
+
+    from catalog import get_catalog
+    from artifacts import load_artifact
+    from data import load_accidents
+    from query import filter_accidents, aggregate
+    from topk import top_k
+    from approx import estimate
+    from crossfilter import crossfilter_counts
+    from temporal import histogram
+    from pages import page1_home, page2_trends, page3_forecast
+    from tools import get_accidents_features, get_casualties_features, forecast_interval, forecast_paths
+
+    catalog = get_catalog()
+    start, end = catalog['date_min'], catalog['date_max']
+    countries = [value for value, _ in catalog['domains']['Country']]
+    weather = [value for value, _ in catalog['domains']['Weather Condition']]
+
+    accidents_df = load_accidents()
+    accidents_model = load_artifact('accidents_forecasting_model')
+    monthly_counts, last_known = get_accidents_features(accidents_df)
+
+    return [
+        ('query.filter_accidents[all]', lambda: filter_accidents(start, end, None, None)),
+        ('query.filter_accidents[countries+weather]', lambda: filter_accidents(start, end, countries[:2], weather[:2])),
+        ('query.aggregate[country]', lambda: aggregate(['Country'], start, end)),
+        ('query.aggregate[location top 10]', lambda: aggregate(['Location'], start, end, countries[:1], None, top=10)),
+        ('topk.top_k[location top 10]', lambda: top_k('Location', 10, start, end, countries[:1], None)),
+        ('approx.estimate[weather x road]', lambda: estimate(['Weather Condition', 'Road Condition'], start, end, top=5)),
+        ('crossfilter.crossfilter_counts[country click]',
+            lambda: crossfilter_counts('Location', start, end, None, None, {'Country': countries[:1]}, top=10)),
+        ('temporal.histogram[hour x weekday]', lambda: histogram('Hour', 'Weekday', start, end, countries[:2], None, sums=['Casualties'])),
+        ('home.update_choropleth[all]', lambda: page1_home.update_choropleth(start, end, None, None)),
+        ('home.update_choropleth[one country]', lambda: page1_home.update_choropleth(start, end, countries[:1], None)),
+        ('home.update_bar_chart', lambda: page1_home.update_bar_chart(start, end, None, None)),
+        ('home.update_heat_chart', lambda: page1_home.update_heat_chart(start, end, None, None)),
+        ('home.update_density_map[world]', lambda: page1_home.update_density_map(start, end, None, None, None)),
+        ('home.update_density_map[one country]', lambda: page1_home.update_density_map(start, end, countries[:1], None, None)),
+        ('home.update_crossfilter_selection[country click]', triggered_by('choropleth-map.clickData',
+            lambda: page1_home.update_crossfilter_selection({'points': [{'location': countries[0]}]}, None, None, None, None, {}, None))),
+        ('home.update_bar_chart[country click]', lambda: page1_home.update_bar_chart(start, end, None, None, {'Country': countries[:1]})),
+        ('trends.update_time_series', lambda: page2_trends.update_time_series(start, end)),
+        ('trends.update_env_plot', lambda: page2_trends.update_env_plot('Weather Condition')),
+        ('trends.update_env_title', lambda: page2_trends.update_env_title('Cause')),
+        ('trends.update_trend_graph', lambda: page2_trends.update_trend_graph('Casualties')),
+        ('trends.update_temporal_heatmap', lambda: page2_trends.update_temporal_heatmap(start, end, 'Month', 'Casualties')),
+        ('tools.get_accidents_features', lambda: get_accidents_features(accidents_df)),
+        ('tools.get_casualties_features', lambda: get_casualties_features(accidents_df)),
+        ('tools.forecast_interval[12]', lambda: forecast_interval(accidents_model, monthly_counts, 12, list(last_known))),
+        ('tools.forecast_paths[12 x 2000]', lambda: forecast_paths(accidents_model, monthly_counts, 12, last_known)),
+        ('forecast.predict_casualties', lambda: page3_forecast.predict_casualties(
+            1, countries[0], None, 12.0, 12.0, 2, weather[0], None, None, str(end)[:10], '08:30')),
+    ]
+
+
+
+
+def trace_peak(function):
+
+    """
+    Run `function` once under tracemalloc and return its peak traced allocation in MiB.
+    """
+
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+
+
+def measure(function, repeat, trace_memory=True):
+
+    """
+    Time `function` over `repeat` runs after one warm-up call, then trace one
+    extra run for its peak memory.
+
+    Returns a dict with the mean and best wall time (seconds) and the peak
+    traced allocation (MiB, None if memory tracing is disabled).
+    """
+
+    function()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    peak_mib = trace_peak(function) if trace_memory else None
+
+    return {'mean_s': sum(timings) / len(timings), 'best_s': min(timings), 'peak_mib': peak_mib}
+
+
+
+
+def run_worker(repeat, trace_memory):
+
+    """
+    Run every case against the dataset named by INCIDENTLYTICS_DATASET and
+    print the results as JSON. Runs in its own interpreter for each size.
+    """
+
+    from data import DATASET_PATH, data_preprocess, load_accidents
+
+    results = {}
+
+    # Preprocessing is timed once, through the first load of the dataset
+    start = time.perf_counter()
+    load_accidents()
+    elapsed = time.perf_counter() - start
+    peak_mib = trace_peak(lambda: data_preprocess(DATASET_PATH)) if trace_memory else None
+    results['data.data_preprocess'] = {'mean_s': elapsed, 'best_s': elapsed, 'peak_mib': peak_mib}
+
+    for name, function in benchmark_cases():
+        results[name] = measure(function, repeat, trace_memory)
+
+    json.dump(results, sys.stdout)
+
+
+
+
+def run_size(n_rows, data_dir, repeat, trace_memory):
+
+    """
+    Benchmark one dataset size in a fresh interpreter and return its results.
+    """
+
+    dataset_path = os.path.join(data_dir, f'synthetic_{n_rows}.csv')
+    if not os.path.exists(dataset_path):
+        from synthetic import write_synthetic
+        print(f"Generating {n_rows:,} synthetic rows -> {dataset_path}", file=sys.stderr)
+        write_synthetic(dataset_path, n_rows)
+
+    command = [sys.executable, os.path.abspath(__file__), '--worker', '--repeat', str(repeat)]
+    if not trace_memory:
+        command.append('--no-memory')
+
+    env = {**os.environ, 'INCIDENTLYTICS_DATASET': dataset_path}
+    result = subprocess.run(command, cwd=ROOT_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"Benchmark worker failed for {n_rows:,} rows")
+
+    return json.loads(result.stdout)
+
+
+
+
+def compare(results, baseline, tolerance, min_delta=0.005):
+
+    """
+    Print the results next to the baseline and return the list of regressions.
+
+    A case regresses when its best time exceeds the baseline's by more than
+    `tolerance` (a fraction, e.g. 0.25 for 25%); the best of several runs is
+    far less noisy than the mean. Slowdowns under `min_delta` seconds are
+    ignored so that sub-millisecond cases do not flag timer noise.
+    """
+
+    regressions = []
+    print(f"{'rows':>11}  {'case':<40} {'mean s':>9} {'best s':>9} {'peak MiB':>9} {'baseline':>9} {'ratio':>6}")
+    for size, cases in results.items():
+        for name, result in cases.items():
+            reference = baseline.get(size, {}).get(name)
+            peak = f"{result['peak_mib']:9.1f}" if result['peak_mib'] is not None else f"{'-':>9}"
+            line = f"{int(size):>11,}  {name:<40} {result['mean_s']:9.4f} {result['best_s']:9.4f} {peak}"
+            if reference:
+                ratio = result['best_s'] / reference['best_s'] if reference['best_s'] else 1.0
+                line += f" {reference['best_s']:9.4f} {ratio:6.2f}"
+                if ratio > 1 + tolerance and result['best_s'] - reference['best_s'] > min_delta:
+                    line += "  REGRESSION"
+                    regressions.append((size, name, ratio))
+            print(line)
+    return regressions
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard's hot paths on synthetic datasets.")
+    parser.add_argument('--sizes', type=lambda text: [int(size) for size in text.split(',')], default=DEFAULT_SIZES,
+                        help="comma-separated dataset sizes in rows (default: 10000,1000000,10000000)")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per case")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'incidentlytics-bench'),
+                        help="where synthetic datasets are generated and reused")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline file to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown before failing (fraction)")
+    parser.add_argument('--min-delta', type=float, default=0.005, help="ignore slowdowns smaller than this (seconds)")
+    parser.add_argument('--no-memory', action='store_true', help="skip the traced peak-memory runs")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.repeat, not args.no_memory)
+        return
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = {str(size): run_size(size, args.data_dir, args.repeat, not args.no_memory) for size in args.sizes}
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    regressions = compare(results, baseline, args.tolerance, args.min_delta)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({**baseline, **results}, file, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif regressions:
+        print(f"\n{len(regressions)} case(s) slower than the baseline by more than {args.tolerance:.0%}")
+        raise SystemExit(1)
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+from data import DATASET_PATH, get_data_version, load_accidents, loaded_version
+from query import aggregate, get_backend
+
+
+# Columns whose distinct values feed the dashboard dropdowns
+CATEGORY_COLUMNS = ['Country', 'City', 'Location', 'Weather Condition', 'Road Condition', 'Cause']
+
+# Cache of catalogs keyed by path -> catalog dict
+_catalog_cache = {}
+
+
+
+
+def build_catalog(accidents_df, version=None):
+
+    """
+    Compute the filter metadata of the accidents dataset in a single pass.
+
+    Args:
+
+    accidents_df : pandas.DataFrame
+        The preprocessed DataFrame returned by `data_preprocess`.
+
+    version : str, optional
+        The data version the catalog was computed from.
+
+    Returns:
+
+    catalog : dict
+        A dictionary holding:
+        - 'version': the data version,
+        - 'date_min' / 'date_max': the date bounds of the dataset,
+        - 'domains': for each categorical column, a list of (value, count) pairs sorted by value,
+        - 'hierarchy': a nested {Country: {City: [Location, ...]}} mapping.
+
+    Notes
+    -----
+    - The catalog is read-only; it is rebuilt only when the data version changes.
+    """
+
+    domains = {}
+    for column in CATEGORY_COLUMNS:
+        counts = accidents_df[column].value_counts().sort_index()
+        domains[column] = list(zip(counts.index.tolist(), counts.values.tolist()))
+
+    hierarchy = {}
+    locations = accidents_df[['Country', 'City', 'Location']].drop_duplicates()
+    for country, city, location in sorted(locations.itertuples(index=False, name=None)):
+        hierarchy.setdefault(country, {}).setdefault(city, []).append(location)
+
+    return {
+        'version': version,
+        'date_min': accidents_df['Date'].min(),
+        'date_max': accidents_df['Date'].max(),
+        'domains': domains,
+        'hierarchy': hierarchy,
+    }
+
+
+
+
+def build_catalog_from_queries(version=None):
+
+    """
+    Compute the same catalog as `build_catalog` through `query.aggregate`, without
+    loading the dataset in memory (for the out-of-core 'parquet' query backend).
+    """
+
+    domains = {}
+    for column in CATEGORY_COLUMNS:
+        counts = aggregate([column])
+        domains[column] = list(zip(counts[column].tolist(), counts['Count'].tolist()))
+
+    hierarchy = {}
+    locations = aggregate(['Country', 'City', 'Location'])
+    for country, city, location in zip(locations['Country'], locations['City'], locations['Location']):
+        hierarchy.setdefault(country, {}).setdefault(city, []).append(location)
+
+    dates = aggregate(['Date'])['Date']
+
+    return {
+        'version': version,
+        'date_min': dates.min(),
+        'date_max': dates.max(),
+        'domains': domains,
+        'hierarchy': hierarchy,
+    }
+
+
+
+
+def get_catalog(path=DATASET_PATH):
+
+    """
+    Return the metadata catalog of the dataset, computing it once per data version.
+    """
+
+    if get_backend() == 'parquet':
+        version = get_data_version(path)
+        catalog = _catalog_cache.get(path)
+        if catalog is None or catalog['version'] != version:
+            catalog = _catalog_cache[path] = build_catalog_from_queries(version)
+        return catalog
+
+    accidents_df = load_accidents(path)
+    version = loaded_version(path)
+
+    catalog = _catalog_cache.get(path)
+    if catalog is None or catalog['version'] != version:
+        catalog = build_catalog(accidents_df, version)
+        _catalog_cache[path] = catalog
+
+    return catalog
+
+
+
+
+def dropdown_options(column, path=DATASET_PATH):
+
+    """
+    Build sorted dropdown options ({'label', 'value'} dicts) for a categorical column.
+    """
+
+    return [{'label': value, 'value': value} for value, _ in get_catalog(path)['domains'][column]]
+
+
+
+
+def cities_for_country(country, path=DATASET_PATH):
+
+    """
+    List the cities recorded for a country, or an empty list for an unknown country.
+    """
+
+    return list(get_catalog(path)['hierarchy'].get(country, {}))
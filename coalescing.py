@@ -0,0 +1,193 @@
+import json
+import uuid
+import inspect
+import threading
+import functools
+import contextvars
+from collections import OrderedDict
+
+from dash import dcc
+from dash.exceptions import PreventUpdate
+
+from metrics import count_event
+
+
+# Store holding the id of a browser tab, so that its superseded requests can be recognized
+TAB_ID = 'tab-id'
+
+# Most (tab, callback) sequence numbers remembered; the oldest tabs are forgotten first
+MAX_TRACKED = 10_000
+
+# Computations in flight: key -> _Flight
+_flights = {}
+_flights_lock = threading.Lock()
+
+# Latest request number per (tab, callback)
+_latest = OrderedDict()
+_latest_lock = threading.Lock()
+
+# (tab, callback, request number) of the callback running in the current context
+_current_ticket = contextvars.ContextVar('current_ticket', default=None)
+
+
+
+
+class _Flight:
+
+    """
+    One shared computation: the first caller runs it, the others wait for its outcome.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+
+
+def _call_key(name, args, kwargs):
+    # Arguments of Dash callbacks are JSON values, so their JSON text identifies the call
+    return name, json.dumps([args, kwargs], sort_keys=True, default=repr)
+
+
+
+
+def shared(function):
+
+    """
+    Decorator making concurrent identical calls of `function` share one computation.
+
+    The first call runs the function; calls with the same arguments arriving while it
+    runs wait for it and receive the same result (or exception). Nothing is cached
+    once the computation completes, so the function must return values the callers
+    only read.
+
+    Notes
+    -----
+    - A computation dropped with PreventUpdate because its own request was superseded
+      (see `latest_only`) is not shared: the waiting calls run the function themselves.
+    """
+
+    name = f'{function.__module__}.{function.__qualname__}'
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        key = _call_key(name, args, kwargs)
+
+        while True:
+            with _flights_lock:
+                flight = _flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _flights[key] = _Flight()
+
+            if leader:
+                try:
+                    flight.result = function(*args, **kwargs)
+                    return flight.result
+                except BaseException as error:
+                    flight.error = error
+                    raise
+                finally:
+                    with _flights_lock:
+                        del _flights[key]
+                    flight.done.set()
+
+            flight.done.wait()
+            count_event(function.__name__, 'shared')
+            if isinstance(flight.error, PreventUpdate):
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+    return wrapper
+
+
+
+
+def tab_store():
+    # The tab's id, drawn anew with every page load (the app layout is served by a function)
+    return dcc.Store(id=TAB_ID, storage_type='memory', data=uuid.uuid4().hex)
+
+
+
+
+def current_tab():
+    # Tab of the running `latest_only` callback (None outside one, or when called directly)
+    ticket = _current_ticket.get()
+    return ticket[0] if ticket is not None else None
+
+
+
+
+def checkpoint():
+
+    """
+    Drop the running callback if its request has been superseded.
+
+    Raises PreventUpdate when a newer request for the same callback arrived from the
+    same tab; does nothing outside a `latest_only` callback.
+    """
+
+    ticket = _current_ticket.get()
+    if ticket is None:
+        return
+
+    tab, name, number = ticket
+    with _latest_lock:
+        latest = _latest.get((tab, name), number)
+    if latest != number:
+        count_event(name, 'superseded')
+        raise PreventUpdate
+
+
+
+
+def latest_only(function):
+
+    """
+    Decorator dropping the superseded requests of a Dash callback.
+
+    Each request of a browser tab gets an increasing number per callback. The callback
+    checks at its start, at every `checkpoint()` and before returning whether a newer
+    request arrived meanwhile (e.g. while a slider is being dragged) and, if so, stops
+    with PreventUpdate: the tab only displays the latest response anyway.
+
+    Notes
+    -----
+    - The callback declares `State(TAB_ID, 'data')` as its last dependency. The tab id
+      is taken off the arguments, so the function (and `shared`) never sees it.
+    - Called without the tab id (direct calls, benchmarks) the callback always runs.
+    """
+
+    name = function.__name__
+    parameters = [parameter for parameter in inspect.signature(function).parameters.values()
+                  if parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)]
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if len(args) <= len(parameters):
+            return function(*args, **kwargs)
+        *args, tab = args
+        if tab is None:
+            return function(*args, **kwargs)
+
+        with _latest_lock:
+            number = _latest.get((tab, name), 0) + 1
+            _latest[(tab, name)] = number
+            _latest.move_to_end((tab, name))
+            while len(_latest) > MAX_TRACKED:
+                _latest.popitem(last=False)
+
+        token = _current_ticket.set((tab, name, number))
+        try:
+            checkpoint()
+            result = function(*args, **kwargs)
+            checkpoint()
+            return result
+        finally:
+            _current_ticket.reset(token)
+
+    return wrapper
@@ -0,0 +1,153 @@
+import os
+import gzip
+import logging
+import threading
+
+from flask import request, g
+
+from metrics import count_event
+
+
+# Compression is on by default; INCIDENTLYTICS_COMPRESSION=0 turns it off
+COMPRESSION_ENABLED = os.environ.get('INCIDENTLYTICS_COMPRESSION', '1') != '0'
+
+# Responses smaller than this (bytes) are sent as they are: compressing them saves nothing
+COMPRESS_MIN_BYTES = int(os.environ.get('INCIDENTLYTICS_COMPRESS_MIN_BYTES', '1024'))
+
+# Callback responses larger than this (bytes, before compression) are logged; 0 disables the check
+PAYLOAD_BUDGET_BYTES = int(os.environ.get('INCIDENTLYTICS_PAYLOAD_BUDGET_BYTES', str(1024 * 1024)))
+
+# Compression levels: fast settings, since most responses are compressed once per request
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+# Types worth compressing (figures and layouts are JSON, the Dash bundles JavaScript)
+COMPRESSIBLE_TYPES = ['application/json', 'text/html', 'text/css', 'text/plain', 'application/javascript', 'text/javascript']
+
+# Dash's component bundles never change for a given URL, so their compressed bodies are kept
+STATIC_PREFIX = '/_dash-component-suites/'
+
+# Compressed static bodies: (path, query string, encoding) -> bytes
+_static_cache = {}
+_static_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+
+
+def available_encodings():
+    # Brotli when the package is installed, then gzip, in order of preference
+    try:
+        import brotli
+        return ['br', 'gzip']
+    except ImportError:
+        return ['gzip']
+
+
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+
+
+def _choose_encoding(accept_encoding):
+    for encoding in available_encodings():
+        if accept_encoding[encoding]:
+            return encoding
+    return None
+
+
+
+
+def _compressed_body(data, encoding):
+    if not request.path.startswith(STATIC_PREFIX):
+        return compress(data, encoding)
+
+    key = (request.path, request.query_string, encoding)
+    body = _static_cache.get(key)
+    if body is None:
+        body = compress(data, encoding)
+        with _static_lock:
+            _static_cache[key] = body
+    return body
+
+
+
+
+def check_payload_budget(size):
+
+    """
+    Log a warning when a Dash callback response exceeds `PAYLOAD_BUDGET_BYTES`.
+
+    The warning names the callback, the output it updates and the inputs that
+    triggered it, with the time spent in each phase when the callback is
+    instrumented. Overruns are also counted in `/metrics` as the 'over_budget' event.
+    """
+
+    if PAYLOAD_BUDGET_BYTES <= 0 or size <= PAYLOAD_BUDGET_BYTES or not request.path.endswith('/_dash-update-component'):
+        return
+
+    payload = request.get_json(silent=True) or {}
+    trace = f"output {payload.get('output')}, triggered by {', '.join(payload.get('changedPropIds') or []) or 'the initial call'}"
+    callback_metrics = g.get('callback_metrics')
+    if callback_metrics is not None:
+        name, wall, _, phases, _ = callback_metrics
+        timings = ', '.join(f'{phase_name} {seconds * 1000:.0f} ms' for phase_name, seconds in phases.items())
+        trace += f"; ran {wall * 1000:.0f} ms ({timings or 'no phases'})"
+    else:
+        name = payload.get('output', '?')
+
+    count_event(name, 'over_budget')
+    logger.warning("Callback %s returned %s bytes, over the %s-byte payload budget: %s",
+                   name, f'{size:,}', f'{PAYLOAD_BUDGET_BYTES:,}', trace)
+
+
+
+
+def init_compression(server):
+
+    """
+    Compress the responses of the Flask server with brotli or gzip, and check the size
+    of the Dash callback responses against the payload budget.
+
+    Responses of a compressible type and at least `COMPRESS_MIN_BYTES` long are
+    compressed with the client's preferred encoding among `available_encodings()`.
+
+    Notes
+    -----
+    - Call it before `init_metrics`: Flask runs the after_request hooks in reverse
+      order, so the compression runs last and the metrics see the uncompressed size.
+    - Streamed responses (the `/export` downloads) are sent as they are.
+    - Compressed responses get weak ETags; the API matches them with weak comparison.
+    """
+
+    @server.after_request
+    def compress_response(response):
+        if response.direct_passthrough or response.is_streamed or response.status_code != 200:
+            return response
+
+        data = response.get_data()
+        check_payload_budget(len(data))
+
+        if (not COMPRESSION_ENABLED or len(data) < COMPRESS_MIN_BYTES or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = _choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        response.set_data(_compressed_body(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        # The compressed body is another representation: a strong ETag would claim byte equality
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
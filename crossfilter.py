@@ -0,0 +1,340 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from data import DATASET_PATH, get_data_version, load_accidents
+from profiling import stage
+from metrics import phase
+
+
+# Dimensions the Home charts filter each other on
+DIMENSIONS = ['Date', 'Country', 'Location', 'Weather Condition', 'Road Condition']
+
+# Filters: the sidebar's (date range, countries, weather) and the charts' selections (clicked values).
+# Each filter is one bit of a row's mask, set while the row fails it.
+FILTERS = {
+    'date': 'Date',
+    'countries': 'Country',
+    'weather': 'Weather Condition',
+    'selected Country': 'Country',
+    'selected Location': 'Location',
+    'selected Weather Condition': 'Weather Condition',
+    'selected Road Condition': 'Road Condition',
+}
+
+# Groups: name -> (grouping dimensions, the filters it ignores, i.e. the selections made on its own chart)
+GROUPS = {
+    'Country': (['Country'], ['selected Country']),
+    'Location': (['Location'], ['selected Location']),
+    'Weather x Road': (['Weather Condition', 'Road Condition'], ['selected Weather Condition', 'selected Road Condition']),
+}
+
+# Most browser tabs whose filter state is kept (each holds one byte per incident); the oldest go first
+MAX_TABS = 32
+
+# Built indexes keyed by path -> (data version, CrossfilterIndex)
+_index_cache = {}
+_index_lock = threading.Lock()
+
+# Data version whose index a background build was started for, keyed by path
+_warming = {}
+_warming_lock = threading.Lock()
+
+# Filter states keyed by tab id -> Crossfilter
+_tabs = OrderedDict()
+_tabs_lock = threading.Lock()
+
+
+
+
+class CrossfilterIndex:
+
+    """
+    The incidents' codes on every dimension, with each dimension's rows grouped by code.
+
+    Built once per data version and shared by every tab's `Crossfilter`.
+
+    Args:
+
+    columns : dict
+        Dimension -> (codes, values): the code of every incident and the value of
+        every code. Date codes are consecutive days from the first date.
+    """
+
+    def __init__(self, columns):
+        self.codes = {dimension: codes for dimension, (codes, _) in columns.items()}
+        self.values = {dimension: values for dimension, (_, values) in columns.items()}
+        self.n_rows = len(self.codes['Date'])
+
+        # Rows of code c of a dimension: order[offsets[c]:offsets[c + 1]]
+        self.order, self.offsets = {}, {}
+        for dimension, codes in self.codes.items():
+            self.order[dimension] = np.argsort(codes, kind='stable').astype(np.int32)
+            self.offsets[dimension] = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(self.values[dimension])))])
+
+        # Group key of every incident, and the counts of the unfiltered incidents
+        self.keys, self.totals = {}, {}
+        for group, (dimensions, _) in GROUPS.items():
+            key = np.zeros(self.n_rows, dtype=np.int64)
+            for dimension in dimensions:
+                key = key * len(self.values[dimension]) + self.codes[dimension]
+            self.keys[group] = key
+            self.totals[group] = np.bincount(key, minlength=int(np.prod([len(self.values[dimension]) for dimension in dimensions])))
+
+    def rows(self, dimension, codes):
+        # Rows having one of `codes` on a dimension; runs of consecutive codes are one slice each
+        order, offsets = self.order[dimension], self.offsets[dimension]
+        if len(codes) == 0:
+            return order[:0]
+        breaks = np.flatnonzero(np.diff(codes) != 1) + 1
+        starts, ends = codes[np.concatenate([[0], breaks])], codes[np.concatenate([breaks - 1, [len(codes) - 1]])]
+        return np.concatenate([order[offsets[start]:offsets[end + 1]] for start, end in zip(starts, ends)])
+
+    def passing(self, name, value):
+        # Codes of the filter's dimension that pass it (a date range, or a list of selected values)
+        import pandas as pd
+
+        dimension = FILTERS[name]
+        values = self.values[dimension]
+        if not value:
+            return np.ones(len(values), dtype=bool)
+        if dimension == 'Date':
+            start, end = value
+            keep = np.ones(len(values), dtype=bool)
+            if start:
+                keep &= values >= pd.Timestamp(start)
+            if end:
+                keep &= values <= pd.Timestamp(end)
+            return keep
+        return np.isin(values, list(value))
+
+
+
+
+class Crossfilter:
+
+    """
+    One browser tab's filters over a `CrossfilterIndex`, with the counts of every group
+    maintained incrementally.
+
+    Every incident keeps a bit mask of the filters it fails. When a filter changes,
+    only the incidents of the codes entering or leaving it are visited: their bit is
+    flipped, and each group's counts gain the incidents that now pass all the filters
+    it does not ignore and lose those that no longer do. A group ignores the
+    selections made on its own chart, so the clicked chart keeps showing every choice.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.mask = np.zeros(index.n_rows, dtype=np.uint8)
+        self.bits = {name: np.uint8(1 << position) for position, name in enumerate(FILTERS)}
+        self.passing = {name: np.ones(len(index.values[dimension]), dtype=bool) for name, dimension in FILTERS.items()}
+        self.group_totals = {group: totals.copy() for group, totals in index.totals.items()}
+        self.ignored = {group: np.uint8(sum(int(self.bits[name]) for name in ignored)) for group, (_, ignored) in GROUPS.items()}
+        self._lock = threading.Lock()
+
+    def _set_filter(self, name, passing):
+        # Visit the incidents of the codes whose pass status changes, and move them between the groups
+        changed = np.flatnonzero(passing != self.passing[name])
+        if len(changed) == 0:
+            return
+        self.passing[name] = passing
+
+        rows = self.index.rows(FILTERS[name], changed)
+        bit = self.bits[name]
+        old = self.mask[rows]
+        new = old ^ bit
+        self.mask[rows] = new
+
+        for group, ignored in self.ignored.items():
+            if bit & ignored:
+                continue
+            considered = np.uint8(~ignored)
+            was, now = (old & considered) == 0, (new & considered) == 0
+            key, size = self.index.keys[group], len(self.group_totals[group])
+            self.group_totals[group] += np.bincount(key[rows[now & ~was]], minlength=size)
+            self.group_totals[group] -= np.bincount(key[rows[was & ~now]], minlength=size)
+
+    def _update(self, filters):
+        # Bring the filters to the given state (see `counts`)
+        for name in FILTERS:
+            self._set_filter(name, self.index.passing(name, filters.get(name)))
+
+    def _group(self, group, top=None):
+        # The non-empty counts of a group (see `counts`)
+        import pandas as pd
+
+        dimensions, _ = GROUPS[group]
+        counts = self.group_totals[group]
+
+        # Codes follow the sorted values, so ties of the ranking are broken by value
+        present = np.flatnonzero(counts)
+        if top is not None:
+            present = present[np.argsort(-counts[present], kind='stable')[:top]]
+
+        result = {}
+        sizes = [len(self.index.values[dimension]) for dimension in dimensions]
+        for dimension, codes in zip(dimensions, np.unravel_index(present, sizes)):
+            result[dimension] = self.index.values[dimension][codes]
+        result['Count'] = counts[present]
+        result = pd.DataFrame(result)
+        return result if top is not None else result.sort_values(dimensions, kind='stable').reset_index(drop=True)
+
+    def counts(self, filters, group, top=None):
+
+        """
+        Bring the filters to the given state and count the incidents of a group.
+
+        Args:
+
+        filters : dict
+            Filter name (from `FILTERS`) -> its value: a (start, end) date pair for
+            'date', a list of values for the others; missing or empty does not filter.
+
+        group : str
+            One of `GROUPS`.
+
+        top : int, optional
+            Keep the `top` largest counts.
+
+        Returns:
+
+        result : pandas.DataFrame
+            The group's dimensions and 'Count', without empty groups, sorted by the
+            dimensions or by decreasing count with `top`.
+
+        Notes
+        -----
+        - Both steps run under one hold of the lock, so another chart or request
+          applying other filters in between cannot change the counts read.
+        """
+
+        with self._lock:
+            with phase('filter'):
+                self._update(filters)
+            with phase('aggregate'):
+                return self._group(group, top)
+
+
+
+
+def build_crossfilter_index(path=DATASET_PATH):
+    # Codes of the dimensions: from the store's dictionaries with the 'parquet' backend, else factorized
+    import pandas as pd
+    from query import get_backend
+
+    if get_backend() == 'parquet':
+        from store import scan
+        table = scan(DIMENSIONS)
+        columns = {}
+        for dimension in DIMENSIONS[1:]:
+            chunk = table.column(dimension).combine_chunks()
+            # Renumber the dictionary in sorted order, like the factorized codes
+            dictionary = np.asarray(chunk.dictionary.to_pylist(), dtype=object)
+            order = np.argsort(dictionary)
+            rank = np.empty(len(order), dtype=np.int32)
+            rank[order] = np.arange(len(order), dtype=np.int32)
+            columns[dimension] = (rank[chunk.indices.to_numpy()], dictionary[order])
+        dates = table.column('Date').to_numpy()
+    else:
+        accidents_df = load_accidents(path)
+        columns = {}
+        for dimension in DIMENSIONS[1:]:
+            codes, values = pd.factorize(accidents_df[dimension], sort=True)
+            columns[dimension] = (codes.astype(np.int32), np.asarray(values, dtype=object))
+        dates = accidents_df['Date'].to_numpy()
+
+    days = dates.astype('datetime64[D]')
+    first = days.min()
+    day_codes = (days - first).astype(np.int32)
+    columns['Date'] = (day_codes, pd.DatetimeIndex(first + np.arange(day_codes.max() + 1)))
+    return CrossfilterIndex(columns)
+
+
+
+
+def get_crossfilter_index(path=DATASET_PATH):
+    # The index of the dataset, built once per data version
+    version = get_data_version(path)
+    cached = _index_cache.get(path)
+    if cached is None or cached[0] != version:
+        with _index_lock:
+            cached = _index_cache.get(path)
+            if cached is None or cached[0] != version:
+                with stage('crossfilter index build'):
+                    cached = _index_cache[path] = (version, build_crossfilter_index(path))
+    return cached[1]
+
+
+
+
+def warm_crossfilter_index(path=DATASET_PATH):
+    # Build the index in a background thread, once per data version however many layouts ask for it
+    version = get_data_version(path)
+    with _warming_lock:
+        cached = _index_cache.get(path)
+        if (cached is not None and cached[0] == version) or _warming.get(path) == version:
+            return
+        _warming[path] = version
+    threading.Thread(target=get_crossfilter_index, args=(path,), name='crossfilter-index', daemon=True).start()
+
+
+
+
+def get_crossfilter(tab):
+    # The tab's filter state, started unfiltered; a state over an outdated index is replaced
+    index = get_crossfilter_index()
+    with _tabs_lock:
+        crossfilter = _tabs.get(tab)
+        if crossfilter is None or crossfilter.index is not index:
+            crossfilter = _tabs[tab] = Crossfilter(index)
+        _tabs.move_to_end(tab)
+        while len(_tabs) > MAX_TABS:
+            _tabs.popitem(last=False)
+    return crossfilter
+
+
+
+
+def crossfilter_counts(group, start_date=None, end_date=None, countries=None, weather=None, selection=None, top=None):
+
+    """
+    Count the incidents of a Home chart's group under the sidebar filters and the
+    selections made on the other charts.
+
+    Args:
+
+    group : str
+        One of `GROUPS`: 'Country', 'Location' or 'Weather x Road'.
+
+    selection : dict, optional
+        Dimension -> the values clicked on the charts (see `GROUPS` for which chart
+        selects which dimensions).
+
+    Returns:
+
+    result : pandas.DataFrame
+        The group's dimensions and 'Count', like `query.aggregate`.
+
+    Notes
+    -----
+    - Each browser tab keeps its own filter state, so a click only moves the
+      incidents of the clicked value between the groups. The three Home charts
+      update the same state with the same filters: the first one applies the
+      change, the others find it applied.
+    - Outside a tab's request each call filters a fresh state, so unrelated callers
+      never move each other's counts.
+    """
+
+    from coalescing import current_tab
+
+    selection = selection or {}
+    filters = {'date': (start_date, end_date) if start_date or end_date else None, 'countries': countries, 'weather': weather}
+    for dimension in DIMENSIONS[1:]:
+        filters[f'selected {dimension}'] = selection.get(dimension)
+
+    # Without a tab (benchmarks, the API, scripts) every call starts from an unfiltered state of its own
+    tab = current_tab()
+    crossfilter = get_crossfilter(tab) if tab is not None else Crossfilter(get_crossfilter_index())
+    return crossfilter.counts(filters, group, top)
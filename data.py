@@ -1,4 +1,15 @@
-import pandas as pd 
+import os
+import threading
+
+from profiling import stage
+
+
+# Default location of the accidents dataset (INCIDENTLYTICS_DATASET points the dashboard at another file)
+DATASET_PATH = os.environ.get('INCIDENTLYTICS_DATASET', 'dataset/global_traffic_accidents.csv')
+
+# Cache of preprocessed frames keyed by path -> (data version, dataframe)
+_accidents_cache = {}
+_accidents_lock = threading.Lock()
 
 
 def determine_severity(row):
@@ -21,15 +32,71 @@ def get_time_segment(hour):
     else:
         return 'Night'
 
-def data_preprocess(path):
-    accidents_df = pd.read_csv('dataset/global_traffic_accidents.csv')
-    accidents_df['City'] = accidents_df['Location'].map(lambda x:x.split(',')[0].strip())
-    accidents_df['Country'] = accidents_df['Location'].map(lambda x:x.split(',')[1].strip())
-    accidents_df['Date'] = pd.to_datetime(accidents_df['Date'])
-    accidents_df['Year'] = accidents_df['Date'].dt.year 
-    accidents_df['Month_Num'] = accidents_df['Date'].dt.month       
-    accidents_df['Hour'] = pd.to_datetime(accidents_df['Time'], format='%H:%M').dt.hour
-    accidents_df['Time Segment'] = accidents_df['Hour'].apply(get_time_segment)
-    accidents_df['Severity'] = accidents_df.apply(determine_severity, axis=1)
+def preprocess_frame(accidents_df):
+    # Add the derived columns to a raw accidents frame (a whole file or one chunk of it).
+    # Location, Date and Time repeat a lot, so each distinct value is parsed once and
+    # broadcast back to the rows; the severity rules of determine_severity are vectorized
+    import numpy as np
+    import pandas as pd
+
+    location_codes, locations = pd.factorize(accidents_df['Location'])
+    accidents_df['City'] = pd.Index([x.split(',')[0].strip() for x in locations]).take(location_codes)
+    accidents_df['Country'] = pd.Index([x.split(',')[1].strip() for x in locations]).take(location_codes)
+
+    date_codes, dates = pd.factorize(accidents_df['Date'])
+    accidents_df['Date'] = pd.to_datetime(pd.Series(dates)).take(date_codes).to_numpy()
+    accidents_df['Year'] = accidents_df['Date'].dt.year
+    accidents_df['Month_Num'] = accidents_df['Date'].dt.month
+
+    time_codes, times = pd.factorize(accidents_df['Time'])
+    accidents_df['Hour'] = pd.to_datetime(pd.Series(times), format='%H:%M').dt.hour.take(time_codes).to_numpy()
+    accidents_df['Time Segment'] = np.array([get_time_segment(hour) for hour in range(24)])[accidents_df['Hour'].to_numpy()]
+
+    casualties, vehicles = accidents_df['Casualties'].to_numpy(), accidents_df['Vehicles Involved'].to_numpy()
+    severe = (casualties >= 6) | (vehicles >= 4)
+    moderate = (casualties >= 2) & (casualties <= 5) & (vehicles <= 3)
+    accidents_df['Severity'] = np.select([severe, moderate], ['Severe', 'Moderate'], 'Minor')
+
     accidents_df['YearMonth'] = accidents_df['Date'].dt.to_period('M')
-    return accidents_df
\ No newline at end of file
+    return accidents_df
+
+
+
+def data_preprocess(path):
+    # pandas is imported on first use to keep the worker's cold start light
+    import pandas as pd
+
+    return preprocess_frame(pd.read_csv(path))
+
+
+
+def get_data_version(path=DATASET_PATH):
+    # The version changes whenever the dataset file is replaced or rewritten
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+
+def load_accidents(path=DATASET_PATH):
+    # Preprocess the dataset once per data version and share it between pages
+    version = get_data_version(path)
+    cached = _accidents_cache.get(path)
+    if cached is None or cached[0] != version:
+        with _accidents_lock:
+            cached = _accidents_cache.get(path)
+            if cached is None or cached[0] != version:
+                from shared_dataset import SHARED_DATASET_ENABLED, map_dataset
+                if SHARED_DATASET_ENABLED:
+                    cached = (version, map_dataset(path))
+                else:
+                    with stage('data load'):
+                        cached = (version, data_preprocess(path))
+                _accidents_cache[path] = cached
+    return cached[1]
+
+
+
+def loaded_version(path=DATASET_PATH):
+    # Version of the frame currently held in memory (None if not loaded yet)
+    cached = _accidents_cache.get(path)
+    return cached[0] if cached else None
@@ -0,0 +1,252 @@
+import io
+
+from flask import Response, request, abort, stream_with_context
+
+from data import load_accidents
+from query import QUERY_COLUMNS, get_backend, aggregate
+
+
+# Output formats: name -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+# Columns of an exported incident (every preprocessed column but the YearMonth period, as in the store) and their dtypes
+EXPORT_DTYPES = {
+    'Accident ID': 'str', 'Date': 'datetime64[us]', 'Time': 'str', 'Location': 'str', 'Latitude': 'float64',
+    'Longitude': 'float64', 'Weather Condition': 'str', 'Road Condition': 'str', 'Vehicles Involved': 'int64',
+    'Casualties': 'int64', 'Cause': 'str', 'City': 'str', 'Country': 'str', 'Year': 'int32', 'Month_Num': 'int32',
+    'Hour': 'int32', 'Time Segment': 'str', 'Severity': 'str',
+}
+EXPORT_COLUMNS = list(EXPORT_DTYPES)
+
+# Numeric columns an aggregate export may sum
+SUM_COLUMNS = ['Casualties', 'Vehicles Involved']
+
+# Rows filtered and encoded at a time, which bounds the memory of an export
+EXPORT_CHUNK_ROWS = 64 * 1024
+
+
+
+
+def incident_chunks(columns, start_date=None, end_date=None, countries=None, weather=None, chunk_rows=EXPORT_CHUNK_ROWS):
+
+    """
+    Yield the incidents matching the dashboard filters as DataFrames of at most about
+    `chunk_rows` rows, without materializing the whole selection.
+
+    Notes
+    -----
+    - With the 'parquet' query backend the selected partitions and row groups of the
+      store are streamed batch by batch; the other backends filter the loaded frame
+      one slice at a time (the SQL engines only hold the query columns).
+    - Filters are the ones of `query.filter_accidents`.
+    - Only the dataset is exported: the live incidents received since it was written
+      (see `live`) are not.
+    """
+
+    if get_backend() == 'parquet':
+        from store import open_store, filter_expression
+
+        scanner = open_store().scanner(columns=list(columns), filter=filter_expression(start_date, end_date, countries, weather),
+                                       batch_size=chunk_rows)
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                chunk = batch.to_pandas()
+                for column in chunk.columns[chunk.dtypes == 'category']:
+                    chunk[column] = chunk[column].astype('str')
+                yield chunk
+        return
+
+    import numpy as np
+
+    accidents_df = load_accidents()
+    for first in range(0, len(accidents_df), chunk_rows):
+        chunk = accidents_df.iloc[first:first + chunk_rows]
+        matching = np.ones(len(chunk), dtype=bool)
+        if start_date:
+            matching &= (chunk['Date'] >= start_date).to_numpy()
+        if end_date:
+            matching &= (chunk['Date'] <= end_date).to_numpy()
+        if weather:
+            matching &= chunk['Weather Condition'].isin(weather).to_numpy()
+        if countries:
+            matching &= chunk['Country'].isin(countries).to_numpy()
+        chunk = chunk.loc[matching, list(columns)]
+        if len(chunk):
+            yield chunk
+
+
+
+
+def aggregate_chunks(by, start_date=None, end_date=None, countries=None, weather=None, sums=(), chunk_rows=EXPORT_CHUNK_ROWS):
+    # Aggregates are computed by `query.aggregate`, then sent in chunks like the incidents
+    result = aggregate(list(by), start_date, end_date, countries, weather, list(sums))
+    for first in range(0, len(result), chunk_rows):
+        yield result.iloc[first:first + chunk_rows]
+
+
+
+
+class _Sink(io.RawIOBase):
+
+    """
+    A write-only file whose written bytes are collected until taken, so a Parquet
+    writer's output can be streamed while the file is being written.
+    """
+
+    def __init__(self):
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+
+
+def encode(chunks, export_format, columns):
+
+    """
+    Encode DataFrame chunks into the bytes of a CSV, NDJSON or Parquet file, chunk by chunk.
+
+    Args:
+
+    chunks : iterable of pandas.DataFrame
+        The rows to encode, with the given `columns`.
+
+    export_format : str
+        One of `EXPORT_FORMATS`.
+
+    columns : list of str
+        The exported columns: `EXPORT_COLUMNS`, or the groups, 'Count' and sums of
+        an aggregate. They give the schema of a Parquet file without rows.
+
+    Notes
+    -----
+    - CSV gets its header with the first chunk; NDJSON has one JSON object per row, with
+      ISO dates. Parquet gets one row group per chunk, and its footer at the end.
+    - An empty selection gives an empty CSV or NDJSON file, and a Parquet file holding
+      only the schema.
+    """
+
+    if export_format == 'csv':
+        header = True
+        for chunk in chunks:
+            yield chunk.to_csv(index=False, header=header).encode()
+            header = False
+
+    elif export_format == 'ndjson':
+        for chunk in chunks:
+            yield chunk.to_json(orient='records', lines=True, date_format='iso', date_unit='s').encode()
+
+    else:
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        sink, writer = _Sink(), None
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(sink, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            yield sink.take()
+        if writer is None:
+            # No rows: the file still has the schema, from the columns' dtypes
+            empty = pd.DataFrame({column: pd.Series(dtype=EXPORT_DTYPES.get(column, 'int64')) for column in columns})
+            writer = pq.ParquetWriter(sink, pa.Table.from_pandas(empty, preserve_index=False).schema)
+        writer.close()
+        yield sink.take()
+
+
+
+
+def list_arg(name):
+    # Repeated (?country=A&country=B) or comma-separated (?country=A,B) values of a query argument
+    values = [value for argument in request.args.getlist(name) for value in argument.split(',') if value]
+    return values or None
+
+
+
+
+def date_arg(name):
+    # A date query argument, checked before any response starts (400 if it is not a date)
+    import pandas as pd
+
+    value = request.args.get(name) or None
+    if value is not None:
+        try:
+            pd.Timestamp(value)
+        except ValueError:
+            abort(400, f"{name} is not a date: {value}")
+    return value
+
+
+
+
+def request_filters():
+    # The Home filters given as query arguments, as keyword arguments of `query.aggregate`
+    return {
+        'start_date': date_arg('start_date'),
+        'end_date': date_arg('end_date'),
+        'countries': list_arg('country'),
+        'weather': list_arg('weather'),
+    }
+
+
+
+
+def init_export(server, path='/export'):
+
+    """
+    Install the export route on the Flask server.
+
+    GET /export?format=csv|ndjson|parquet streams the incidents matching the filters
+    (start_date, end_date, country, weather, as on the Home page), optionally restricted
+    to `columns`. With `by` it streams the counts per group instead, with the `sums`
+    of numeric columns. List arguments may be repeated or comma-separated:
+
+        /export?format=parquet&start_date=2024-01-01&country=Brazil,Canada
+        /export?by=Country&by=Severity&sums=Casualties
+    """
+
+    @server.route(path)
+    def export_endpoint():
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            abort(400, f"format must be one of {', '.join(EXPORT_FORMATS)}")
+
+        filters = request_filters()
+
+        by = list_arg('by')
+        if by:
+            sums = list_arg('sums') or []
+            unknown = [column for column in by if column not in QUERY_COLUMNS] + [column for column in sums if column not in SUM_COLUMNS]
+            if unknown:
+                abort(400, f"unknown columns: {', '.join(unknown)}")
+            chunks, name = aggregate_chunks(by, sums=sums, **filters), 'aggregates'
+            columns = [*by, 'Count', *sums]
+        else:
+            columns = list_arg('columns') or EXPORT_COLUMNS
+            unknown = [column for column in columns if column not in EXPORT_COLUMNS]
+            if unknown:
+                abort(400, f"unknown columns: {', '.join(unknown)}")
+            chunks, name = incident_chunks(columns, **filters), 'incidents'
+
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        return Response(
+            stream_with_context(encode(chunks, export_format, columns)),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename="{name}.{extension}"'},
+        )
@@ -0,0 +1,25 @@
+import os
+
+# Workers map the dataset the master publishes to shared memory (see shared_dataset.py)
+os.environ.setdefault('INCIDENTLYTICS_SHARED_DATASET', '1')
+
+bind = os.environ.get('INCIDENTLYTICS_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('WEB_CONCURRENCY', '4'))
+threads = int(os.environ.get('INCIDENTLYTICS_THREADS', '4'))
+
+# The master imports the app (which loads no data) so that what it loads before forking is shared
+preload_app = True
+
+
+
+
+def on_starting(server):
+    # Master, before forking: publish the dataset once, and load the models, which the
+    # workers then share copy-on-write instead of unpickling their own
+    from shared_dataset import ensure_published
+    from artifacts import load_artifact
+    from pages.page3_forecast import page_artifacts
+
+    ensure_published()
+    for name in page_artifacts:
+        load_artifact(name)
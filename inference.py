@@ -0,0 +1,179 @@
+import os
+import time
+import queue
+import threading
+
+from artifacts import load_artifact
+from metrics import record_batch, set_queue_depth
+
+
+# Longest time (milliseconds) a prediction waits for others to share its batch; 0 disables batching
+BATCH_DEADLINE_MS = float(os.environ.get('INCIDENTLYTICS_BATCH_DEADLINE_MS', '10'))
+
+# Most rows predicted in one call of the model
+MAX_BATCH_SIZE = 64
+
+# Running batchers keyed by model artifact name
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+
+
+class _Request:
+
+    """
+    One queued prediction: the caller waits on `done` for its `result` (or `error`).
+    """
+
+    def __init__(self, row):
+        self.row = row
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+
+
+class MicroBatcher:
+
+    """
+    A thread predicting the queued single-row requests of a model in micro-batches.
+
+    The thread takes the oldest request, then gathers the requests arriving within
+    `deadline` seconds of it (up to `max_batch_size`), predicts them with one call of
+    the model and hands every caller its own row's prediction.
+
+    Args:
+
+    model_name : str
+        The model artifact (see `artifacts.load_artifact`).
+
+    deadline : float
+        The longest time (seconds) the first request of a batch waits for others.
+
+    max_batch_size : int
+        The most rows predicted at once.
+    """
+
+    def __init__(self, model_name, deadline=BATCH_DEADLINE_MS / 1000, max_batch_size=MAX_BATCH_SIZE):
+        self.model_name = model_name
+        self.deadline = deadline
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f'batcher-{model_name}', daemon=True)
+        self._thread.start()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def predict(self, row):
+
+        """
+        Queue one single-row DataFrame and wait for its prediction.
+        """
+
+        request = _Request(row)
+        self._queue.put(request)
+        set_queue_depth(self.model_name, self._queue.qsize())
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _gather(self):
+        # Block for the first request, then take the others arriving before the deadline
+        batch = [self._queue.get()]
+        closes = time.perf_counter() + self.deadline
+        while len(batch) < self.max_batch_size:
+            remaining = closes - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        set_queue_depth(self.model_name, self._queue.qsize())
+        return batch
+
+    def _run(self):
+        import pandas as pd
+
+        while True:
+            batch = self._gather()
+            start = time.perf_counter()
+            try:
+                model = load_artifact(self.model_name)
+                try:
+                    predictions = model.predict(pd.concat([request.row for request in batch], ignore_index=True))
+                    for request, prediction in zip(batch, predictions):
+                        request.result = prediction
+                except Exception:
+                    # One bad row fails the whole call: predict the rows one by one, so that
+                    # only its own caller gets the error
+                    for request in batch:
+                        try:
+                            request.result = model.predict(request.row)[0]
+                        except Exception as error:
+                            request.error = error
+            except Exception as error:
+                for request in batch:
+                    request.error = error
+            finally:
+                record_batch(self.model_name, len(batch), start - batch[0].enqueued, time.perf_counter() - start)
+                for request in batch:
+                    request.done.set()
+
+
+
+
+def numeric_row(row):
+
+    """
+    Return a single-row DataFrame of model features with numeric dtypes.
+
+    Raises ValueError naming the columns whose value is missing or not a number, so
+    that a bad input fails its own prediction before it is batched with others.
+    """
+
+    import pandas as pd
+    from pandas.api.types import is_numeric_dtype
+
+    # Columns already numeric (the usual case) are only checked for missing values
+    numeric = row if all(is_numeric_dtype(dtype) for dtype in row.dtypes) else row.apply(pd.to_numeric, errors='coerce')
+    missing = numeric.isna().any()
+    if missing.any():
+        raise ValueError(f"Not a number: {', '.join(map(str, missing.index[missing]))}")
+    return numeric
+
+
+
+
+def predict(model_name, row):
+
+    """
+    Predict one single-row DataFrame with the model `model_name`.
+
+    Concurrent predictions of the same model are gathered into micro-batches by a
+    `MicroBatcher` thread started on first use; with INCIDENTLYTICS_BATCH_DEADLINE_MS=0
+    the model is called directly.
+
+    Notes
+    -----
+    - Each process has its own batcher: background jobs (see `jobs.py`) run in their
+      own processes, so their predictions are not batched together.
+    - The row is checked by `numeric_row` before it is queued; should a batch still
+      fail, its rows are predicted again one by one.
+    """
+
+    row = numeric_row(row)
+    if BATCH_DEADLINE_MS <= 0:
+        return load_artifact(model_name).predict(row)[0]
+
+    # A batcher inherited through a fork has lost its thread and is replaced
+    batcher = _batchers.get(model_name)
+    if batcher is None or not batcher.is_alive():
+        with _batchers_lock:
+            batcher = _batchers.get(model_name)
+            if batcher is None or not batcher.is_alive():
+                batcher = _batchers[model_name] = MicroBatcher(model_name)
+    return batcher.predict(row)
@@ -0,0 +1,125 @@
+import os
+import inspect
+import warnings
+import tempfile
+import functools
+
+from dash import callback, State
+
+from coalescing import TAB_ID, shared, latest_only
+
+
+# Forecast-page jobs run in background processes when INCIDENTLYTICS_BACKGROUND_JOBS=1
+BACKGROUND_JOBS = os.environ.get('INCIDENTLYTICS_BACKGROUND_JOBS', '0') == '1'
+
+# Where job progress and results are exchanged between the web worker and the job processes
+JOBS_CACHE_DIR = os.environ.get('INCIDENTLYTICS_JOBS_CACHE', os.path.join(tempfile.gettempdir(), 'incidentlytics-jobs'))
+
+# How often (milliseconds) the browser polls a running job for progress and its result
+POLL_INTERVAL_MS = 250
+
+# Seconds an unread job result is kept before it is evicted
+RESULT_EXPIRE_S = 600
+
+_job_manager = None
+
+
+
+
+def get_job_manager():
+
+    """
+    Return the Dash background callback manager shared by every job, or None
+    when jobs run synchronously in the web worker (jobs disabled, or the
+    `dash[diskcache]` extras are not installed).
+    """
+
+    global _job_manager
+
+    if _job_manager is None and BACKGROUND_JOBS:
+        try:
+            import diskcache
+            from dash import DiskcacheManager
+            _job_manager = DiskcacheManager(diskcache.Cache(JOBS_CACHE_DIR), expire=RESULT_EXPIRE_S)
+        except ImportError:
+            warnings.warn('Background jobs need `pip install "dash[diskcache]"`; running them in the web worker instead')
+
+    return _job_manager
+
+
+
+
+def _ignore_progress(*values):
+    pass
+
+
+
+
+def job_callback(*dependencies, progress=None, progress_default=None, cancel=None, coalesce=False, **kwargs):
+
+    """
+    Register a Dash callback that runs as a background job when jobs are enabled.
+
+    Args:
+
+    dependencies : Output, Input, State
+        The callback's dependencies, as for `dash.callback`.
+
+    progress : list of Output, optional
+        Outputs updated while the job runs through its `set_progress` argument.
+
+    progress_default : list, optional
+        Values of the `progress` outputs when no job is running.
+
+    cancel : list of Input, optional
+        Inputs whose change terminates a running job.
+
+    coalesce : bool, optional
+        When the callback runs in the web worker, drop its superseded requests
+        (`latest_only`) and share identical concurrent ones (`shared`), keyed on
+        the callback's own arguments only.
+
+    kwargs :
+        Other `dash.callback` options (`running`, `prevent_initial_call`, ...),
+        which apply in both modes.
+
+    Notes
+    -----
+    - The decorated function always receives a `set_progress` function as its first argument;
+      it does nothing when the callback runs synchronously or is called directly.
+    - In background mode the browser cancels the previous job of a callback when the
+      callback fires again, so only the latest slider position keeps computing.
+    - Jobs run in a forked process: the dataset and models already loaded by the web
+      worker are shared, but their /metrics statistics stay in the job process.
+    - `coalesce` does nothing in background mode: a job runs in its own process, where the
+      supersession and sharing tables of the web worker are not seen, and the browser
+      already cancels the previous job instead.
+    """
+
+    def decorator(function):
+        manager = get_job_manager()
+
+        @functools.wraps(function)
+        def run_without_progress(*args):
+            return function(_ignore_progress, *args)
+
+        # Without `set_progress`, so that latest_only counts the callback's own arguments
+        parameters = list(inspect.signature(function).parameters.values())[1:]
+        run_without_progress.__signature__ = inspect.Signature(parameters)
+
+        if manager is not None and progress is not None:
+            callback(*dependencies, background=True, manager=manager, interval=POLL_INTERVAL_MS,
+                     progress=progress, progress_default=progress_default, cancel=cancel, **kwargs)(function)
+        elif manager is not None:
+            callback(*dependencies, background=True, manager=manager, interval=POLL_INTERVAL_MS,
+                     cancel=cancel, **kwargs)(run_without_progress)
+        elif coalesce:
+            # The tab id comes last, where latest_only takes it off the arguments
+            callback(*dependencies, State(TAB_ID, 'data'), **kwargs)(latest_only(shared(run_without_progress)))
+        else:
+            callback(*dependencies, **kwargs)(run_without_progress)
+
+        # Direct calls (benchmarks, scripts) take the callback's own arguments
+        return run_without_progress
+
+    return decorator
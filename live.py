@@ -0,0 +1,413 @@
+import os
+import time
+import logging
+import threading
+
+from data import DATASET_PATH, get_data_version, preprocess_frame
+from metrics import phase
+
+
+# Live mode: incidents written to LIVE_DIR after the dataset are pushed to the open pages
+LIVE_ENABLED = os.environ.get('INCIDENTLYTICS_LIVE', '0') == '1'
+
+# Watched directory: every CSV file written there (same columns as the dataset) is one batch of new incidents
+LIVE_DIR = os.environ.get('INCIDENTLYTICS_LIVE_DIR', 'dataset/live')
+
+# How often (milliseconds) the open pages ask for new incidents
+LIVE_INTERVAL_MS = int(os.environ.get('INCIDENTLYTICS_LIVE_INTERVAL_MS', '5000'))
+
+# Least time (seconds) between two scans of the watched directory
+SCAN_INTERVAL_S = 1.0
+
+# Feeds keyed by path -> (data version, LiveFeed)
+_feed_cache = {}
+_feed_lock = threading.Lock()
+
+# Serializes the catching up of the shared indexes with the feed
+_catch_up_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+
+
+class LiveFeed:
+
+    """
+    The incidents received since the dataset was written, as numbered batches.
+
+    Batches are numbered from 1 in the order they are received; a page remembers the
+    number of the last batch its figures show, and asks for the following ones.
+    Consecutive batches are merged into runs of 1, 2, 4... batches, so the incidents
+    of any batches are sliced from a few frames however many batches were received.
+
+    Args:
+
+    path : str
+        The dataset the incidents add to. Files of the watched directory older than
+        it are taken as already merged into it.
+
+    Notes
+    -----
+    - Every process scans the watched directory itself and reads its files in the
+      order they were written, so the gunicorn workers and the background job
+      processes number the same batches the same way.
+    - Writers should create a file under another name (or starting with '.') and
+      rename it once complete, so a scan never reads a partial file.
+    - The incidents are kept until the dataset is written again, which starts a new feed.
+    """
+
+    def __init__(self, path=DATASET_PATH):
+        self.path = path
+        self.since = os.stat(path).st_mtime_ns
+        self.sequence = 0
+        # Runs of consecutive batches: (number of the first batch, row offsets of the batches, rows)
+        self._runs = []
+        # The last incidents returned by `rows`: (after, upto, rows)
+        self._last_rows = None
+        self._read = set()
+        self._scanned = None
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+
+    def append(self, incidents):
+        # Number a preprocessed batch; the rows are only read from then on
+        import pandas as pd
+
+        with self._lock:
+            self.sequence += 1
+            self._runs.append((self.sequence, [0, len(incidents)], incidents))
+            # Merge the last two runs while they hold as many batches, as a binary counter carries
+            while len(self._runs) > 1 and len(self._runs[-2][1]) == len(self._runs[-1][1]):
+                (first, offsets, frame), (_, more, other) = self._runs[-2:]
+                offsets = offsets + [offsets[-1] + offset for offset in more[1:]]
+                self._runs[-2:] = [(first, offsets, pd.concat([frame, other], ignore_index=True))]
+            return self.sequence
+
+    def scan(self):
+        # Read the files written to LIVE_DIR since the last scan, at most once every SCAN_INTERVAL_S;
+        # callers arriving during a scan go on with the batches already received
+        import pandas as pd
+
+        now = time.monotonic()
+        if self._scanned is not None and now - self._scanned < SCAN_INTERVAL_S:
+            return
+        if not self._scan_lock.acquire(blocking=False):
+            return
+        try:
+            self._scanned = now
+            if not os.path.isdir(LIVE_DIR):
+                return
+            files = sorted((entry.stat().st_mtime_ns, entry.name) for entry in os.scandir(LIVE_DIR)
+                           if entry.is_file() and entry.name.endswith('.csv') and not entry.name.startswith('.'))
+            for mtime, name in files:
+                if mtime <= self.since or name in self._read:
+                    continue
+                self._read.add(name)
+                try:
+                    batch = preprocess_frame(pd.read_csv(os.path.join(LIVE_DIR, name)))
+                except Exception:
+                    logger.exception("Skipping the unreadable live file %s", name)
+                    continue
+                self.append(batch)
+        finally:
+            self._scan_lock.release()
+
+    def rows(self, after=0, upto=None):
+
+        """
+        Return the incidents of the batches numbered after `after` and up to `upto`
+        (the last batch received by default), or None when there are none.
+        """
+
+        import pandas as pd
+
+        with self._lock:
+            runs = list(self._runs)
+            upto = self.sequence if upto is None else min(upto, self.sequence)
+            last_rows = self._last_rows
+        if last_rows is not None and last_rows[:2] == (after, upto):
+            return last_rows[2]
+
+        pieces = []
+        for first, offsets, frame in runs:
+            last = first + len(offsets) - 2
+            if last > after and first <= upto:
+                start = offsets[max(after + 1 - first, 0)]
+                end = offsets[min(upto, last) - first + 1]
+                pieces.append(frame.iloc[start:end])
+        if not pieces:
+            return None
+
+        # The pages redraw with the same batches until new ones arrive, so the last rows are kept
+        incidents = pd.concat(pieces, ignore_index=True) if len(pieces) > 1 else pieces[0].reset_index(drop=True)
+        with self._lock:
+            self._last_rows = (after, upto, incidents)
+        return incidents
+
+
+
+
+def get_feed(path=DATASET_PATH):
+    # The feed of the dataset, started anew with every data version
+    version = get_data_version(path)
+    cached = _feed_cache.get(path)
+    if cached is None or cached[0] != version:
+        with _feed_lock:
+            cached = _feed_cache.get(path)
+            if cached is None or cached[0] != version:
+                cached = _feed_cache[path] = (version, LiveFeed(path))
+    return cached[1]
+
+
+
+
+def live_sequence():
+    # Number of the last batch received (0 without live mode), after a scan of the watched directory
+    if not LIVE_ENABLED:
+        return 0
+    feed = get_feed()
+    feed.scan()
+    return feed.sequence
+
+
+
+
+def submit(incidents):
+
+    """
+    Add new incidents from within the process (e.g. a consumer thread of a message queue).
+
+    Args:
+
+    incidents : pandas.DataFrame
+        Raw rows with the columns of the dataset; they are preprocessed here.
+
+    Returns:
+
+    sequence : int
+        The number of the batch.
+
+    Notes
+    -----
+    - Only the pages served by this process see the batch: with several workers,
+      write the incidents to the watched directory instead.
+    """
+
+    return get_feed().append(preprocess_frame(incidents.copy()))
+
+
+
+
+def live_end(end_date):
+    # In live mode, a date range ending on the dataset's last day (the default) follows the live incidents
+    import pandas as pd
+    from catalog import get_catalog
+
+    if LIVE_ENABLED and end_date and pd.Timestamp(end_date) >= pd.Timestamp(get_catalog()['date_max']):
+        return None
+    return end_date
+
+
+
+
+def live_aggregate(by, start_date=None, end_date=None, countries=None, weather=None, sums=(), after=0, upto=None):
+
+    """
+    Count the live incidents of batches `after` (excluded) to `upto` matching the
+    dashboard filters, grouped by `by`.
+
+    Same arguments and result as `query.aggregate`, over the live incidents only;
+    pass the end of the date range through `live_end` to keep the newest ones.
+    """
+
+    import pandas as pd
+
+    incidents = get_feed().rows(after, upto) if LIVE_ENABLED else None
+    if incidents is None:
+        return pd.DataFrame(columns=[*by, 'Count', *sums])
+
+    with phase('aggregate'):
+        keep = pd.Series(True, index=incidents.index)
+        if start_date:
+            keep &= incidents['Date'] >= pd.Timestamp(start_date)
+        if end_date:
+            keep &= incidents['Date'] <= pd.Timestamp(end_date)
+        if countries:
+            keep &= incidents['Country'].isin(countries)
+        if weather:
+            keep &= incidents['Weather Condition'].isin(weather)
+
+        grouped = incidents[keep].groupby(by, observed=True)
+        result = grouped.size().rename('Count').to_frame()
+        for column in sums:
+            result[column] = grouped[column].sum()
+        return result.reset_index()
+
+
+
+
+def merge_counts(result, counts, by, sums=()):
+
+    """
+    Add grouped counts (e.g. of live incidents) to an aggregate with the same groups.
+
+    Args:
+
+    result : pandas.DataFrame
+        A result of `query.aggregate` or `approx.estimate`; its error columns are
+        kept, the added counts being exact.
+
+    counts : pandas.DataFrame
+        The counts to add: the columns `by`, 'Count' and `sums`.
+
+    Returns:
+
+    result : pandas.DataFrame
+        The merged groups, sorted by `by`.
+    """
+
+    import pandas as pd
+
+    if counts.empty:
+        return result
+
+    with phase('aggregate'):
+        columns = ['Count', *sums]
+        merged = pd.concat([result, counts], ignore_index=True)
+        merged = merged.groupby(by, observed=True, sort=True)[[*columns, *result.columns.difference([*by, *columns])]].sum()
+        return merged.reset_index().astype({column: result[column].dtype for column in columns})
+
+
+
+
+def add_live(result, by, start_date=None, end_date=None, countries=None, weather=None, sums=(), upto=None):
+    # Add the live incidents of batches 1 to `upto` to an aggregate of the dataset with the same arguments
+    return merge_counts(result, live_aggregate(by, start_date, end_date, countries, weather, sums, upto=upto), by, sums)
+
+
+
+
+def catch_up(index):
+    # Count into a shared index (a `topk.TopKIndex`) the live incidents it has not counted yet
+    if not LIVE_ENABLED:
+        return
+    feed = get_feed()
+    with _catch_up_lock:
+        if index.live_sequence < feed.sequence:
+            sequence = feed.sequence
+            index.add(feed.rows(index.live_sequence, sequence))
+            index.live_sequence = sequence
+
+
+
+
+def series_state(x, sequence, errors=False):
+
+    """
+    Describe a figure trace drawn over consecutive periods (days or months), so that
+    `extend_series` can later add the live incidents to it.
+
+    The state travels with the page in a `dcc.Store`: the batch number the trace
+    shows, its first and last periods, and whether it carries error bars.
+    """
+
+    return {
+        'sequence': sequence,
+        'first': x[0].isoformat() if len(x) else None,
+        'last': x[-1].isoformat() if len(x) else None,
+        'errors': errors,
+    }
+
+
+
+
+def extend_series(patch, shown, points, freq, sequence):
+
+    """
+    Add values to the first trace of a figure without resending it.
+
+    Args:
+
+    patch : dash.Patch
+        The patch of the figure; its first trace must hold its x and y values as lists.
+
+    shown : dict
+        The trace's state from `series_state`.
+
+    points : pandas.Series
+        The values to add, indexed by the start of their period.
+
+    freq : str
+        The trace's period: 'D' (days) or 'MS' (months).
+
+    sequence : int
+        The batch the trace shows once patched.
+
+    Returns:
+
+    shown : dict
+        The new state of the trace.
+
+    Notes
+    -----
+    - Values of periods already drawn are added in place; later periods are
+      appended, with zeros for the periods in between. Periods before the trace
+      (incidents older than the chart) appear at its next redraw.
+    """
+
+    import pandas as pd
+
+    if shown['first'] is None or points.empty:
+        return {**shown, 'sequence': sequence}
+
+    trace = patch['data'][0]
+    first, last = pd.Timestamp(shown['first']), pd.Timestamp(shown['last'])
+    drawn = pd.date_range(first, last, freq=freq)
+
+    inside = points[(points.index >= first) & (points.index <= last)]
+    for position, value in zip(drawn.get_indexer(inside.index), inside.tolist()):
+        trace['y'][int(position)] += value
+
+    later = points[points.index > last]
+    if not later.empty:
+        appended = pd.date_range(last, later.index.max(), freq=freq)[1:]
+        trace['x'].extend([when.isoformat() for when in appended])
+        trace['y'].extend(later.reindex(appended, fill_value=0).tolist())
+        if shown['errors']:
+            trace['error_y']['array'].extend([0] * len(appended))
+        last = appended[-1]
+
+    return {**shown, 'sequence': sequence, 'last': last.isoformat()}
+
+
+
+
+def extendable(figure, *names):
+
+    """
+    Make properties of a figure's first trace (e.g. 'y', 'error_y.array') patchable in place.
+
+    Plotly sends numeric arrays packed as binary, which a `dash.Patch` can replace
+    but not add to or extend; these are sent as JSON lists instead.
+    """
+
+    import numpy as np
+
+    trace = figure.data[0]
+    for name in names:
+        values = trace[name]
+        if values is not None:
+            # Assigning equal values would keep the packed array
+            trace[name] = None
+            trace[name] = np.asarray(values).tolist()
+    return figure
+
+
+
+
+def live_interval(component_id):
+    # The timer of a page's live updates (never firing without live mode)
+    from dash import dcc
+
+    return dcc.Interval(id=component_id, interval=LIVE_INTERVAL_MS, disabled=not LIVE_ENABLED)
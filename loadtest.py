@@ -0,0 +1,498 @@
+import json
+import time
+import uuid
+import random
+import argparse
+import datetime
+import threading
+import http.client
+from http.cookies import SimpleCookie
+import multiprocessing
+from urllib.parse import urlsplit, quote
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Session scenarios a virtual user can replay
+SCENARIOS = ['home', 'trends', 'forecast', 'assessment']
+
+# Route each scenario's session runs on
+SCENARIO_PATHS = {'home': '/', 'trends': '/trends', 'forecast': '/TimeSeries', 'assessment': '/TimeSeries'}
+
+# Components present on each route; a callback only fires when its outputs are on the page
+PAGE_COMPONENTS = {
+    '/': {'main-layout', 'date-picker', 'country-dropdown', 'weather-dropdown', 'choropleth-map', 'density-map', 'bar-chart', 'heat-chart', 'export-link',
+          'crossfilter-selection', 'crossfilter-summary', 'choropleth-live', 'bar-live', 'heat-live'},
+    '/trends': {'main-layout', 'time-series', 'time-series-live', 'env-boxplot', 'env-title', 'monthly-trend-graph', 'temporal-heatmap'},
+    '/TimeSeries': {'main-layout', 'main-content-container', 'main-forecast-graph', 'forecast-card-title', 'forecast-live',
+                    'city-dropdown', 'prediction-output', 'date-picker', 'country-dropdown', 'weather-dropdown'},
+}
+
+# Browsers send at most this many callback requests at once to the same host
+BROWSER_CONNECTIONS = 6
+
+# Seconds between the requests of a burst (a slider or date range being dragged)
+BURST_INTERVAL = 0.05
+
+# Chained callback rounds followed after a user action (outputs feeding other callbacks)
+MAX_CHAIN_ROUNDS = 3
+
+# Road conditions of the dataset, clicked on the Home heatmap
+ROAD_CONDITIONS = ['Dry', 'Wet', 'Icy', 'Snowy', 'Gravel', 'Under Construction']
+
+# Initial value of every component property the callbacks read
+DEFAULT_PROPS = {
+    'page-url.pathname': '/',
+    'date-picker.start_date': None,
+    'date-picker.end_date': None,
+    'date-picker.date': None,
+    'country-dropdown.value': None,
+    'weather-dropdown.value': None,
+    'approx-toggle.value': False,
+    'trends-approx-toggle.value': False,
+    'density-map.relayoutData': None,
+    'choropleth-map.clickData': None,
+    'bar-chart.clickData': None,
+    'heat-chart.clickData': None,
+    'crossfilter-reset.n_clicks': None,
+    'crossfilter-selection.data': {},
+    'clear-filters-btn.n_clicks': None,
+    'date-range.start_date': None,
+    'date-range.end_date': None,
+    'env-dropdown.value': 'Weather Condition',
+    'metric-selector.value': 'Casualties',
+    'temporal-rows.value': 'Weekday',
+    'temporal-metric.value': 'Count',
+    'model-dropdown.value': 'assess_accident',
+    'month-slider.value': 0,
+    'submit-assess-btn.n_clicks': 0,
+    'city-dropdown.value': None,
+    'lat-input.value': 12,
+    'long-input.value': 12,
+    'vehicles-input.value': 2,
+    'road-dropdown.value': None,
+    'cause-dropdown.value': None,
+    'hour-input.value': '08:30',
+}
+
+
+
+
+class DashClient:
+
+    """
+    Minimal client for the Dash callback endpoint of a running dashboard.
+
+    Keeps one HTTP connection per thread and builds `_dash-update-component`
+    payloads from the app's own callback graph (`_dash-dependencies`), the
+    same way the browser does.
+    """
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.local = threading.local()
+        self.cookies = {}
+        self.dependencies = self.request('GET', '/_dash-dependencies')[1]
+
+    def request(self, method, path, body=None):
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload else {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        for attempt in range(2):
+            connection = getattr(self.local, 'connection', None)
+            if connection is None:
+                connection = self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=120)
+            try:
+                connection.request(method, self.prefix + path, payload, headers)
+                response = connection.getresponse()
+                data = response.read()
+                for header in response.headers.get_all('Set-Cookie') or []:
+                    self.cookies.update({name: morsel.value for name, morsel in SimpleCookie(header).items()})
+                return response.status, json.loads(data) if data and response.status == 200 else None
+            except (http.client.HTTPException, OSError):
+                # Stale keep-alive connection: reconnect once
+                connection.close()
+                self.local.connection = None
+                if attempt:
+                    raise
+
+    def callbacks_for(self, prop_ids, pathname):
+        # Callbacks fired when any of `prop_ids` changes on the page at `pathname`
+        on_page = PAGE_COMPONENTS.get(pathname, set())
+        fired = []
+        for cb in self.dependencies:
+            inputs = {f"{item['id']}.{item['property']}" for item in cb['inputs']}
+            outputs = {prop_id.rsplit('.', 1)[0] for prop_id in output_prop_ids(cb)}
+            if inputs & set(prop_ids) and outputs <= on_page:
+                fired.append(cb)
+        return fired
+
+    def fire(self, callback, props, changed):
+        # POST one callback with the session's current property values
+        outputs = [{'id': prop_id.rsplit('.', 1)[0], 'property': prop_id.rsplit('.', 1)[1]}
+                   for prop_id in output_prop_ids(callback)]
+
+        def values(items):
+            return [{'id': item['id'], 'property': item['property'],
+                     'value': props.get(f"{item['id']}.{item['property']}")} for item in items]
+
+        body = {
+            'output': callback['output'],
+            'outputs': outputs if callback['output'].startswith('..') else outputs[0],
+            'inputs': values(callback['inputs']),
+            'state': values(callback['state']),
+            'changedPropIds': [prop_id for prop_id in changed
+                               if any(f"{item['id']}.{item['property']}" == prop_id for item in callback['inputs'])],
+        }
+        start = time.perf_counter()
+        status, data = self.request('POST', '/_dash-update-component', body)
+
+        # Background callbacks answer with a job handle; poll it until the result is ready
+        while status == 200 and data and 'cacheKey' in data and 'response' not in data:
+            time.sleep(callback.get('background', {}).get('interval', 1000) / 1000)
+            query = f"?cacheKey={quote(data['cacheKey'])}&job={quote(str(data['job']))}"
+            if 'endId' in data:
+                query += f"&endId={quote(data['endId'])}"
+            status, polled = self.request('POST', '/_dash-update-component' + query, body)
+            data = {**data, **(polled or {})} if status == 200 else polled
+        return status, time.perf_counter() - start, data
+
+
+
+
+def output_prop_ids(callback):
+    # "component-id.property" of each output (multi-output callbacks are "..a.b...c.d..")
+    output = callback['output']
+    return output[2:-2].split('...') if output.startswith('..') else [output]
+
+
+
+
+def callback_name(callback):
+    # Readable name of a callback: its outputs without the allow_duplicate hashes
+    return '+'.join(prop_id.split('@')[0] for prop_id in output_prop_ids(callback))
+
+
+
+
+def session_steps(scenario, rng, start_date, end_date, countries, weather):
+
+    """
+    Build the property changes one session of `scenario` makes after opening its page.
+
+    Each step is a dict of {"component-id.property": new value}, or a list of such
+    dicts for a burst of changes sent without waiting for the responses (dragging).
+    """
+
+    days = max((end_date - start_date).days, 2)
+
+    def day(offset):
+        return (start_date + datetime.timedelta(days=offset)).strftime('%Y-%m-%d')
+
+    steps = []
+
+    if scenario == 'home':
+        # Dragging the date range fires a burst of changes on its end date
+        first = rng.randrange(days // 2)
+        steps.append({'date-picker.start_date': day(first)})
+        steps.append([{'date-picker.end_date': day(offset)}
+                      for offset in sorted(rng.sample(range(first + 1, days + 1), min(8, days - first)))])
+        # Dropdown churn
+        for _ in range(rng.randint(2, 5)):
+            steps.append({'country-dropdown.value': rng.sample(countries, rng.randint(1, min(3, len(countries))))})
+            steps.append({'weather-dropdown.value': rng.sample(weather, rng.randint(1, min(2, len(weather))))})
+        steps.append({'country-dropdown.value': None, 'weather-dropdown.value': None})
+        # Linked charts: click a country, a weather x road cell, then clear the selection
+        for _ in range(rng.randint(1, 3)):
+            steps.append({'choropleth-map.clickData': {'points': [{'location': rng.choice(countries)}]}})
+            steps.append({'heat-chart.clickData': {'points': [{'x': rng.choice(weather), 'y': rng.choice(ROAD_CONDITIONS)}]}})
+        steps.append({'crossfilter-reset.n_clicks': 1})
+
+    elif scenario == 'trends':
+        for _ in range(rng.randint(2, 4)):
+            steps.append({'metric-selector.value': rng.choice(['Casualties', 'Vehicles Involved'])})
+            steps.append({'env-dropdown.value': rng.choice(['Weather Condition', 'Road Condition', 'Cause'])})
+            steps.append({'temporal-rows.value': rng.choice(['Weekday', 'Month']), 'temporal-metric.value': rng.choice(['Count', 'Casualties'])})
+        first = rng.randrange(days // 2)
+        steps.append({'date-range.start_date': day(first)})
+        steps.append([{'date-range.end_date': day(offset)}
+                      for offset in sorted(rng.sample(range(first + 1, days + 1), min(5, days - first)), reverse=True)])
+
+    elif scenario == 'forecast':
+        for model in rng.sample(['forecast_casualties', 'forecast_accidents'], 2):
+            steps.append({'model-dropdown.value': model, 'month-slider.value': 0})
+            # Slider sweep, one request per mark crossed
+            steps.append([{'month-slider.value': months} for months in range(1, rng.randint(6, 12) + 1)])
+
+    elif scenario == 'assessment':
+        steps.append({'model-dropdown.value': 'assess_accident'})
+        for clicks in range(1, rng.randint(2, 5) + 1):
+            steps.append({'country-dropdown.value': rng.choice(countries)})
+            steps.append({
+                'vehicles-input.value': rng.randint(1, 5),
+                'lat-input.value': round(rng.uniform(-90, 90), 2),
+                'long-input.value': round(rng.uniform(-180, 180), 2),
+                'weather-dropdown.value': rng.choice(weather),
+                'date-picker.date': day(rng.randrange(days)),
+                'hour-input.value': f"{rng.randrange(24):02d}:{rng.randrange(60):02d}",
+                'submit-assess-btn.n_clicks': clicks,
+            })
+
+    else:
+        raise ValueError(f"Unknown scenario '{scenario}'")
+
+    return steps
+
+
+
+
+def apply_step(client, executor, props, step, results):
+
+    """
+    Apply one user action: fire every callback it triggers, concurrently like the
+    browser, then follow the callbacks triggered by their outputs.
+    """
+
+    props.update(step)
+    changed = list(step)
+    pathname = props['page-url.pathname']
+
+    for _ in range(MAX_CHAIN_ROUNDS):
+        callbacks = client.callbacks_for(changed, pathname)
+        futures = [(cb, executor.submit(client.fire, cb, props, changed)) for cb in callbacks]
+
+        changed = []
+        for cb, future in futures:
+            try:
+                status, latency, data = future.result()
+            except OSError:
+                results.append((callback_name(cb), None, 0))
+                continue
+            results.append((callback_name(cb), latency, status))
+
+            # Outputs that the session keeps (filters, date bounds, options)
+            for component_id, component_props in ((data or {}).get('response') or {}).items():
+                for prop, value in component_props.items():
+                    prop_id = f'{component_id}.{prop}'
+                    if prop_id in DEFAULT_PROPS or prop == 'options':
+                        if props.get(prop_id) != value:
+                            props[prop_id] = value
+                            changed.append(prop_id)
+        if not changed:
+            break
+
+
+
+
+def apply_burst(client, executor, props, steps, results):
+
+    """
+    Apply a burst of changes (a drag): every change fires its callbacks right away,
+    without waiting for the responses of the previous ones.
+    """
+
+    pending = []
+    for step in steps[:-1]:
+        props.update(step)
+        for cb in client.callbacks_for(list(step), props['page-url.pathname']):
+            pending.append((cb, executor.submit(client.fire, cb, dict(props), list(step))))
+        time.sleep(BURST_INTERVAL)
+
+    apply_step(client, executor, props, steps[-1], results)
+
+    for cb, future in pending:
+        try:
+            status, latency, _ = future.result()
+        except OSError:
+            results.append((callback_name(cb), None, 0))
+            continue
+        results.append((callback_name(cb), latency, status))
+
+
+
+
+def run_virtual_user(base_url, scenarios, duration, think_time, seed):
+
+    """
+    Replay random sessions against the dashboard for `duration` seconds.
+
+    Returns a list of (callback name, latency seconds or None, HTTP status).
+    """
+
+    client = DashClient(base_url)
+    rng = random.Random(seed)
+    deadline = time.time() + duration
+    results = []
+
+    with ThreadPoolExecutor(BROWSER_CONNECTIONS) as executor:
+        while time.time() < deadline:
+            scenario = rng.choice(scenarios)
+            # Every virtual user is a fresh browser tab with its own id
+            props = {**DEFAULT_PROPS, 'tab-id.data': uuid.uuid4().hex}
+
+            # Open the page; the Home filters bring back the date bounds and options
+            apply_step(client, executor, props, {'page-url.pathname': SCENARIO_PATHS[scenario]}, results)
+            if scenario == 'trends' or not props.get('date-picker.start_date'):
+                apply_step(client, executor, props, {'page-url.pathname': '/'}, [])
+                props['page-url.pathname'] = SCENARIO_PATHS[scenario]
+
+            start_date = datetime.datetime.fromisoformat(str(props['date-picker.start_date'])[:10])
+            end_date = datetime.datetime.fromisoformat(str(props['date-picker.end_date'])[:10])
+            countries = [option['value'] for option in props.get('country-dropdown.options') or []] or ['USA']
+            weather = [option['value'] for option in props.get('weather-dropdown.options') or []] or ['Clear']
+
+            if scenario == 'trends':
+                # The Trends charts render with the full date range when the page opens
+                apply_step(client, executor, props, {
+                    'date-range.start_date': start_date.strftime('%Y-%m-%d'),
+                    'date-range.end_date': end_date.strftime('%Y-%m-%d'),
+                    'env-dropdown.value': DEFAULT_PROPS['env-dropdown.value'],
+                    'metric-selector.value': DEFAULT_PROPS['metric-selector.value'],
+                    'temporal-rows.value': DEFAULT_PROPS['temporal-rows.value'],
+                    'temporal-metric.value': DEFAULT_PROPS['temporal-metric.value'],
+                }, results)
+            elif scenario in ('forecast', 'assessment'):
+                apply_step(client, executor, props, {'model-dropdown.value': DEFAULT_PROPS['model-dropdown.value']}, results)
+
+            for step in session_steps(scenario, rng, start_date, end_date, countries, weather):
+                if time.time() >= deadline:
+                    break
+                if think_time > 0:
+                    time.sleep(rng.expovariate(1 / think_time))
+                if isinstance(step, list):
+                    apply_burst(client, executor, props, step, results)
+                else:
+                    apply_step(client, executor, props, step, results)
+
+    return results
+
+
+
+
+def _run_process(args):
+    # Worker process: run its share of virtual users as threads
+    base_url, scenarios, duration, think_time, seeds = args
+    with ThreadPoolExecutor(len(seeds)) as executor:
+        futures = [executor.submit(run_virtual_user, base_url, scenarios, duration, think_time, seed) for seed in seeds]
+        return [result for future in futures for result in future.result()]
+
+
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+
+
+def summarize(results, elapsed):
+
+    """
+    Aggregate raw results into per-callback latency percentiles and throughput.
+
+    Returns a dict: callback name -> {requests, errors, rps, p50_ms, p95_ms, p99_ms, max_ms}.
+    """
+
+    by_callback = {}
+    for name, latency, status in results:
+        by_callback.setdefault(name, []).append((latency, status))
+    by_callback['(all)'] = [(latency, status) for _, latency, status in results]
+
+    summary = {}
+    for name, samples in by_callback.items():
+        latencies = sorted(latency for latency, status in samples if latency is not None and status in (200, 204))
+        summary[name] = {
+            'requests': len(samples),
+            'errors': sum(1 for latency, status in samples if status not in (200, 204)),
+            'rps': len(samples) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': latencies[-1] * 1000 if latencies else float('nan'),
+        }
+    return summary
+
+
+
+
+def run_load_test(base_url, users=10, processes=2, duration=60, think_time=0.5, scenarios=None, seed=0):
+
+    """
+    Run `users` concurrent virtual users spread over `processes` worker processes.
+
+    Args:
+
+    base_url : str
+        Root URL of the running dashboard (e.g. 'http://127.0.0.1:8050').
+
+    users : int
+        Total number of concurrent virtual users.
+
+    processes : int
+        Number of load-generator processes (keeps the client side from being the bottleneck).
+
+    duration : float
+        Test length in seconds.
+
+    think_time : float
+        Mean pause (seconds) between two user actions; 0 for back-to-back requests.
+
+    scenarios : list of str, optional
+        Scenarios to replay (default: all of `SCENARIOS`).
+
+    seed : int
+        Base random seed; each virtual user gets its own derived seed.
+
+    Returns:
+
+    summary : dict
+        Per-callback statistics, see `summarize`.
+    """
+
+    scenarios = scenarios or SCENARIOS
+    processes = max(1, min(processes, users))
+    seeds = [[seed * 100_003 + user for user in range(users) if user % processes == worker] for worker in range(processes)]
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        chunks = pool.map(_run_process, [(base_url, scenarios, duration, think_time, worker_seeds) for worker_seeds in seeds])
+    elapsed = time.perf_counter() - start
+
+    return summarize([result for chunk in chunks for result in chunk], elapsed)
+
+
+
+
+def print_summary(summary):
+    print(f"{'callback':<60} {'requests':>8} {'errors':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, stats in sorted(summary.items(), key=lambda item: (item[0] == '(all)', item[0])):
+        print(f"{name[:60]:<60} {stats['requests']:>8} {stats['errors']:>6} {stats['rps']:>7.1f} "
+              f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['max_ms']:>8.1f}")
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay realistic dashboard sessions against a running app.")
+    parser.add_argument('--url', default='http://127.0.0.1:8050', help="root URL of the running dashboard")
+    parser.add_argument('--users', type=int, default=10, help="concurrent virtual users")
+    parser.add_argument('--processes', type=int, default=2, help="load-generator processes")
+    parser.add_argument('--duration', type=float, default=60, help="test length in seconds")
+    parser.add_argument('--think-time', type=float, default=0.5, help="mean pause between user actions (seconds)")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="comma-separated scenarios to replay")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    parser.add_argument('--json', help="also write the summary to this file")
+    args = parser.parse_args()
+
+    summary = run_load_test(args.url, args.users, args.processes, args.duration, args.think_time,
+                            args.scenarios.split(','), args.seed)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(summary, file, indent=2)
@@ -0,0 +1,15 @@
+import fcntl
+from contextlib import contextmanager
+
+
+
+
+@contextmanager
+def file_lock(lock_path):
+    # Exclusive lock across processes: one process builds or publishes while the others wait
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
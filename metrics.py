@@ -0,0 +1,342 @@
+import os
+import time
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context
+from dash.exceptions import PreventUpdate
+
+
+# Instrumentation is on by default; INCIDENTLYTICS_METRICS=0 turns it off
+METRICS_ENABLED = os.environ.get('INCIDENTLYTICS_METRICS', '1') != '0'
+
+# Upper bounds (seconds) of the callback latency histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Phases of a callback, in the order they usually run
+PHASES = ['filter', 'aggregate', 'figure', 'serialize']
+
+# Per-callback statistics: name -> dict of counters
+_callback_stats = {}
+_stats_lock = threading.Lock()
+
+# Per-callback event counters: (name, event) -> count
+_event_counts = {}
+
+# Upper bounds of the inference batch size histogram buckets
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64]
+
+# Per-model micro-batching statistics: model -> dict of counters
+_batch_stats = {}
+
+# Phase durations of the callback running in the current context
+_current_phases = contextvars.ContextVar('current_phases', default=None)
+
+
+
+
+def _new_stats():
+    return {
+        'count': 0,
+        'errors': 0,
+        'wall_seconds': 0.0,
+        'cpu_seconds': 0.0,
+        'response_bytes': 0,
+        'responses': 0,
+        'buckets': [0] * len(LATENCY_BUCKETS),
+        'phases': dict.fromkeys(PHASES, 0.0),
+    }
+
+
+
+
+def _new_batch_stats():
+    return {
+        'batches': 0,
+        'predictions': 0,
+        'wait_seconds': 0.0,
+        'seconds': 0.0,
+        'queue_depth': 0,
+        'buckets': [0] * len(BATCH_SIZE_BUCKETS),
+    }
+
+
+
+
+def record(name, wall, cpu, phases=None, response_bytes=None, error=False):
+
+    """
+    Add one callback run to the statistics of `name`.
+
+    Args:
+
+    name : str
+        The callback name (its function name).
+
+    wall, cpu : float
+        The wall-clock and CPU time (seconds) of the run.
+
+    phases : dict, optional
+        Seconds spent per phase ('filter', 'aggregate', 'figure', 'serialize', ...).
+
+    response_bytes : int, optional
+        The size of the response payload sent back to the browser.
+
+    error : bool
+        Whether the callback raised.
+    """
+
+    with _stats_lock:
+        stats = _callback_stats.get(name)
+        if stats is None:
+            stats = _callback_stats[name] = _new_stats()
+
+        stats['count'] += 1
+        stats['errors'] += int(error)
+        stats['wall_seconds'] += wall
+        stats['cpu_seconds'] += cpu
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if wall <= bound:
+                stats['buckets'][index] += 1
+        for phase_name, seconds in (phases or {}).items():
+            stats['phases'][phase_name] = stats['phases'].get(phase_name, 0.0) + seconds
+        if response_bytes is not None:
+            stats['response_bytes'] += response_bytes
+            stats['responses'] += 1
+
+
+
+
+def count_event(name, event):
+
+    """
+    Count one `event` (e.g. 'shared', 'superseded') of the callback `name`.
+    """
+
+    with _stats_lock:
+        _event_counts[(name, event)] = _event_counts.get((name, event), 0) + 1
+
+
+
+
+def record_batch(model, size, wait, seconds):
+
+    """
+    Add one micro-batch of `size` predictions of `model` to the statistics.
+
+    `wait` is the time its oldest request spent queued and `seconds` the model call.
+    """
+
+    with _stats_lock:
+        stats = _batch_stats.get(model)
+        if stats is None:
+            stats = _batch_stats[model] = _new_batch_stats()
+        stats['batches'] += 1
+        stats['predictions'] += size
+        stats['wait_seconds'] += wait
+        stats['seconds'] += seconds
+        for index, bound in enumerate(BATCH_SIZE_BUCKETS):
+            if size <= bound:
+                stats['buckets'][index] += 1
+
+
+
+
+def set_queue_depth(model, depth):
+
+    """
+    Record the number of predictions of `model` waiting for a batch.
+    """
+
+    with _stats_lock:
+        stats = _batch_stats.get(model)
+        if stats is None:
+            stats = _batch_stats[model] = _new_batch_stats()
+        stats['queue_depth'] = depth
+
+
+
+
+@contextmanager
+def phase(name):
+
+    """
+    Time a phase ('filter', 'aggregate', 'figure', ...) of the instrumented callback
+    running in the current context. Outside an instrumented callback it does nothing.
+    """
+
+    phases = _current_phases.get()
+    if phases is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+
+
+
+def instrument(function):
+
+    """
+    Decorator recording the wall time, CPU time and phases of a Dash callback.
+
+    Place it under `@callback` so that Dash registers the instrumented function.
+    Inside a Flask request the measurements are completed (response size and
+    serialize phase) by the hooks installed with `init_metrics`.
+    """
+
+    if not METRICS_ENABLED:
+        return function
+
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        phases = {}
+        token = _current_phases.set(phases)
+        error = False
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            return function(*args, **kwargs)
+        except PreventUpdate:
+            # Not an error: the callback chose not to update its outputs
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start
+            _current_phases.reset(token)
+
+            if has_request_context():
+                # Finished in the after_request hook, once the response is serialized
+                g.callback_metrics = (name, wall, cpu, phases, error)
+            else:
+                record(name, wall, cpu, phases, error=error)
+
+    return wrapper
+
+
+
+
+def render_prometheus():
+
+    """
+    Render the callback statistics in the Prometheus text exposition format.
+    """
+
+    with _stats_lock:
+        snapshot = {name: {**stats, 'buckets': list(stats['buckets']), 'phases': dict(stats['phases'])}
+                    for name, stats in _callback_stats.items()}
+        events = dict(_event_counts)
+        batches = {model: {**stats, 'buckets': list(stats['buckets'])} for model, stats in _batch_stats.items()}
+
+    lines = [
+        '# HELP incidentlytics_callback_seconds Wall-clock time spent in each Dash callback.',
+        '# TYPE incidentlytics_callback_seconds histogram',
+    ]
+    for name, stats in sorted(snapshot.items()):
+        for bound, count in zip(LATENCY_BUCKETS, stats['buckets']):
+            lines.append(f'incidentlytics_callback_seconds_bucket{{callback="{name}",le="{bound}"}} {count}')
+        lines.append(f'incidentlytics_callback_seconds_bucket{{callback="{name}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'incidentlytics_callback_seconds_sum{{callback="{name}"}} {stats["wall_seconds"]:.6f}')
+        lines.append(f'incidentlytics_callback_seconds_count{{callback="{name}"}} {stats["count"]}')
+
+    counters = [
+        ('incidentlytics_callback_cpu_seconds_total', 'CPU time spent in each Dash callback.', 'cpu_seconds', '.6f'),
+        ('incidentlytics_callback_errors_total', 'Dash callback runs that raised an exception.', 'errors', 'd'),
+        ('incidentlytics_callback_response_bytes_total', 'Bytes of callback responses sent to the browser.', 'response_bytes', 'd'),
+        ('incidentlytics_callback_responses_total', 'Callback responses whose size was measured.', 'responses', 'd'),
+    ]
+    for metric, help_text, key, number_format in counters:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} counter')
+        for name, stats in sorted(snapshot.items()):
+            lines.append(f'{metric}{{callback="{name}"}} {stats[key]:{number_format}}')
+
+    lines.append('# HELP incidentlytics_callback_phase_seconds_total Wall-clock time spent per callback phase.')
+    lines.append('# TYPE incidentlytics_callback_phase_seconds_total counter')
+    for name, stats in sorted(snapshot.items()):
+        for phase_name, seconds in sorted(stats['phases'].items()):
+            lines.append(f'incidentlytics_callback_phase_seconds_total{{callback="{name}",phase="{phase_name}"}} {seconds:.6f}')
+
+    lines.append('# HELP incidentlytics_callback_events_total Callback events (shared computations, superseded requests).')
+    lines.append('# TYPE incidentlytics_callback_events_total counter')
+    for (name, event), count in sorted(events.items()):
+        lines.append(f'incidentlytics_callback_events_total{{callback="{name}",event="{event}"}} {count}')
+
+    lines.append('# HELP incidentlytics_inference_batch_size Predictions per micro-batch of each model.')
+    lines.append('# TYPE incidentlytics_inference_batch_size histogram')
+    for model, stats in sorted(batches.items()):
+        for bound, count in zip(BATCH_SIZE_BUCKETS, stats['buckets']):
+            lines.append(f'incidentlytics_inference_batch_size_bucket{{model="{model}",le="{bound}"}} {count}')
+        lines.append(f'incidentlytics_inference_batch_size_bucket{{model="{model}",le="+Inf"}} {stats["batches"]}')
+        lines.append(f'incidentlytics_inference_batch_size_sum{{model="{model}"}} {stats["predictions"]}')
+        lines.append(f'incidentlytics_inference_batch_size_count{{model="{model}"}} {stats["batches"]}')
+
+    lines.append('# HELP incidentlytics_inference_queue_depth Predictions waiting for a micro-batch.')
+    lines.append('# TYPE incidentlytics_inference_queue_depth gauge')
+    for model, stats in sorted(batches.items()):
+        lines.append(f'incidentlytics_inference_queue_depth{{model="{model}"}} {stats["queue_depth"]}')
+
+    inference_counters = [
+        ('incidentlytics_inference_wait_seconds_total', 'Time the oldest request of each batch spent queued.', 'wait_seconds'),
+        ('incidentlytics_inference_seconds_total', 'Time spent in batched model calls.', 'seconds'),
+    ]
+    for metric, help_text, key in inference_counters:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} counter')
+        for model, stats in sorted(batches.items()):
+            lines.append(f'{metric}{{model="{model}"}} {stats[key]:.6f}')
+
+    return '\n'.join(lines) + '\n'
+
+
+
+
+def init_metrics(server, path='/metrics'):
+
+    """
+    Install the metrics route and the per-request hooks on the Flask server.
+
+    Every Dash callback response gets a `Server-Timing` header with its
+    phases, and its size and serialization time are added to the statistics.
+    """
+
+    @server.route(path)
+    def metrics_endpoint():
+        return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+    if not METRICS_ENABLED:
+        return
+
+    @server.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @server.after_request
+    def finish_callback_metrics(response):
+        callback_metrics = g.get('callback_metrics')
+        if callback_metrics is None:
+            return response
+
+        name, wall, cpu, phases, error = callback_metrics
+        total = time.perf_counter() - g.get('request_start', time.perf_counter())
+
+        # Whatever the request spent outside the callback is Dash's JSON serialization
+        phases = {**phases, 'serialize': max(total - wall, 0.0)}
+        response_bytes = response.calculate_content_length() if not response.is_streamed else None
+        record(name, wall, cpu, phases, response_bytes, error)
+
+        timings = [f'{phase_name};dur={seconds * 1000:.2f}' for phase_name, seconds in phases.items()]
+        timings.append(f'callback;desc="{name}";dur={wall * 1000:.2f}')
+        timings.append(f'cpu;dur={cpu * 1000:.2f}')
+        response.headers.add('Server-Timing', ', '.join(timings))
+        return response
@@ -1,14 +1,20 @@
-import dash
 import dash_bootstrap_components as dbc
-from dash import dcc, html, Input, Output, callback
-import pandas as pd
-import plotly.express as px
-import sys
-import os
-from data import data_preprocess
+from dash import dcc, html, Input, Output, State, Patch, callback, ctx, no_update
+from dash.exceptions import PreventUpdate
+from query import get_backend
+from topk import top_k, get_topk_index
+from approx import estimate
+from spatial import density, get_spatial_index, view_from_relayout
+from crossfilter import crossfilter_counts, warm_crossfilter_index
+from live import live_sequence, live_end, live_aggregate, add_live, merge_counts, extendable, live_interval
+from metrics import instrument, phase
+from coalescing import TAB_ID, shared, latest_only, checkpoint
 
-# Load and preprocess data globally 
-df = data_preprocess('dataset/global_traffic_accidents.csv')
+# Shown above the charts while nothing is clicked
+selection_hint = "Click a country, a city or a weather × road cell to filter the other charts."
+
+# Columns of the weather × road counts kept with the heatmap for its live updates
+heat_columns = ['Weather Condition', 'Road Condition', 'Count', 'Count Error']
 
 color_seq = [
     "#b0c4de",  
@@ -20,9 +26,31 @@ color_seq = [
 ]
 
 def create_insights_layout():
+    # Index the incident coordinates and locations with the page, so the first charts are served warm
+    if get_backend() != 'parquet':
+        get_spatial_index()
+    get_topk_index('Location')
+    # The crossfilter index only serves clicks, so it is built in the background
+    warm_crossfilter_index()
+
     layout = html.Div([
         # Main content area without filters (filters are now in sidebar)
         html.Div([
+            # Values clicked on the charts, which filter the other charts
+            dcc.Store(id='crossfilter-selection', data={}),
+            # What each chart shows, so that live incidents update it without redrawing it
+            dcc.Store(id='choropleth-live'),
+            dcc.Store(id='bar-live'),
+            dcc.Store(id='heat-live'),
+            live_interval('home-live-interval'),
+            html.Div([
+                html.Span(selection_hint,
+                          id='crossfilter-summary',
+                          style={'color': '#001f3f', 'font-weight': '600', 'margin-right': '15px'}),
+                dbc.Button("Clear chart selection", id='crossfilter-reset', color="outline-primary", size="sm",
+                           style={"border-color": "#001f3f", "color": "#001f3f", "font-weight": "600"}),
+            ], className="mb-3 d-flex align-items-center"),
+
             dbc.Row([
                 dbc.Col([
                     dbc.Card([
@@ -48,6 +76,31 @@ def create_insights_layout():
                 ], width=12)
             ]),
 
+            dbc.Row([
+                dbc.Col([
+                    dbc.Card([
+                        dbc.CardHeader([
+                            html.H5("Incident Density", 
+                                    className="card-title text-center",
+                                    style={
+                                        'fontWeight': 'bold',
+                                        'color': '#001f3f',
+                                        'margin': '0'
+                                    })
+                        ], style={'background-color': '#f8f9fa', 'border-bottom': '2px solid #001f3f'}),
+                        dbc.CardBody([
+                            dcc.Graph(id='density-map', style={'height': '500px'})
+                        ])
+                    ], 
+                    className="mb-4", 
+                    style={
+                        "border": "2px solid #001f3f", 
+                        "borderRadius": "15px",
+                        "box-shadow": "0 4px 15px rgba(0,31,63,0.1)"
+                    })
+                ], width=12)
+            ]),
+
             dbc.Row([
                 dbc.Col([
                     dbc.Card([
@@ -100,134 +153,369 @@ def create_insights_layout():
     return layout
 
 
-def filter_data(start_date, end_date, selected_countries, selected_weather):
-    filtered = df[(df['Date'] >= start_date) & (df['Date'] <= end_date)]
-    if selected_weather:
-        filtered = filtered[filtered['Weather Condition'].isin(selected_weather)]
-    if selected_countries:
-        filtered = filtered[filtered['Country'].isin(selected_countries)]
-    return filtered
+def has_selection(selection):
+    # Whether any value is clicked on the charts (the charts then use the crossfilter engine)
+    return any((selection or {}).values())
+
+def toggle(values, value):
+    # Add a clicked value to a selection, or remove it when clicked again
+    values = list(values or [])
+    return [v for v in values if v != value] if value in values else values + [value]
+
+@callback(
+    Output('crossfilter-selection', 'data'),
+    Output('crossfilter-summary', 'children'),
+    Input('choropleth-map', 'clickData'),
+    Input('bar-chart', 'clickData'),
+    Input('heat-chart', 'clickData'),
+    Input('crossfilter-reset', 'n_clicks'),
+    Input('clear-filters-btn', 'n_clicks'),
+    State('crossfilter-selection', 'data'),
+    State('country-dropdown', 'value'),
+    prevent_initial_call=True
+)
+@instrument
+def update_crossfilter_selection(choropleth_click, bar_click, heat_click, reset_clicks, clear_clicks, selection, selected_countries):
+    selection = dict(selection or {})
+    if ctx.triggered_id == 'choropleth-map' and choropleth_click:
+        # With a single country in the sidebar the map shows its cities
+        dimension = 'Location' if selected_countries and len(selected_countries) == 1 else 'Country'
+        selection[dimension] = toggle(selection.get(dimension), choropleth_click['points'][0]['location'])
+    elif ctx.triggered_id == 'bar-chart' and bar_click:
+        selection['Location'] = toggle(selection.get('Location'), bar_click['points'][0]['x'])
+    elif ctx.triggered_id == 'heat-chart' and heat_click:
+        point = heat_click['points'][0]
+        cell = ([point['x']], [point['y']])
+        same = (selection.get('Weather Condition'), selection.get('Road Condition')) == cell
+        selection['Weather Condition'], selection['Road Condition'] = ([], []) if same else cell
+    else:
+        selection = {}
+
+    parts = [f"{dimension}: {', '.join(values)}" for dimension, values in selection.items() if values]
+    summary = ("Filtered by " + " | ".join(parts)) if parts else selection_hint
+    return selection, summary
+
 
 @callback(
     Output('choropleth-map', 'figure'),
+    Output('choropleth-live', 'data'),
     Input('date-picker', 'start_date'),
     Input('date-picker', 'end_date'),
     Input('country-dropdown', 'value'),
     Input('weather-dropdown', 'value'),
+    Input('approx-toggle', 'value'),
+    Input('crossfilter-selection', 'data'),
+    State(TAB_ID, 'data'),
 )
-def update_choropleth(start_date, end_date, selected_countries, selected_weather):
-    filtered_df = filter_data(start_date, end_date, selected_countries, selected_weather)
+@instrument
+@latest_only
+@shared
+def update_choropleth(start_date, end_date, selected_countries, selected_weather, approximate=False, selection=None):
+    import plotly.express as px
+    # Charts filtered by a click show the dataset only, and get no live updates
+    sequence = live_sequence()
+    end_date = live_end(end_date)
+    shown = None
     if selected_countries and len(selected_countries) == 1:
         country_name = selected_countries[0]
-        city_counts = (
-            filtered_df.groupby('Location')
-            .size()
-            .reset_index(name='Accident Count')
-            .sort_values('Accident Count', ascending=False)
-            .head(10)
-        )
-        fig = px.scatter_geo(
-            city_counts,
-            locations='Location',
-            locationmode='country names',
-            color='Accident Count',
-            size='Accident Count',
-            hover_name='Location',
-            projection='natural earth',
-            title=f'Accident Locations in {country_name}',
-            color_continuous_scale=color_seq,
-            size_max=20,
-            height=500,
-        )
-        fig.update_geos(
-            fitbounds="locations",
-            showcountries=True,
-            countrycolor="Black",
-            visible=True,
-            resolution=50,
-        )
+        if has_selection(selection):
+            city_counts = crossfilter_counts(
+                'Location', start_date, end_date, selected_countries, selected_weather, selection, top=10
+            ).rename(columns={'Count': 'Accident Count'})
+        else:
+            city_counts = top_k(
+                'Location', 10, start_date, end_date, selected_countries, selected_weather
+            ).rename(columns={'Count': 'Accident Count'})
+            shown = {'sequence': sequence}
+        checkpoint()
+        with phase('figure'):
+            fig = px.scatter_geo(
+                city_counts,
+                locations='Location',
+                locationmode='country names',
+                color='Accident Count',
+                size='Accident Count',
+                hover_name='Location',
+                projection='natural earth',
+                title=f'Accident Locations in {country_name}',
+                color_continuous_scale=color_seq,
+                size_max=20,
+                height=500,
+            )
+            fig.update_geos(
+                fitbounds="locations",
+                showcountries=True,
+                countrycolor="Black",
+                visible=True,
+                resolution=50,
+            )
     else:
-        accident_counts = (
-            filtered_df.groupby('Country')
-            .size()
-            .reset_index(name='Accident Count')
-        )
-        fig = px.choropleth(
-            accident_counts,
-            locations='Country',
-            locationmode='country names',
-            color='Accident Count',
-            color_continuous_scale=color_seq,
-            title="Accident Density by Country",
+        if has_selection(selection):
+            accident_counts = crossfilter_counts(
+                'Country', start_date, end_date, selected_countries, selected_weather, selection
+            ).assign(**{'Count Error': 0.0})
+        else:
+            accident_counts = estimate(
+                ['Country'], start_date, end_date, selected_countries, selected_weather, approximate=approximate
+            )
+            accident_counts = add_live(accident_counts, ['Country'], start_date, end_date, selected_countries, selected_weather, upto=sequence)
+            shown = {'sequence': sequence, 'countries': accident_counts['Country'].tolist(), 'errors': bool(accident_counts['Count Error'].any())}
+        accident_counts = accident_counts.rename(columns={'Count': 'Accident Count', 'Count Error': '± (95%)'})
+        checkpoint()
+        with phase('figure'):
+            fig = px.choropleth(
+                accident_counts,
+                locations='Country',
+                locationmode='country names',
+                color='Accident Count',
+                color_continuous_scale=color_seq,
+                title="Accident Density by Country",
+                height=500,
+                hover_data={'± (95%)': ':.0f'} if accident_counts['± (95%)'].any() else None,
+            )
+            fig.update_layout(margin={"r":0,"t":40,"l":0,"b":0})
+            extendable(fig, 'z', 'locations', 'customdata')
+            # Outline the selected countries
+            selected = set((selection or {}).get('Country') or [])
+            if selected:
+                fig.update_traces(marker_line_color='#FFD700',
+                                  marker_line_width=[3 if country in selected else 0.5 for country in accident_counts['Country']])
+    return fig, shown
+
+@callback(
+    Output('density-map', 'figure'),
+    Input('date-picker', 'start_date'),
+    Input('date-picker', 'end_date'),
+    Input('country-dropdown', 'value'),
+    Input('weather-dropdown', 'value'),
+    Input('density-map', 'relayoutData'),
+    State(TAB_ID, 'data'),
+)
+@instrument
+@latest_only
+@shared
+def update_density_map(start_date, end_date, selected_countries, selected_weather, relayout_data):
+    import plotly.graph_objects as go
+    # Only the counts of the grid cells in view are sent, never the incidents themselves
+    zoom, bounds = view_from_relayout(relayout_data)
+    cells, resolution = density(start_date, end_date, selected_countries, selected_weather, zoom, bounds)
+    checkpoint()
+    with phase('figure'):
+        fig = go.Figure(go.Densitymap(
+            lat=cells['Latitude'],
+            lon=cells['Longitude'],
+            z=cells['Count'],
+            radius=10,
+            colorscale=color_seq,
+            colorbar=dict(title='Accidents'),
+            hovertemplate='%{z} accidents<extra></extra>',
+        ))
+        fig.update_layout(
+            map_style='carto-positron',
+            # Keep the user's pan and zoom when the figure is redrawn for a new view
+            uirevision='density-map',
+            title=f'Accidents per {resolution:g}° cell',
             height=500,
+            margin={"r":0,"t":40,"l":0,"b":0},
         )
-        fig.update_layout(margin={"r":0,"t":40,"l":0,"b":0})
     return fig
 
 @callback(
     Output('bar-chart', 'figure'),
+    Output('bar-live', 'data'),
     Input('date-picker', 'start_date'),
     Input('date-picker', 'end_date'),
     Input('country-dropdown', 'value'),
     Input('weather-dropdown', 'value'),
+    Input('crossfilter-selection', 'data'),
+    State(TAB_ID, 'data'),
 )
-def update_bar_chart(start_date, end_date, selected_countries, selected_weather):
-    filtered_df = filter_data(start_date, end_date, selected_countries, selected_weather)
-    top_cities = (
-        filtered_df['Location']
-        .value_counts()
-        .head(5)
-        .reset_index(name='Accident Count')
-    )
-    top_cities.rename(columns={'index': 'Location'}, inplace=True)
-    fig = px.bar(
-        top_cities.sort_values('Accident Count', ascending=False),
-        x='Location',
-        y='Accident Count',
-        color='Accident Count',
-        color_continuous_scale=color_seq,
-        template='plotly_white',
-        text='Accident Count'
-    )
-    fig.update_traces(
-        textposition='outside',
-        marker_line_color='#36454f',
-        marker_line_width=1.5
-    )
-    fig.update_layout(
-        xaxis_title='City',
-        yaxis_title='Number of Accidents',
-        coloraxis_showscale=False,
-        plot_bgcolor='#f7f9fa',
-        margin=dict(l=60, r=20, t=60, b=40)
-    )
-    return fig
+@instrument
+@latest_only
+@shared
+def update_bar_chart(start_date, end_date, selected_countries, selected_weather, selection=None):
+    import plotly.express as px
+    sequence = live_sequence()
+    end_date = live_end(end_date)
+    shown = None
+    if has_selection(selection):
+        top_cities = crossfilter_counts(
+            'Location', start_date, end_date, selected_countries, selected_weather, selection, top=5
+        ).rename(columns={'Count': 'Accident Count'})
+    else:
+        top_cities = top_k(
+            'Location', 5, start_date, end_date, selected_countries, selected_weather
+        ).rename(columns={'Count': 'Accident Count'})
+        shown = {'sequence': sequence}
+    checkpoint()
+    with phase('figure'):
+        fig = px.bar(
+            top_cities.sort_values('Accident Count', ascending=False),
+            x='Location',
+            y='Accident Count',
+            color='Accident Count',
+            color_continuous_scale=color_seq,
+            template='plotly_white',
+            text='Accident Count'
+        )
+        selected = set((selection or {}).get('Location') or [])
+        fig.update_traces(
+            textposition='outside',
+            marker_line_color='#36454f',
+            # The selected cities get a thicker outline
+            marker_line_width=[4 if location in selected else 1.5 for location in fig.data[0].x] if selected else 1.5
+        )
+        fig.update_layout(
+            xaxis_title='City',
+            yaxis_title='Number of Accidents',
+            coloraxis_showscale=False,
+            plot_bgcolor='#f7f9fa',
+            margin=dict(l=60, r=20, t=60, b=40)
+        )
+    return fig, shown
+
+def top_combos(combos):
+    # The 5 most frequent weather × road combinations (ties by condition), as `estimate(..., top=5)` ranks them
+    return combos.sort_values('Count', ascending=False, kind='stable').head(5).reset_index(drop=True)
+
+def heat_matrix(combo_counts):
+    # Counts and errors of the combinations, pivoted with the roads as rows and the weathers as columns
+    heatmap_data = combo_counts.pivot(index='Road Condition', columns='Weather Condition', values='Count').fillna(0)
+    error_data = combo_counts.pivot(index='Road Condition', columns='Weather Condition', values='Count Error').fillna(0)
+    return heatmap_data, error_data
+
+def heat_text(heatmap_data, error_data):
+    # Estimated counts read "count ± error"
+    return [[f'{count:.0f} ± {error:.0f}' if error else f'{count:.0f}' for count, error in zip(counts, errors)]
+            for counts, errors in zip(heatmap_data.to_numpy(), error_data.to_numpy())]
 
 @callback(
     Output('heat-chart', 'figure'),
+    Output('heat-live', 'data'),
     Input('date-picker', 'start_date'),
     Input('date-picker', 'end_date'),
     Input('country-dropdown', 'value'),
     Input('weather-dropdown', 'value'),
+    Input('approx-toggle', 'value'),
+    Input('crossfilter-selection', 'data'),
+    State(TAB_ID, 'data'),
 )
-def update_heat_chart(start_date, end_date, selected_countries, selected_weather):
-    filtered_df = filter_data(start_date, end_date, selected_countries, selected_weather)
-    combo_counts = (
-        filtered_df.groupby(['Weather Condition', 'Road Condition'])
-        .size()
-        .reset_index(name='Count')
-        .sort_values('Count', ascending=False)
-        .head(5)
-    )
-    # Pivot for heatmap
-    heatmap_data = combo_counts.pivot(index='Road Condition', columns='Weather Condition', values='Count').fillna(0)
-    fig = px.imshow(
-        heatmap_data,
-        color_continuous_scale=color_seq,
-        labels=dict(x="Weather Condition", y="Road Condition", color="Accident Count"),
-        text_auto=True
-    )
-    fig.update_layout(
-        margin=dict(l=20, r=20, t=60, b=20)
-    )
-    return fig
\ No newline at end of file
+@instrument
+@latest_only
+@shared
+def update_heat_chart(start_date, end_date, selected_countries, selected_weather, approximate=False, selection=None):
+    import plotly.express as px
+    sequence = live_sequence()
+    end_date = live_end(end_date)
+    shown = None
+    if has_selection(selection):
+        combo_counts = crossfilter_counts(
+            'Weather x Road', start_date, end_date, selected_countries, selected_weather, selection, top=5
+        ).assign(**{'Count Error': 0.0})
+    else:
+        # Every combination is kept with the chart, as live incidents can change the top 5
+        combos = estimate(
+            ['Weather Condition', 'Road Condition'], start_date, end_date, selected_countries, selected_weather,
+            approximate=approximate
+        )
+        combos = add_live(combos, ['Weather Condition', 'Road Condition'], start_date, end_date, selected_countries, selected_weather, upto=sequence)
+        combo_counts = top_combos(combos)
+        shown = {'sequence': sequence, 'combos': combos[heat_columns].to_numpy().tolist(), 'errors': bool(combos['Count Error'].any())}
+    with phase('aggregate'):
+        # Pivot for heatmap
+        heatmap_data, error_data = heat_matrix(combo_counts)
+    checkpoint()
+    with phase('figure'):
+        fig = px.imshow(
+            heatmap_data,
+            color_continuous_scale=color_seq,
+            labels=dict(x="Weather Condition", y="Road Condition", color="Accident Count"),
+            text_auto=True
+        )
+        if combo_counts['Count Error'].any():
+            fig.update_traces(text=heat_text(heatmap_data, error_data), texttemplate='%{text}')
+        fig.update_layout(
+            margin=dict(l=20, r=20, t=60, b=20)
+        )
+    return fig, shown
+
+@callback(
+    Output('choropleth-map', 'figure', allow_duplicate=True),
+    Output('choropleth-live', 'data', allow_duplicate=True),
+    Output('bar-chart', 'figure', allow_duplicate=True),
+    Output('bar-live', 'data', allow_duplicate=True),
+    Output('heat-chart', 'figure', allow_duplicate=True),
+    Output('heat-live', 'data', allow_duplicate=True),
+    Input('home-live-interval', 'n_intervals'),
+    State('choropleth-live', 'data'),
+    State('bar-live', 'data'),
+    State('heat-live', 'data'),
+    State('date-picker', 'start_date'),
+    State('date-picker', 'end_date'),
+    State('country-dropdown', 'value'),
+    State('weather-dropdown', 'value'),
+    prevent_initial_call=True
+)
+@instrument
+def push_live_home(n_intervals, choropleth_shown, bar_shown, heat_shown, start_date, end_date, selected_countries, selected_weather):
+    # Bring the charts up to the incidents received since they were drawn, sending only what changed
+    import pandas as pd
+    sequence = live_sequence()
+    behind = [shown is not None and shown['sequence'] < sequence for shown in (choropleth_shown, bar_shown, heat_shown)]
+    if not any(behind):
+        raise PreventUpdate
+    end_date = live_end(end_date)
+    filters = (start_date, end_date, selected_countries, selected_weather)
+    outputs = [no_update] * 6
+
+    if behind[0] and 'countries' in choropleth_shown:
+        # Country counts: the new incidents add to their country, new countries are appended
+        new_counts = live_aggregate(['Country'], *filters, after=choropleth_shown['sequence'], upto=sequence)
+        patch = Patch()
+        trace = patch['data'][0]
+        countries = list(choropleth_shown['countries'])
+        positions = {country: position for position, country in enumerate(countries)}
+        for country, count in zip(new_counts['Country'], new_counts['Count'].tolist()):
+            if country in positions:
+                trace['z'][positions[country]] += count
+            else:
+                countries.append(country)
+                trace['locations'].append(country)
+                trace['z'].append(count)
+                if choropleth_shown['errors']:
+                    trace['customdata'].append([0.0])
+        outputs[0:2] = patch, {**choropleth_shown, 'sequence': sequence, 'countries': countries}
+    elif behind[0]:
+        # Top cities of a country: ranked again by the top-K index, which counts the new incidents
+        city_counts = top_k('Location', 10, *filters)
+        patch = Patch()
+        trace = patch['data'][0]
+        trace['locations'] = trace['hovertext'] = city_counts['Location'].tolist()
+        trace['marker']['color'] = trace['marker']['size'] = city_counts['Count'].tolist()
+        # Same bubble scale as plotly express's size_max=20
+        trace['marker']['sizeref'] = 2.0 * max(city_counts['Count'].max(), 1) / 20 ** 2
+        outputs[0:2] = patch, {'sequence': sequence}
+
+    if behind[1]:
+        top_cities = top_k('Location', 5, *filters)
+        patch = Patch()
+        trace = patch['data'][0]
+        trace['x'] = top_cities['Location'].tolist()
+        trace['y'] = trace['text'] = trace['marker']['color'] = top_cities['Count'].tolist()
+        outputs[2:4] = patch, {'sequence': sequence}
+
+    if behind[2]:
+        # The new incidents add to the kept combinations, whose top 5 is drawn again
+        new_counts = live_aggregate(['Weather Condition', 'Road Condition'], *filters, after=heat_shown['sequence'], upto=sequence)
+        combos = pd.DataFrame(heat_shown['combos'], columns=heat_columns)
+        combos = merge_counts(combos, new_counts, ['Weather Condition', 'Road Condition'])
+        heatmap_data, error_data = heat_matrix(top_combos(combos))
+        patch = Patch()
+        trace = patch['data'][0]
+        trace['z'] = heatmap_data.to_numpy().tolist()
+        trace['x'], trace['y'] = heatmap_data.columns.tolist(), heatmap_data.index.tolist()
+        if heat_shown['errors']:
+            trace['text'] = heat_text(heatmap_data, error_data)
+        outputs[4:6] = patch, {**heat_shown, 'sequence': sequence, 'combos': combos[heat_columns].to_numpy().tolist()}
+
+    return outputs
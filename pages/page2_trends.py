@@ -1,14 +1,16 @@
 from dash_bootstrap_components._components.CardBody import CardBody
 from dash_bootstrap_components._components.CardHeader import CardHeader
-import pandas as pd
-import plotly.express as px 
+import calendar
 import dash_bootstrap_components as dbc 
-from dash import html, dcc, Input, Output, callback
+from dash import html, dcc, Input, Output, State, Patch, callback
+from dash.exceptions import PreventUpdate
 
-from data import data_preprocess
-
-# Load data
-accidents_df = data_preprocess('dataset\\global_traffic_accidents.csv')
+from query import aggregate
+from approx import estimate
+from catalog import get_catalog
+from temporal import AXES, histogram
+from metrics import instrument, phase
+from live import live_sequence, live_end, live_aggregate, add_live, series_state, extend_series, extendable, live_interval
 
 # ---------- Header ----------
 header_trends = html.Div([
@@ -63,24 +65,28 @@ styles = {
 }
 
 # ---------- Figure Generators ----------
-def create_accidents_over_date(selected_metric):
-    monthly_data = accidents_df.groupby(['Year','Month_Num'])[selected_metric].sum().reset_index()
-    pivot_df = monthly_data.pivot(index='Month_Num', columns='Year', values=selected_metric).reset_index()
-    pivot_df['Month'] = pivot_df['Month_Num'].apply(lambda x: pd.to_datetime(str(x), format='%m').strftime('%b'))
-    pivot_df = pivot_df.sort_values('Month_Num')
-    fig = px.line(pivot_df,
-                x='Month',
-                y=[pivot_df.columns[1], pivot_df.columns[2]],   
-                markers=True,
-                labels={"value": selected_metric, "variable": "Year"},
-                template='plotly_white',    
-                color_discrete_sequence=["#001f3f", "#800020"]
-    )
+def create_accidents_over_date(selected_metric, approximate=False):
+    import plotly.express as px
+    monthly_data = estimate(['Year', 'Month_Num'], sums=[selected_metric], approximate=approximate)
+    with phase('aggregate'):
+        monthly_data = monthly_data.sort_values(['Month_Num', 'Year'])
+        monthly_data['Month'] = monthly_data['Month_Num'].apply(lambda x: calendar.month_abbr[x])
+        monthly_data['Year'] = monthly_data['Year'].astype(str)
+    with phase('figure'):
+        fig = px.line(monthly_data,
+                    x='Month',
+                    y=selected_metric,
+                    color='Year',
+                    error_y=f'{selected_metric} Error' if approximate else None,
+                    markers=True,
+                    template='plotly_white',    
+                    color_discrete_sequence=["#001f3f", "#800020"]
+        )
     return fig
 
 def create_severity_figure():
-    severity_counts = accidents_df['Severity'].value_counts().reset_index()
-    severity_counts.columns = ['Severity', 'Count']
+    import plotly.express as px
+    severity_counts = aggregate(['Severity'])
     fig = px.pie(
         severity_counts,
         names='Severity',
@@ -95,10 +101,13 @@ def create_severity_figure():
     return fig
 
 def create_accidents_with_time():
-    weather_mode = accidents_df.groupby('Time Segment')['Weather Condition'].agg(lambda x: x.mode().iloc[0])
-    road_mode = accidents_df.groupby('Time Segment')['Road Condition'].agg(lambda x: x.mode().iloc[0])
-    segment_counts = accidents_df['Time Segment'].value_counts().reset_index()
-    segment_counts.columns = ['Time Segment', 'Count']
+    import plotly.express as px
+    # Most common condition per segment (ties go to the first value, like Series.mode)
+    weather_mode = (aggregate(['Time Segment', 'Weather Condition']).sort_values('Count', ascending=False, kind='stable')
+                    .drop_duplicates('Time Segment').set_index('Time Segment')['Weather Condition'])
+    road_mode = (aggregate(['Time Segment', 'Road Condition']).sort_values('Count', ascending=False, kind='stable')
+                 .drop_duplicates('Time Segment').set_index('Time Segment')['Road Condition'])
+    segment_counts = aggregate(['Time Segment'])
     segment_counts['Weather Condition'] = segment_counts['Time Segment'].map(weather_mode)
     segment_counts['Road Condition'] = segment_counts['Time Segment'].map(road_mode)
     segment_counts['Hover'] = (
@@ -122,9 +131,16 @@ def create_accidents_with_time():
 
  # ---------- Layout ----------   
 def create_trends_layout():
+    catalog = get_catalog()
     trends_layout = html.Div([
     #header_trends,
     html.Div([
+        dbc.Switch(
+            id='trends-approx-toggle',
+            label="Approximate results (faster, with 95% error bars)",
+            value=False,
+            style={'color': '#001f3f', 'font-weight': '600', 'margin-bottom': '15px'}
+        ),
         dbc.Card([
             dbc.CardHeader([
                 html.H5("Accident Trends Over Time",
@@ -135,14 +151,17 @@ def create_trends_layout():
             dbc.CardBody([
                 dcc.DatePickerRange(   
                     id='date-range',
-                    start_date=accidents_df['Date'].min(),
-                    end_date=accidents_df['Date'].max(),
-                    min_date_allowed=accidents_df['Date'].min(),
-                    max_date_allowed=accidents_df['Date'].max(),
+                    start_date=catalog['date_min'],
+                    end_date=catalog['date_max'],
+                    min_date_allowed=catalog['date_min'],
+                    max_date_allowed=catalog['date_max'],
                     display_format='YYYY-MM-DD',
                     style=styles["datepicker"]
                 ),
                 dcc.Graph(id='time-series'),
+                # Days drawn by the time series, which the live incidents extend
+                dcc.Store(id='time-series-live'),
+                live_interval('trends-live-interval'),
             ]),
             
         ], className="mb-4", style=styles["card"]),
@@ -184,6 +203,34 @@ def create_trends_layout():
             ]),
         ], className="mb-4", style=styles["card"]),
 
+        dbc.Card([
+            dbc.CardHeader([
+                html.H5("Accidents by Hour of Day",
+                className="card-title text-center", style=styles["card_title"]),
+            ],style=styles['card_header']),
+            dbc.CardBody([
+                dcc.Tabs(
+                id='temporal-metric',
+                value='Count',
+                children=[
+                    dcc.Tab(label='Accidents', value='Count', style=styles["tab"], selected_style=styles["tab"]),
+                    dcc.Tab(label='Casualties', value='Casualties', style=styles["tab"], selected_style=styles["tab"]),
+                ],
+            ),
+            dcc.Dropdown(
+                id='temporal-rows',
+                options=[
+                    {'label': 'Hour x Day of Week', 'value': 'Weekday'},
+                    {'label': 'Hour x Month', 'value': 'Month'},
+                ],
+                value='Weekday',
+                clearable=False,
+                style={"margin": "10px"}
+            ),
+            dcc.Graph(id='temporal-heatmap')
+            ]),
+        ], className="mb-4", style=styles["card"]),
+
         dbc.Row([
             dbc.Col([
                 dbc.Card([
@@ -221,60 +268,97 @@ def create_trends_layout():
 # ---------- Callbacks ----------
 @callback(
     Output('time-series', 'figure'),
+    Output('time-series-live', 'data'),
     Input('date-range', 'start_date'),
-    Input('date-range', 'end_date')
+    Input('date-range', 'end_date'),
+    Input('trends-approx-toggle', 'value')
 )
-def update_time_series(start_date, end_date):
-    mask = (accidents_df['Date'] >= start_date) & (accidents_df['Date'] <= end_date)
-    filtered_data = accidents_df.loc[mask]
-    grouped = filtered_data.groupby('Date').size().reset_index(name='accident_count')
-    fig = px.line(
-        grouped, 
-        x='Date',
-        y='accident_count',
-        labels={'accident_count': 'Number of Accidents'},
-        template='plotly_white',
-        color_discrete_sequence=['#001f3f']
-    )
-    fig.update_traces(mode='lines+markers')
-    return fig
+@instrument
+def update_time_series(start_date, end_date, approximate=False):
+    import pandas as pd
+    import plotly.express as px
+    sequence = live_sequence()
+    end_date = live_end(end_date)
+    grouped = estimate(['Date'], start_date, end_date, approximate=approximate)
+    grouped = add_live(grouped, ['Date'], start_date, end_date, upto=sequence)
+    with phase('aggregate'):
+        # One point per day (days without accidents count 0), so that live incidents land on known points
+        days = pd.date_range(start_date or grouped['Date'].min(), grouped['Date'].max(), freq='D') if len(grouped) else pd.DatetimeIndex([])
+        grouped = grouped.set_index('Date').reindex(days, fill_value=0).rename_axis('Date').reset_index()
+        grouped = grouped.rename(columns={'Count': 'accident_count'})
+    with phase('figure'):
+        fig = px.line(
+            grouped, 
+            x='Date',
+            y='accident_count',
+            error_y='Count Error' if approximate else None,
+            labels={'accident_count': 'Number of Accidents'},
+            template='plotly_white',
+            color_discrete_sequence=['#001f3f']
+        )
+        fig.update_traces(mode='lines+markers')
+        extendable(fig, 'y', 'error_y.array')
+    return fig, series_state(days, sequence, errors=approximate)
+
+@callback(
+    Output('time-series', 'figure', allow_duplicate=True),
+    Output('time-series-live', 'data', allow_duplicate=True),
+    Input('trends-live-interval', 'n_intervals'),
+    State('time-series-live', 'data'),
+    State('date-range', 'start_date'),
+    State('date-range', 'end_date'),
+    prevent_initial_call=True
+)
+@instrument
+def extend_time_series(n_intervals, shown, start_date, end_date):
+    # Add the incidents received since the figure was drawn to their days, without resending it
+    sequence = live_sequence()
+    if not shown or sequence <= shown['sequence']:
+        raise PreventUpdate
+    counts = live_aggregate(['Date'], start_date, live_end(end_date), after=shown['sequence'], upto=sequence)
+    patch = Patch()
+    shown = extend_series(patch, shown, counts.set_index('Date')['Count'], 'D', sequence)
+    return patch, shown
 
 @callback(
     Output('env-boxplot', 'figure'),
-    Input('env-dropdown', 'value')
+    Input('env-dropdown', 'value'),
+    Input('trends-approx-toggle', 'value')
 )
-def update_env_plot(selected_feature):
-    grouped_df = accidents_df.groupby(selected_feature).agg({
-        'Casualties': 'sum',
-        selected_feature: 'count',
-        'Vehicles Involved': 'sum',
-    }).rename(columns={
-        selected_feature: 'Number of Accidents',
+@instrument
+def update_env_plot(selected_feature, approximate=False):
+    import plotly.express as px
+    grouped_df = estimate([selected_feature], sums=['Casualties', 'Vehicles Involved'], approximate=approximate).rename(columns={
+        'Count': 'Number of Accidents',
         'Casualties': 'Total Casualties',
         'Vehicles Involved': 'Total Vehicles',
-    }).reset_index()
-    grouped_df['Hover'] = grouped_df.apply(lambda row: (
-        f"{selected_feature}: {row[selected_feature]}"
-        f"<br>Number of Accidents: {row['Number of Accidents']}"
-        f"<br>Total Casualties: {row['Total Casualties']}"
-        f"<br>Total Vehicles: {row['Total Vehicles']}"
-    ), axis=1)
-    fig = px.bar(
-        grouped_df,
-        x=selected_feature,
-        y='Number of Accidents',
-        template='plotly_white',
-        color=selected_feature,
-        color_discrete_sequence=['#1e2d3b', '#36454f', '#3e78b2', '#003366', '#001f3f','#3a6d8c'],
-        hover_data=['Hover']
-    )
-    fig.update_traces(hovertemplate='%{customdata[0]}<extra></extra>')
+    })
+    with phase('figure'):
+        margin = lambda error: f" ± {error:.0f}" if error else ""
+        grouped_df['Hover'] = grouped_df.apply(lambda row: (
+            f"{selected_feature}: {row[selected_feature]}"
+            f"<br>Number of Accidents: {row['Number of Accidents']}{margin(row['Count Error'])}"
+            f"<br>Total Casualties: {row['Total Casualties']}{margin(row['Casualties Error'])}"
+            f"<br>Total Vehicles: {row['Total Vehicles']}{margin(row['Vehicles Involved Error'])}"
+        ), axis=1)
+        fig = px.bar(
+            grouped_df,
+            x=selected_feature,
+            y='Number of Accidents',
+            template='plotly_white',
+            color=selected_feature,
+            color_discrete_sequence=['#1e2d3b', '#36454f', '#3e78b2', '#003366', '#001f3f','#3a6d8c'],
+            error_y='Count Error' if approximate else None,
+            hover_data=['Hover']
+        )
+        fig.update_traces(hovertemplate='%{customdata[0]}<extra></extra>')
     return fig
 
 @callback(
     Output('env-title', 'children'),
     Input('env-dropdown', 'value')
 )
+@instrument
 def update_env_title(selected_feature):
     feature_map = {
         "Weather Condition": "Accidents by Weather Condition",
@@ -285,8 +369,37 @@ def update_env_title(selected_feature):
 
 @callback(
     Output('monthly-trend-graph', 'figure'),
-    Input('metric-selector', 'value')
+    Input('metric-selector', 'value'),
+    Input('trends-approx-toggle', 'value')
+)
+@instrument
+def update_trend_graph(selected_metric, approximate=False):
+    fig = create_accidents_over_date(selected_metric, approximate)
+    return fig
+
+@callback(
+    Output('temporal-heatmap', 'figure'),
+    Input('date-range', 'start_date'),
+    Input('date-range', 'end_date'),
+    Input('temporal-rows', 'value'),
+    Input('temporal-metric', 'value')
 )
-def update_trend_graph(selected_metric):
-    fig = create_accidents_over_date(selected_metric)
+@instrument
+def update_temporal_heatmap(start_date, end_date, rows='Weekday', metric='Count'):
+    import plotly.express as px
+    cells = histogram('Hour', rows, start_date, end_date, sums=[metric] if metric != 'Count' else [])
+    with phase('figure'):
+        # Cells come sorted by row then hour, one per pair
+        matrix = cells[metric].to_numpy().reshape(AXES[rows][0], AXES['Hour'][0])
+        fig = px.imshow(
+            matrix,
+            x=AXES['Hour'][1],
+            y=AXES[rows][1],
+            color_continuous_scale=['#f8f9fa', '#3e78b2', '#001f3f'],
+            labels=dict(x='Hour', y='Day of Week' if rows == 'Weekday' else 'Month',
+                        color='Accidents' if metric == 'Count' else 'Casualties'),
+            aspect='auto',
+            template='plotly_white'
+        )
+        fig.update_xaxes(side='bottom', tickangle=-45)
     return fig
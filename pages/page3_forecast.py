@@ -1,28 +1,50 @@
 import datetime
-import pandas as pd   
-from joblib import load      
 
 # Dash Components Related Modules
 import plotly.graph_objects as go
 import dash_mantine_components as dmc
 import dash_bootstrap_components as dbc 
-from dash import Dash, html, dcc, Input, Output, State, callback
+from dash import Dash, html, dcc, Input, Output, State, Patch, callback
+from dash.exceptions import PreventUpdate
 
 # User-Defined Modules
-from data import data_preprocess
-from tools import monthly_casualties, forecast_interval, get_casualties_features, get_accidents_features
+from data import load_accidents
+from artifacts import load_artifact
+from catalog import get_catalog, dropdown_options, cities_for_country
+from metrics import instrument, phase
+from jobs import job_callback
+from inference import predict
+from coalescing import checkpoint
+from tools import monthly_casualties, forecast_interval, forecast_paths, get_casualties_features, get_accidents_features
+from live import live_sequence, live_aggregate, series_state, extend_series, live_interval
 
 
-# Read the dataframe
-accidents_df = data_preprocess('dataset/global_traffic_accidents.csv')
+# Models used by this page, loaded on first use
+page_artifacts = [
+    'assessment_feature_columns',
+    'assessment_model',
+    'casualties_forecasting_model',
+    'accidents_forecasting_model'
+]
 
-# Load Feature Columns Names used in training
-assessment_feature_columns = load(open('models/assessment_feature_columns.pkl', 'rb'))
 
-# Load ML Models
-assessment_model = load('models/assessment_model.pkl')
-casualties_forecast_model = load('models/casualties_forecasting_model.pkl')
-accidents_forecast_model = load('models/accidents_forecasting_model.pkl')
+def live_months(model_type, after=0, upto=None):
+    # Accidents (or casualties) per month of the live incidents of batches `after` to `upto`
+    import pandas as pd
+
+    live = live_aggregate(['YearMonth'], sums=['Casualties'], after=after, upto=upto)
+    column = 'Casualties' if model_type == "forecast_casualties" else 'Count'
+    return pd.Series(live[column].to_numpy(dtype='int64'), index=pd.PeriodIndex(live['YearMonth'], freq='M').to_timestamp())
+
+
+def history(monthly_counts, model_type, sequence):
+    # Monthly history of the forecast target (one point per month), with the live incidents up to `sequence`
+    import pandas as pd
+
+    column = 'Casualties' if model_type == "forecast_casualties" else 'AccidentsCount'
+    series = monthly_counts.set_index('YearMonth')[column].add(live_months(model_type, upto=sequence), fill_value=0)
+    months = pd.date_range(series.index.min(), series.index.max(), freq='MS')
+    return series.reindex(months, fill_value=0).astype(monthly_counts[column].dtype)
 
 
 def create_forecast_layout():
@@ -57,21 +79,25 @@ def create_forecast_layout():
     Output("main-content-container", "children"),
     Input("model-dropdown", "value")
 )
+@instrument
 def update_main_layout(selected_model):
     
+    accidents_df = load_accidents()
+
     if selected_model in ["forecast_casualties", "forecast_accidents"]:
         
         title = "Forecasting Monthly Global Casualties" if selected_model == "forecast_casualties" else "Forecasting Monthly Global Accidents"
         
         # Generate initial historical plot
+        sequence = live_sequence()
         if selected_model == "forecast_casualties":
             monthly_counts, _ = get_casualties_features(accidents_df)
-            x_col, y_col = monthly_counts['YearMonth'], monthly_counts['Casualties']
             y_title = 'Casualties'
         else:  # forecast_accidents
             monthly_counts, _ = get_accidents_features(accidents_df)
-            x_col, y_col = monthly_counts['YearMonth'], monthly_counts['AccidentsCount']
             y_title = 'Accidents'
+        monthly_history = history(monthly_counts, selected_model, sequence)
+        x_col, y_col = monthly_history.index, monthly_history.tolist()
         
         # Create initial historical plot
         initial_fig = go.Figure()
@@ -109,9 +135,11 @@ def update_main_layout(selected_model):
                     ], style={"padding": "20px", "marginBottom": "20px"})
                 ], width=6),
                 
-                # Empty column for spacing/future use
+                # Progress of the running forecast
                 dbc.Col([
-                    html.Div()  # Empty div for potential future controls
+                    html.Div([
+                        dbc.Progress(id="forecast-progress", value=100, striped=True, animated=True, style={"height": "20px"})
+                    ], id="forecast-progress-container", style={"padding": "20px", "marginTop": "35px", "visibility": "hidden"})
                 ], width=6)
             ]),
             
@@ -124,7 +152,10 @@ def update_main_layout(selected_model):
                                 className="card-title text-center mt-3",
                                 style={"fontWeight": "bold"}
                             ),
-                        dcc.Graph(id="main-forecast-graph", figure=initial_fig)
+                        dcc.Graph(id="main-forecast-graph", figure=initial_fig),
+                        # Months drawn by the history, which the live incidents extend
+                        dcc.Store(id="forecast-live", data=series_state(x_col, sequence)),
+                        live_interval("forecast-live-interval")
                     ], className="mb-4 p-3", style={"border": "1px solid #001f3f", "borderRadius": "20px"})
                 ], width=12)
             ])
@@ -158,7 +189,7 @@ def update_main_layout(selected_model):
 
                     html.Label("Select Country", style={"fontWeight": "bold"}),
                     dcc.Dropdown(
-                        options=[{'label': c, 'value': c} for c in sorted(accidents_df['Country'].unique())],
+                        options=dropdown_options('Country'),
                         id="country-dropdown"
                     ),
 
@@ -191,21 +222,21 @@ def update_main_layout(selected_model):
 
                     html.Label("Select Weather Condition", style={"fontWeight": "bold"}),
                     dcc.Dropdown(
-                        options=[{'label': c, 'value': c} for c in sorted(accidents_df['Weather Condition'].unique())],
+                        options=dropdown_options('Weather Condition'),
                         id="weather-dropdown"
                     ),
                     html.Br(),
 
                     html.Label("Select Road Condition", style={"fontWeight": "bold"}),
                     dcc.Dropdown(
-                        options=[{'label': c, 'value': c} for c in sorted(accidents_df['Road Condition'].unique())],
+                        options=dropdown_options('Road Condition'),
                         id="road-dropdown"
                     ),
                     html.Br(),
 
                     html.Label("Select Cause", style={"fontWeight": "bold"}),
                     dcc.Dropdown(
-                        options=[{'label': c, 'value': c} for c in sorted(accidents_df['Cause'].unique())],
+                        options=dropdown_options('Cause'),
                         id="cause-dropdown"
                     ),
                     html.Br(),
@@ -215,7 +246,7 @@ def update_main_layout(selected_model):
                             html.Label("Select Date", style={"fontWeight": "bold"}),
                             dcc.DatePickerSingle(
                                 id="date-picker",
-                                date=accidents_df['Date'].max(),
+                                date=get_catalog()['date_max'],
                                 style={"width": "100%"}
                             )
                         ], style={"width": "48%", "display": "inline-block", "marginRight": "4%"}),
@@ -279,37 +310,26 @@ def update_main_layout(selected_model):
     Input('country-dropdown', 'value'),
     prevent_initial_call=True
 )
+@instrument
 def update_city_dropdown(selected_country):
     
+    accidents_df = load_accidents()
     cities_menu = []
     title = "Global Monthly Average Casualties" 
     fig = monthly_casualties(accidents_df, '')
 
-    city_country_map = {
-                        'Australia': ['Sydney'],
-                        'Brazil': ['São Paulo'],
-                        'Canada': ['Toronto'],
-                        'China': ['Beijing'],  
-                        'France': ['Paris'],
-                        'Germany': ['Berlin'],
-                        'India': ['Mumbai'],
-                        'Japan': ['Tokyo'],
-                        'UK': ['London'],
-                        'USA': ['New York']
-                      }
-    
     if not selected_country:
         return fig, title, cities_menu
     
-    elif selected_country.strip() in city_country_map:
+    elif selected_country.strip() in get_catalog()['hierarchy']:
         title = f"{selected_country.strip()} Monthly Average Casualties" 
         fig = monthly_casualties(accidents_df, selected_country.strip())
-        cities_menu = city_country_map[selected_country.strip()]
+        cities_menu = cities_for_country(selected_country.strip())
     
     return fig, title, cities_menu
 
 
-@callback(
+@job_callback(
     Output("prediction-output", "children"),
     Input("submit-assess-btn", "n_clicks"),
     State("country-dropdown", "value"),
@@ -322,9 +342,14 @@ def update_city_dropdown(selected_country):
     State("cause-dropdown", "value"),
     State("date-picker", "date"),
     State("hour-input", "value"),
+    running=[(Output("submit-assess-btn", "disabled"), True, False)],
+    cancel=[Input("model-dropdown", "value")],
     prevent_initial_call=True
 )
-def predict_casualties(n_clicks, country, city, lat, lon, vehicles, weather, road, cause, date, hour):
+@instrument
+def predict_casualties(set_progress, n_clicks, country, city, lat, lon, vehicles, weather, road, cause, date, hour):
+
+    import pandas as pd
 
     if not date:
         return "Please select a date."
@@ -349,6 +374,9 @@ def predict_casualties(n_clicks, country, city, lat, lon, vehicles, weather, roa
                     'Vehicles Involved': vehicles
                 }
 
+    # Load Feature Columns Names used in training
+    assessment_feature_columns = load_artifact('assessment_feature_columns')
+
     # One-hot encode city
     for col in assessment_feature_columns:
         if col.startswith("City_"):
@@ -380,51 +408,110 @@ def predict_casualties(n_clicks, country, city, lat, lon, vehicles, weather, roa
 
     # Predict
     try:
-        prediction = assessment_model.predict(df_input)[0]
+        with phase('model'):
+            prediction = predict('assessment_model', df_input)
         return f"Predicted Casualties: {int(prediction)}"
     
     except Exception as e:
         return f"Error during prediction: {str(e)}"
 
 
-@callback(
+@job_callback(
     Output("main-forecast-graph", "figure", allow_duplicate=True),
+    Output("forecast-live", "data", allow_duplicate=True),
     Input("month-slider", "value"),
     State("model-dropdown", "value"),
+    progress=[Output("forecast-progress", "value"), Output("forecast-progress", "label")],
+    progress_default=[100, ""],
+    running=[(Output("forecast-progress-container", "style"),
+              {"padding": "20px", "marginTop": "35px", "visibility": "visible"},
+              {"padding": "20px", "marginTop": "35px", "visibility": "hidden"})],
+    cancel=[Input("model-dropdown", "value")],
+    coalesce=True,
     prevent_initial_call=True
 )
-def generate_forecast(months, model_type):
+@instrument
+def generate_forecast(set_progress, months, model_type):
+
+    # The simulated paths, then the point forecast, fill one bar: each phase is half of it
+    def report_simulation(done, total):
+        set_progress((50 * done // total, f"{done}/{total} months simulated"))
+
+    def report_progress(done, total):
+        set_progress((50 + 50 * done // total, f"{done}/{total} months forecast"))
+
+    accidents_df = load_accidents()
+    sequence = live_sequence()
 
     if model_type == "forecast_accidents":
-        monthly_counts, last_known = get_accidents_features(accidents_df)
-        future_dates, future_predictions = forecast_interval(accidents_forecast_model, monthly_counts, months, last_known)
+        with phase('aggregate'):
+            monthly_counts, last_known = get_accidents_features(accidents_df)
+        with phase('model'):
+            model = load_artifact('accidents_forecasting_model')
+            _, bands = forecast_paths(model, monthly_counts, months, last_known, on_step=report_simulation)
+            future_dates, future_predictions = forecast_interval(model, monthly_counts, months, last_known, report_progress)
         x_col, y_col = monthly_counts['YearMonth'], monthly_counts['AccidentsCount']
         title = 'Accidents'
 
     elif model_type == "forecast_casualties":
-        monthly_counts, last_known = get_casualties_features(accidents_df)
-        future_dates, future_predictions = forecast_interval(casualties_forecast_model, monthly_counts, months, last_known)
+        with phase('aggregate'):
+            monthly_counts, last_known = get_casualties_features(accidents_df)
+        with phase('model'):
+            model = load_artifact('casualties_forecasting_model')
+            _, bands = forecast_paths(model, monthly_counts, months, last_known, on_step=report_simulation)
+            future_dates, future_predictions = forecast_interval(model, monthly_counts, months, last_known, report_progress)
         x_col, y_col = monthly_counts['YearMonth'], monthly_counts['Casualties']
         title = 'Casualties'
 
     else:
-        return go.Figure().update_layout(title="Invalid Model Selection")
+        return go.Figure().update_layout(title="Invalid Model Selection"), None
+
+    checkpoint()
+
+    # The forecast starts from the dataset; the history also shows the live incidents, drawn over the forecast
+    with phase('aggregate'):
+        monthly_history = history(monthly_counts, model_type, sequence)
 
     # Plotting forecast
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(x=x_col, y=y_col, mode='lines+markers', line=dict(color='#001f3f'), marker=dict(color='#001f3f'),  name='Historical'))
-    fig.add_trace(go.Scatter(x=future_dates, y=future_predictions, mode='lines+markers', name='Forecast'))
-
-    # Add dashed connector between last historical and first forecasted point
-    if len(x_col) > 0 and len(future_dates) > 0:
-        fig.add_trace(go.Scatter(
-                                    x=[x_col.iloc[-1], future_dates[0]],
-                                    y=[y_col.iloc[-1], future_predictions[0]],
-                                    mode='lines',
-                                    line=dict(color='#001f3f', dash='dash'),
-                                    showlegend=False
-                                ))
-
-    fig.update_layout(title='', xaxis_title='Date', yaxis_title=title, template='plotly_white')
-
-    return fig
\ No newline at end of file
+    with phase('figure'):
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=monthly_history.index, y=monthly_history.tolist(), mode='lines+markers', line=dict(color='#001f3f'), marker=dict(color='#001f3f'),  name='Historical'))
+        # Simulated 90% and 50% prediction intervals, drawn as bands under the forecast
+        for low, high, opacity in [(0.05, 0.95, 0.15), (0.25, 0.75, 0.3)]:
+            fig.add_trace(go.Scatter(x=future_dates, y=bands[high], mode='lines', line=dict(width=0), hoverinfo='skip', showlegend=False))
+            fig.add_trace(go.Scatter(x=future_dates, y=bands[low], mode='lines', line=dict(width=0), fill='tonexty',
+                                     fillcolor=f'rgba(128, 0, 32, {opacity})', name=f'{round((high - low) * 100)}% interval'))
+        fig.add_trace(go.Scatter(x=future_dates, y=future_predictions, mode='lines+markers', name='Forecast'))
+
+        # Add dashed connector between last historical and first forecasted point
+        if len(x_col) > 0 and len(future_dates) > 0:
+            fig.add_trace(go.Scatter(
+                                        x=[x_col.iloc[-1], future_dates[0]],
+                                        y=[monthly_history[x_col.iloc[-1]], future_predictions[0]],
+                                        mode='lines',
+                                        line=dict(color='#001f3f', dash='dash'),
+                                        showlegend=False
+                                    ))
+
+        fig.update_layout(title='', xaxis_title='Date', yaxis_title=title, template='plotly_white')
+
+    return fig, series_state(monthly_history.index, sequence)
+
+
+@callback(
+    Output("main-forecast-graph", "figure", allow_duplicate=True),
+    Output("forecast-live", "data", allow_duplicate=True),
+    Input("forecast-live-interval", "n_intervals"),
+    State("forecast-live", "data"),
+    State("model-dropdown", "value"),
+    prevent_initial_call=True
+)
+@instrument
+def extend_forecast_history(n_intervals, shown, model_type):
+    # Add the incidents received since the history was drawn to their months, without resending the figure
+    sequence = live_sequence()
+    if not shown or sequence <= shown['sequence']:
+        raise PreventUpdate
+    patch = Patch()
+    shown = extend_series(patch, shown, live_months(model_type, shown['sequence'], sequence), 'MS', sequence)
+    return patch, shown
\ No newline at end of file
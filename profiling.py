@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import threading
+from contextlib import contextmanager
+
+
+# Startup profiling is enabled with INCIDENTLYTICS_PROFILE_STARTUP=1 (or through `python profiling.py`)
+PROFILE_STARTUP = os.environ.get('INCIDENTLYTICS_PROFILE_STARTUP') == '1'
+
+# Recorded stages as [depth, name, seconds], in start order
+_stages = []
+_stage_depth = threading.local()
+
+# Code run in the profiled child interpreter: cold import, then first build of every page
+_CHILD_CODE = """
+import profiling
+with profiling.stage('import app'):
+    import app
+with profiling.stage('first Home request'):
+    app.server.test_client().get('/')
+    app.display_page('/')
+app.prewarm_pages()
+profiling.print_stages()
+"""
+
+
+
+
+@contextmanager
+def stage(name):
+
+    """
+    Time an initialization stage (data load, layout build, model load, ...).
+
+    The stage is only recorded when startup profiling is enabled, so the
+    context manager is cheap enough to leave in the loading code paths.
+    """
+
+    if not PROFILE_STARTUP:
+        yield
+        return
+
+    depth = getattr(_stage_depth, 'value', 0)
+    entry = [depth, name, None]
+    _stages.append(entry)
+    _stage_depth.value = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _stage_depth.value = depth
+        entry[2] = time.perf_counter() - start
+
+
+
+
+def print_stages(file=None):
+
+    """
+    Print the recorded stages, nested stages indented under their parent.
+    """
+
+    file = file or sys.stdout
+    print("Initialization stages (seconds):", file=file)
+
+    for depth, name, seconds in _stages:
+        if seconds is not None:
+            print(f"  {'  ' * depth}{name:<{48 - 2 * depth}} {seconds:8.3f}", file=file)
+
+
+
+
+def parse_importtime(stderr_text):
+
+    """
+    Parse the output of `python -X importtime` into a list of
+    (module, self seconds, cumulative seconds, depth) tuples.
+    """
+
+    modules = []
+    for line in stderr_text.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return modules
+
+
+
+
+def profile_startup(top=20):
+
+    """
+    Profile a cold start of the dashboard in a fresh interpreter.
+
+    Reports the slowest modules by cumulative and self import time, the
+    cost of each top-level import of `app`, and the initialization stages
+    (data load, layout build, model load) of every page.
+    """
+
+    env = {**os.environ, 'INCIDENTLYTICS_PROFILE_STARTUP': '1'}
+    env.pop('INCIDENTLYTICS_PREWARM', None)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _CHILD_CODE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(result.returncode)
+
+    modules = parse_importtime(result.stderr)
+
+    print(f"Slowest {top} imports by cumulative time (seconds):")
+    for name, _, cumulative, _ in sorted(modules, key=lambda m: m[2], reverse=True)[:top]:
+        print(f"  {name:<48} {cumulative:8.3f}")
+
+    print(f"\nSlowest {top} imports by self time (seconds):")
+    for name, self_time, _, _ in sorted(modules, key=lambda m: m[1], reverse=True)[:top]:
+        print(f"  {name:<48} {self_time:8.3f}")
+
+    # importtime lists children before their parent, so the direct imports of
+    # `app` are the depth-1 modules reported since the previous top-level import
+    print("\nImports made by app.py (seconds):")
+    children = []
+    for name, _, cumulative, depth in modules:
+        if depth == 1:
+            children.append((name, cumulative))
+        elif depth == 0:
+            if name == 'app':
+                for child_name, child_cumulative in children:
+                    print(f"  {child_name:<48} {child_cumulative:8.3f}")
+                print(f"  {'(total)':<48} {cumulative:8.3f}")
+            children = []
+
+    print()
+    print(result.stdout, end='')
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the dashboard's cold start.")
+    parser.add_argument('--top', type=int, default=20, help="number of modules to list")
+    args = parser.parse_args()
+    profile_startup(args.top)
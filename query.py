@@ -0,0 +1,360 @@
+import os
+import json
+import warnings
+import threading
+
+from data import DATASET_PATH, get_data_version, load_accidents
+from profiling import stage
+from metrics import phase
+from coalescing import shared
+
+
+# Engine answering the dashboard's filter + group-by queries: 'pandas', 'duckdb', 'sqlite' or 'parquet'
+QUERY_BACKEND = os.environ.get('INCIDENTLYTICS_QUERY_BACKEND', 'pandas')
+
+# DuckDB database file (':memory:' keeps it in RAM; a file, suffixed with the data version, lets DuckDB spill and persist the table)
+DUCKDB_PATH = os.environ.get('INCIDENTLYTICS_DUCKDB_PATH', ':memory:')
+
+QUERY_BACKENDS = ['pandas', 'duckdb', 'sqlite', 'parquet']
+
+# Columns loaded into the SQL engines, which filters and groupings may use
+QUERY_COLUMNS = [
+    'Date', 'Year', 'Month_Num', 'Hour', 'Country', 'City', 'Location', 'Weather Condition',
+    'Road Condition', 'Cause', 'Severity', 'Time Segment', 'Casualties', 'Vehicles Involved'
+]
+
+# Filter conditions of each SQL dialect, with named parameters
+_CONDITIONS = {
+    'duckdb': [
+        '($start_date IS NULL OR "Date" >= $start_date)',
+        '($end_date IS NULL OR "Date" <= $end_date)',
+        '($countries::VARCHAR[] IS NULL OR list_contains($countries::VARCHAR[], "Country"))',
+        '($weather::VARCHAR[] IS NULL OR list_contains($weather::VARCHAR[], "Weather Condition"))',
+    ],
+    'sqlite': [
+        '(:start_date IS NULL OR "Date" >= :start_date)',
+        '(:end_date IS NULL OR "Date" <= :end_date)',
+        '(:countries IS NULL OR "Country" IN (SELECT value FROM json_each(:countries)))',
+        '(:weather IS NULL OR "Weather Condition" IN (SELECT value FROM json_each(:weather)))',
+    ],
+}
+
+# Loaded engine state: backend -> (data version, database handle)
+_engines = {}
+_engines_lock = threading.Lock()
+
+# Per-thread connections: backend -> (database handle, connection)
+_connections = threading.local()
+
+
+
+
+def get_backend():
+    # Backend in use; DuckDB falls back to SQLite when it is not installed
+    backend = QUERY_BACKEND if QUERY_BACKEND in QUERY_BACKENDS else 'pandas'
+    if backend == 'duckdb':
+        try:
+            import duckdb
+        except ImportError:
+            warnings.warn("INCIDENTLYTICS_QUERY_BACKEND=duckdb needs `pip install duckdb`; using SQLite instead")
+            backend = 'sqlite'
+    return backend
+
+
+
+
+@shared
+def filter_accidents(start_date=None, end_date=None, countries=None, weather=None):
+
+    """
+    Return the rows of the preprocessed accidents matching the dashboard filters.
+
+    Missing bounds and empty selections do not filter. Concurrent identical calls
+    (e.g. the three Home charts) share one computation.
+    """
+
+    accidents_df = load_accidents()
+    with phase('filter'):
+        filtered = accidents_df
+        if start_date:
+            filtered = filtered[filtered['Date'] >= start_date]
+        if end_date:
+            filtered = filtered[filtered['Date'] <= end_date]
+        if weather:
+            filtered = filtered[filtered['Weather Condition'].isin(weather)]
+        if countries:
+            filtered = filtered[filtered['Country'].isin(countries)]
+    return filtered
+
+
+
+
+def _aggregate_pandas(by, filters, sums, top):
+    filtered = filter_accidents(filters['start_date'], filters['end_date'], filters['countries'], filters['weather'])
+    with phase('aggregate'):
+        if len(by) == 1 and not sums:
+            # Counting one column is faster with value_counts than with a group-by
+            result = filtered[by[0]].value_counts(sort=False).sort_index().rename('Count').rename_axis(by[0]).to_frame()
+        else:
+            grouped = filtered.groupby(by, observed=True)
+            result = grouped.size().rename('Count').to_frame()
+            for column in sums:
+                result[column] = grouped[column].sum()
+        result = result.reset_index()
+        if top is not None:
+            result = result.sort_values('Count', ascending=False, kind='stable').head(top).reset_index(drop=True)
+    return result
+
+
+
+
+def _aggregate_parquet(by, filters, sums, top):
+    # Out of core: only the selected partitions, row groups and columns of the store are read
+    from store import scan
+
+    with phase('filter'):
+        table = scan([*by, *sums], filters['start_date'], filters['end_date'], filters['countries'], filters['weather'])
+    with phase('aggregate'):
+        grouped = table.group_by(by).aggregate([([], 'count_all')] + [(column, 'sum') for column in sums])
+        result = grouped.to_pandas().rename(columns={'count_all': 'Count', **{f'{column}_sum': column for column in sums}})
+        for column in by:
+            if result[column].dtype == 'category':
+                result[column] = result[column].astype('str')
+        result = result[[*by, 'Count', *sums]].sort_values(by, kind='stable').reset_index(drop=True)
+        if top is not None:
+            result = result.sort_values('Count', ascending=False, kind='stable').head(top).reset_index(drop=True)
+    return result
+
+
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+
+
+def build_sql(backend, by, sums=(), top=None):
+
+    """
+    Build the parameterized SQL statement of a query shape.
+
+    The statement text depends only on the grouping, the summed columns and the
+    limit, never on the filter values, so each engine reuses its prepared statement
+    across requests.
+    """
+
+    keys = ', '.join(_quote(column) for column in by)
+    columns = [keys, 'COUNT(*) AS "Count"'] + [f'CAST(SUM({_quote(column)}) AS BIGINT) AS {_quote(column)}' for column in sums]
+    sql = f'SELECT {", ".join(columns)} FROM accidents WHERE {" AND ".join(_CONDITIONS[backend])} GROUP BY {keys}'
+    if top is not None:
+        sql += f' ORDER BY "Count" DESC, {keys} LIMIT {int(top)}'
+    else:
+        sql += f' ORDER BY {keys}'
+    return sql
+
+
+
+
+def _duckdb_file(version):
+    # One database file per data version next to DUCKDB_PATH, so that a new version never
+    # needs write access to a file the other workers have open read-only
+    root, extension = os.path.splitext(DUCKDB_PATH)
+    return f'{root}-{version}{extension or ".duckdb"}'
+
+
+
+
+def _create_duckdb_table(database):
+    # Load the query columns from the Parquet store, which DuckDB streams without the dataset in memory
+    from store import open_store
+
+    files = open_store().files
+    columns = ', '.join(_quote(column) for column in QUERY_COLUMNS)
+    database.execute(f'CREATE OR REPLACE TABLE accidents AS SELECT {columns} FROM read_parquet(?, hive_partitioning = true)', [files])
+
+
+
+
+def _load_duckdb(version):
+
+    """
+    Open the DuckDB database of a data version, building it first if needed.
+
+    Notes
+    -----
+    - The table is loaded from the Parquet store (built from the CSV chunk by chunk
+      if needed), never from the preprocessed frame, so with a database file the
+      dataset does not have to fit in memory.
+    - DuckDB lets only one process write a database file. The first worker builds
+      the file of a new data version under a file lock, into a temporary file renamed
+      when complete; every worker then opens it read-only.
+    """
+
+    import glob
+    import duckdb
+    from locks import file_lock
+
+    if DUCKDB_PATH == ':memory:':
+        database = duckdb.connect(':memory:')
+        _create_duckdb_table(database)
+        return database
+
+    database_file = _duckdb_file(version)
+    if not os.path.exists(database_file):
+        with file_lock(f'{DUCKDB_PATH}.lock'):
+            if not os.path.exists(database_file):
+                tmp_file = f'{database_file}.{os.getpid()}.tmp'
+                builder = duckdb.connect(tmp_file)
+                try:
+                    _create_duckdb_table(builder)
+                finally:
+                    builder.close()
+                os.replace(tmp_file, database_file)
+                for stale in glob.glob(_duckdb_file('*')):
+                    if stale != database_file:
+                        os.remove(stale)
+    return duckdb.connect(database_file, read_only=True)
+
+
+
+
+def _load_sqlite(version):
+    import sqlite3
+
+    # A shared in-memory database, alive as long as this connection is open
+    uri = f'file:incidentlytics-{version}?mode=memory&cache=shared'
+    database = sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    frame = load_accidents()[QUERY_COLUMNS].copy()
+    frame['Date'] = frame['Date'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    frame.to_sql('accidents', database, index=False, if_exists='replace', chunksize=100_000)
+    database.execute('CREATE INDEX IF NOT EXISTS accidents_date ON accidents ("Date")')
+    database.commit()
+    return database, uri
+
+
+
+
+def _get_connection(backend, path=DATASET_PATH):
+    # Load the engine once per data version, then hand each thread its own connection
+    version = get_data_version(path)
+    engine = _engines.get(backend)
+    if engine is None or engine[0] != version:
+        with _engines_lock:
+            engine = _engines.get(backend)
+            if engine is None or engine[0] != version:
+                with stage(f'query engine load: {backend}'):
+                    database = _load_duckdb(version) if backend == 'duckdb' else _load_sqlite(version)
+                if engine is not None:
+                    old = engine[1][0] if backend == 'sqlite' else engine[1]
+                    old.close()
+                engine = _engines[backend] = (version, database)
+
+    database = engine[1]
+    cached = getattr(_connections, backend, None)
+    if cached is None or cached[0] is not database:
+        if backend == 'duckdb':
+            connection = database.cursor()
+        else:
+            import sqlite3
+            connection = sqlite3.connect(database[1], uri=True, check_same_thread=False, cached_statements=256)
+        cached = (database, connection)
+        setattr(_connections, backend, cached)
+    return cached[1]
+
+
+
+
+def _aggregate_sql(backend, by, filters, sums, top):
+    import pandas as pd
+
+    connection = _get_connection(backend)
+    sql = build_sql(backend, by, sums, top)
+
+    if backend == 'duckdb':
+        params = {**filters, 'start_date': _timestamp(filters['start_date']), 'end_date': _timestamp(filters['end_date'])}
+        with phase('aggregate'):
+            return connection.execute(sql, params).df()
+
+    params = {
+        'start_date': _timestamp(filters['start_date'], text=True),
+        'end_date': _timestamp(filters['end_date'], text=True),
+        'countries': json.dumps(filters['countries']) if filters['countries'] else None,
+        'weather': json.dumps(filters['weather']) if filters['weather'] else None,
+    }
+    with phase('aggregate'):
+        rows = connection.execute(sql, params).fetchall()
+        result = pd.DataFrame(rows, columns=[*by, 'Count', *sums])
+        if 'Date' in by:
+            result['Date'] = pd.to_datetime(result['Date'])
+    return result
+
+
+
+
+def _timestamp(value, text=False):
+    import pandas as pd
+
+    if not value:
+        return None
+    value = pd.Timestamp(value)
+    return value.strftime('%Y-%m-%d %H:%M:%S') if text else value.to_pydatetime()
+
+
+
+
+def aggregate(by, start_date=None, end_date=None, countries=None, weather=None, sums=(), top=None):
+
+    """
+    Count the accidents matching the dashboard filters, grouped by `by`.
+
+    Args:
+
+    by : list of str
+        The grouping columns (from `QUERY_COLUMNS`).
+
+    start_date, end_date : str, optional
+        The inclusive date bounds; None does not filter.
+
+    countries, weather : list of str, optional
+        The selected countries and weather conditions; None or empty does not filter.
+
+    sums : list of str
+        Numeric columns summed per group (e.g. 'Casualties').
+
+    top : int, optional
+        Keep only the `top` largest groups.
+
+    Returns:
+
+    result : pandas.DataFrame
+        The columns `by`, 'Count' and `sums`, one row per group, sorted by the
+        grouping columns, or by decreasing count (ties by the grouping columns) with `top`.
+
+    Notes
+    -----
+    - The backend is chosen with INCIDENTLYTICS_QUERY_BACKEND. 'pandas' filters the
+      in-memory frame; 'duckdb' and 'sqlite' push the filters and the group-by down
+      as parameterized SQL, with one connection per worker thread; 'parquet' scans the
+      partitioned store of `store.py` without loading the dataset in memory.
+    - Every backend returns the same frame for the same query.
+    """
+
+    for column in [*by, *sums]:
+        if column not in QUERY_COLUMNS:
+            raise ValueError(f"Unknown column '{column}'")
+
+    filters = {
+        'start_date': start_date,
+        'end_date': end_date,
+        'countries': list(countries) if countries else None,
+        'weather': list(weather) if weather else None,
+    }
+
+    backend = get_backend()
+    if backend == 'pandas':
+        return _aggregate_pandas(list(by), filters, list(sums), top)
+    if backend == 'parquet':
+        return _aggregate_parquet(list(by), filters, list(sums), top)
+    return _aggregate_sql(backend, list(by), filters, list(sums), top)
@@ -0,0 +1,126 @@
+import os
+import glob
+import warnings
+import hashlib
+import tempfile
+
+from data import DATASET_PATH, get_data_version, data_preprocess
+from profiling import stage
+from locks import file_lock
+
+
+# Preload mode: the preprocessed dataset is written once to shared memory and mapped by every worker
+SHARED_DATASET_ENABLED = os.environ.get('INCIDENTLYTICS_SHARED_DATASET', '0') == '1'
+
+# Directory of the shared files; /dev/shm is memory-backed, so mapping it reads no disk
+SHARED_DIR = os.environ.get('INCIDENTLYTICS_SHARED_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+
+# Column holding the YearMonth periods as month ordinals (Arrow has no period type)
+ORDINAL_COLUMN = '_YearMonth_ordinal'
+
+
+
+
+def _shared_prefix(path):
+    # Prefix of the shared files of one dataset
+    return os.path.join(SHARED_DIR, f"incidentlytics-{hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]}")
+
+
+
+
+def shared_path(path=DATASET_PATH, version=None):
+    # One file per dataset and data version, so a rewritten CSV never reuses a stale file
+    return f'{_shared_prefix(path)}-{version or get_data_version(path)}.arrow'
+
+
+
+
+def publish_dataset(path=DATASET_PATH):
+
+    """
+    Preprocess the dataset and write it as an Arrow IPC file to `SHARED_DIR`.
+
+    Returns:
+
+    shared_file : str
+        The written file; files of older data versions of the dataset are removed.
+
+    Notes
+    -----
+    - The file is written under a temporary name and renamed, so readers never see
+      a partial file. Files still mapped by running workers stay readable after
+      their removal, until the workers unmap them.
+    - Strings are stored as large_string, the storage of pandas' string dtype, so
+      that mapping them needs no conversion.
+    """
+
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    version = get_data_version(path)
+    shared_file = shared_path(path, version)
+
+    with stage('shared dataset publish'):
+        accidents_df = data_preprocess(path)
+        ordinals = accidents_df['YearMonth'].array.asi8
+        accidents_df = accidents_df.drop(columns=['YearMonth']).assign(**{ORDINAL_COLUMN: ordinals})
+        table = pa.Table.from_pandas(accidents_df, preserve_index=False)
+        del accidents_df
+
+        tmp_file = f'{shared_file}.{os.getpid()}.tmp'
+        with ipc.new_file(tmp_file, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_file, shared_file)
+
+    for stale in glob.glob(f'{_shared_prefix(path)}-*.arrow'):
+        if stale != shared_file:
+            os.remove(stale)
+    return shared_file
+
+
+
+
+def ensure_published(path=DATASET_PATH):
+    # Publish the current data version unless a process already did (concurrent callers wait for it)
+    shared_file = shared_path(path)
+    if not os.path.exists(shared_file):
+        with file_lock(f'{_shared_prefix(path)}.lock'):
+            if not os.path.exists(shared_file):
+                publish_dataset(path)
+    return shared_file
+
+
+
+
+def map_dataset(path=DATASET_PATH):
+
+    """
+    Return the preprocessed accidents mapped zero-copy from the shared Arrow file.
+
+    The first process needing a data version that has no shared file yet publishes
+    it (under a file lock, so concurrent workers preprocess the dataset only once);
+    every process then maps the same file.
+
+    Notes
+    -----
+    - Numeric, date and string columns are views on the mapped file, so the
+      dataset's memory is shared by every worker instead of copied per worker.
+      The mapped columns are read-only; pandas copies a column written to.
+    - String columns are only views with pandas>=3, whose default string dtype is
+      stored by Arrow; older versions convert them to Python objects in every worker.
+    """
+
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    if int(pd.__version__.split('.')[0]) < 3:
+        warnings.warn("The shared dataset needs pandas>=3 to map string columns; each worker copies them instead")
+
+    shared_file = ensure_published(path)
+    with stage('shared dataset map'):
+        table = ipc.open_file(pa.memory_map(shared_file)).read_all()
+        accidents_df = table.to_pandas(split_blocks=True)
+        ordinals = accidents_df.pop(ORDINAL_COLUMN).to_numpy()
+        accidents_df['YearMonth'] = pd.arrays.PeriodArray(ordinals, dtype=pd.PeriodDtype('M'))
+    return accidents_df
@@ -0,0 +1,214 @@
+import threading
+
+import numpy as np
+
+from data import DATASET_PATH, get_data_version, load_accidents
+from profiling import stage
+from metrics import phase
+
+
+# Grid cell sizes (degrees) of the index, from the whole world down to city blocks
+RESOLUTIONS = [8, 4, 2, 1, 0.5, 0.25, 0.1, 0.05, 0.02, 0.01]
+
+# Approximate on-screen size (pixels) of one density cell
+CELL_PIXELS = 8
+
+# Most cells sent to the browser for one view
+MAX_CELLS = 20_000
+
+# Cache of spatial indexes keyed by path -> (data version, index)
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+
+
+def cell_ids(latitude, longitude, resolution):
+    # Row-major id of the grid cell of each point (rows from the south pole, columns from the antimeridian)
+    n_columns = int(round(360 / resolution))
+    rows = np.floor((np.clip(latitude, -90, 89.999999) + 90) / resolution).astype(np.int64)
+    columns = np.floor((np.mod(np.asarray(longitude) + 180, 360)) / resolution).astype(np.int64)
+    return rows * n_columns + np.minimum(columns, n_columns - 1)
+
+
+
+
+def cell_centers(cells, resolution):
+    # (latitude, longitude) of the centre of each grid cell
+    n_columns = int(round(360 / resolution))
+    rows, columns = np.divmod(cells, n_columns)
+    return (rows + 0.5) * resolution - 90, (columns + 0.5) * resolution - 180
+
+
+
+
+def build_spatial_index(accidents_df):
+
+    """
+    Index every incident in a lat/lon grid at each of the `RESOLUTIONS`.
+
+    Args:
+
+    accidents_df : pandas.DataFrame
+        The preprocessed DataFrame returned by `data_preprocess`.
+
+    Returns:
+
+    index : dict
+        For each resolution (same order as `RESOLUTIONS`):
+        - 'codes': for every row, the position of its cell in 'cells' (int32),
+        - 'cells': the ids of the non-empty cells.
+
+    Notes
+    -----
+    - Densities are then `np.bincount` over the codes of the selected rows, which
+      never materializes a grid larger than the non-empty cells.
+    """
+
+    import pandas as pd
+
+    latitude = accidents_df['Latitude'].to_numpy(dtype=float)
+    longitude = accidents_df['Longitude'].to_numpy(dtype=float)
+
+    index = {'codes': [], 'cells': []}
+    for resolution in RESOLUTIONS:
+        codes, cells = pd.factorize(cell_ids(latitude, longitude, resolution))
+        index['codes'].append(codes.astype(np.int32))
+        index['cells'].append(np.asarray(cells, dtype=np.int64))
+    return index
+
+
+
+
+def get_spatial_index(path=DATASET_PATH):
+
+    """
+    Return the spatial index of the dataset, building it once per data version.
+    """
+
+    version = get_data_version(path)
+    cached = _index_cache.get(path)
+    if cached is None or cached[0] != version:
+        with _index_lock:
+            cached = _index_cache.get(path)
+            if cached is None or cached[0] != version:
+                accidents_df = load_accidents(path)
+                with stage('spatial index build'):
+                    cached = _index_cache[path] = (version, build_spatial_index(accidents_df))
+    return cached[1]
+
+
+
+
+def resolution_for_zoom(zoom):
+    # Finest resolution whose cells still span about CELL_PIXELS on screen at this zoom level
+    target = 360 * CELL_PIXELS / (256 * 2 ** (zoom or 0))
+    for level, resolution in enumerate(RESOLUTIONS):
+        if resolution < target:
+            return max(level - 1, 0)
+    return len(RESOLUTIONS) - 1
+
+
+
+
+def view_from_relayout(relayout_data):
+
+    """
+    Extract (zoom, bounds) from the relayoutData of a map figure.
+
+    Bounds are (lat_min, lat_max, lon_min, lon_max), or None for the whole world.
+    """
+
+    relayout_data = relayout_data or {}
+    zoom = relayout_data.get('map.zoom', 0)
+    corners = (relayout_data.get('map._derived') or {}).get('coordinates')
+    if not corners:
+        return zoom, None
+
+    longitudes = [corner[0] for corner in corners]
+    latitudes = [corner[1] for corner in corners]
+    return zoom, (min(latitudes), max(latitudes), min(longitudes), max(longitudes))
+
+
+
+
+def density(start_date=None, end_date=None, countries=None, weather=None, zoom=0, bounds=None):
+
+    """
+    Count the incidents matching the dashboard filters per grid cell of the view.
+
+    Args:
+
+    start_date, end_date, countries, weather :
+        The dashboard filters, as for `query.aggregate`.
+
+    zoom : float
+        The map zoom level, which picks the grid resolution.
+
+    bounds : tuple, optional
+        (lat_min, lat_max, lon_min, lon_max) of the view; cells outside are dropped.
+
+    Returns:
+
+    cells : pandas.DataFrame
+        The 'Latitude' and 'Longitude' of each non-empty cell centre and its 'Count'.
+
+    resolution : float
+        The cell size in degrees.
+
+    Notes
+    -----
+    - With the 'parquet' query backend the coordinates of the matching incidents are
+      scanned from the store and binned on the fly instead of through the index.
+    - When the view holds more than `MAX_CELLS` cells the resolution is coarsened.
+    """
+
+    import pandas as pd
+    from query import get_backend, filter_accidents
+
+    level = resolution_for_zoom(zoom)
+
+    if get_backend() == 'parquet':
+        from store import scan
+        with phase('filter'):
+            table = scan(['Latitude', 'Longitude'], start_date, end_date, countries, weather)
+            latitude = table['Latitude'].to_numpy()
+            longitude = table['Longitude'].to_numpy()
+        with phase('aggregate'):
+            while True:
+                resolution = RESOLUTIONS[level]
+                cells, counts = np.unique(cell_ids(latitude, longitude, resolution), return_counts=True)
+                cells, counts = _in_view(cells, counts, resolution, bounds)
+                if len(cells) <= MAX_CELLS or level == 0:
+                    break
+                level -= 1
+    else:
+        index = get_spatial_index()
+        filtered = filter_accidents(start_date, end_date, countries, weather)
+        with phase('aggregate'):
+            # The preprocessed frame keeps its default RangeIndex, so labels are row positions
+            rows = filtered.index.to_numpy()
+            while True:
+                resolution = RESOLUTIONS[level]
+                all_counts = np.bincount(index['codes'][level][rows], minlength=len(index['cells'][level]))
+                present = np.flatnonzero(all_counts)
+                cells, counts = _in_view(index['cells'][level][present], all_counts[present], resolution, bounds)
+                if len(cells) <= MAX_CELLS or level == 0:
+                    break
+                level -= 1
+
+    latitude, longitude = cell_centers(cells, resolution)
+    return pd.DataFrame({'Latitude': latitude, 'Longitude': longitude, 'Count': counts}), resolution
+
+
+
+
+def _in_view(cells, counts, resolution, bounds):
+    # Keep the cells whose centre lies in the view, with a margin of one cell
+    if bounds is None:
+        return cells, counts
+    lat_min, lat_max, lon_min, lon_max = bounds
+    latitude, longitude = cell_centers(cells, resolution)
+    inside = ((latitude >= lat_min - resolution) & (latitude <= lat_max + resolution) &
+              (longitude >= lon_min - resolution) & (longitude <= lon_max + resolution))
+    return cells[inside], counts[inside]
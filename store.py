@@ -0,0 +1,218 @@
+import os
+import shutil
+import argparse
+import tempfile
+import threading
+
+from data import DATASET_PATH, get_data_version, preprocess_frame
+from profiling import stage
+from locks import file_lock
+
+
+# Directory of the partitioned Parquet store built from the dataset
+STORE_DIR = os.environ.get('INCIDENTLYTICS_STORE', 'dataset/store')
+
+# Also partition the store by Country (many more, smaller files; prunes country filters)
+PARTITION_COUNTRY = os.environ.get('INCIDENTLYTICS_STORE_BY_COUNTRY', '0') == '1'
+
+# CSV rows read and preprocessed at a time while building the store
+BUILD_CHUNK_ROWS = 1_000_000
+
+# Rows per Parquet row group; files are sorted by Date so row groups prune day ranges
+ROW_GROUP_ROWS = 64 * 1024
+
+# Text columns read back dictionary-encoded, which groups them much faster than plain strings
+DICTIONARY_COLUMNS = ['Country', 'City', 'Location', 'Weather Condition', 'Road Condition', 'Cause', 'Severity', 'Time Segment']
+
+# File recording the data version the store was built from
+VERSION_FILE = '_version'
+
+# Opened datasets keyed by store directory -> (data version, pyarrow dataset)
+_dataset_cache = {}
+_dataset_lock = threading.Lock()
+
+
+
+
+def build_store(path=DATASET_PATH, store_dir=STORE_DIR, partition_country=PARTITION_COUNTRY, chunk_rows=BUILD_CHUNK_ROWS):
+
+    """
+    Preprocess the accidents CSV chunk by chunk into a Parquet store partitioned by
+    Year / Month_Num (and optionally Country), without holding the whole file in memory.
+
+    Args:
+
+    path : str
+        The accidents CSV.
+
+    store_dir : str
+        The store directory; it is replaced once the new store is complete. Hold
+        `store_lock` while building, so that concurrent builds do not interleave.
+
+    partition_country : bool
+        Add a Country level below Year / Month_Num.
+
+    chunk_rows : int
+        The number of CSV rows read and preprocessed at a time, which bounds memory use.
+
+    Returns:
+
+    version : str
+        The data version of the CSV the store was built from.
+
+    Notes
+    -----
+    - The store holds every column of `data_preprocess` except the YearMonth period,
+      which Parquet cannot represent and which is derived from Date.
+    - Partitions use hive-style directories (Year=2024/Month_Num=3/...), so any
+      Parquet reader recovers the partition columns.
+    """
+
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    version = get_data_version(path)
+    partition_columns = ['Year', 'Month_Num'] + (['Country'] if partition_country else [])
+    # A directory of this build only, next to the store so that it can be renamed into place
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(store_dir.rstrip('/')) + '.tmp-', dir=parent)
+
+    partitioning = None
+    for index, chunk in enumerate(pd.read_csv(path, chunksize=chunk_rows)):
+        chunk = preprocess_frame(chunk).drop(columns=['YearMonth']).sort_values('Date', kind='stable')
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if partitioning is None:
+            partitioning = ds.partitioning(pa.schema([table.schema.field(column) for column in partition_columns]), flavor='hive')
+        ds.write_dataset(
+            table, tmp_dir, format='parquet', partitioning=partitioning,
+            basename_template=f'part-{index}-{{i}}.parquet',
+            existing_data_behavior='overwrite_or_ignore',
+            min_rows_per_group=ROW_GROUP_ROWS, max_rows_per_group=ROW_GROUP_ROWS,
+        )
+
+    with open(os.path.join(tmp_dir, VERSION_FILE), 'w') as file:
+        file.write(version)
+
+    # Move the old store aside before renaming the new one into place, then delete it
+    old_dir = tmp_dir + '.old'
+    if os.path.exists(store_dir):
+        os.replace(store_dir, old_dir)
+    os.replace(tmp_dir, store_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return version
+
+
+
+
+def store_lock(store_dir=STORE_DIR):
+    # Lock file next to the store, held across processes while it is built
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    os.makedirs(parent, exist_ok=True)
+    return file_lock(os.path.abspath(store_dir).rstrip('/') + '.lock')
+
+
+
+
+def store_version(store_dir=STORE_DIR):
+    # Data version the store was built from (None if there is no complete store)
+    try:
+        with open(os.path.join(store_dir, VERSION_FILE)) as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+
+
+def open_store(path=DATASET_PATH, store_dir=STORE_DIR):
+
+    """
+    Return the store as a pyarrow dataset, (re)building it when the CSV changed.
+    """
+
+    import pyarrow.dataset as ds
+
+    version = get_data_version(path)
+    cached = _dataset_cache.get(store_dir)
+    if cached is None or cached[0] != version:
+        with _dataset_lock:
+            cached = _dataset_cache.get(store_dir)
+            if cached is None or cached[0] != version:
+                if store_version(store_dir) != version:
+                    # Workers starting together build the store once: the others wait for the
+                    # lock, then find the store built
+                    with store_lock(store_dir):
+                        if store_version(store_dir) != version:
+                            with stage('store build'):
+                                build_store(path, store_dir)
+                file_format = ds.ParquetFileFormat(read_options=ds.ParquetReadOptions(dictionary_columns=DICTIONARY_COLUMNS))
+                dataset = ds.dataset(store_dir, format=file_format, partitioning='hive', exclude_invalid_files=True)
+                cached = _dataset_cache[store_dir] = (version, dataset)
+    return cached[1]
+
+
+
+
+def filter_expression(start_date=None, end_date=None, countries=None, weather=None):
+
+    """
+    Build the pyarrow filter of the dashboard filters.
+
+    The Year / Month_Num (and Country) terms only involve partition columns, so
+    pyarrow skips the partitions outside the selection without opening them; the
+    Date terms then skip row groups through their statistics.
+    """
+
+    import pandas as pd
+    import pyarrow.dataset as ds
+
+    year, month = ds.field('Year'), ds.field('Month_Num')
+    terms = []
+    if start_date:
+        start = pd.Timestamp(start_date)
+        terms.append((year > start.year) | ((year == start.year) & (month >= start.month)))
+        terms.append(ds.field('Date') >= start.to_pydatetime())
+    if end_date:
+        end = pd.Timestamp(end_date)
+        terms.append((year < end.year) | ((year == end.year) & (month <= end.month)))
+        terms.append(ds.field('Date') <= end.to_pydatetime())
+    if countries:
+        terms.append(ds.field('Country').isin(list(countries)))
+    if weather:
+        terms.append(ds.field('Weather Condition').isin(list(weather)))
+
+    expression = None
+    for term in terms:
+        expression = term if expression is None else expression & term
+    return expression
+
+
+
+
+def scan(columns, start_date=None, end_date=None, countries=None, weather=None):
+
+    """
+    Read only `columns` of the accidents matching the filters, as a pyarrow Table.
+
+    Text columns come back dictionary-encoded, with one dictionary per column.
+    """
+
+    dataset = open_store()
+    table = dataset.to_table(columns=list(columns), filter=filter_expression(start_date, end_date, countries, weather))
+    return table.unify_dictionaries()
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the partitioned Parquet store of the accidents dataset.")
+    parser.add_argument('--dataset', default=DATASET_PATH, help="accidents CSV to preprocess")
+    parser.add_argument('--store', default=STORE_DIR, help="output store directory")
+    parser.add_argument('--by-country', action='store_true', default=PARTITION_COUNTRY, help="also partition by Country")
+    parser.add_argument('--chunk-rows', type=int, default=BUILD_CHUNK_ROWS, help="CSV rows preprocessed at a time")
+    args = parser.parse_args()
+    with store_lock(args.store):
+        version = build_store(args.dataset, args.store, args.by_country, args.chunk_rows)
+    print(f"Store {args.store} built from data version {version}")
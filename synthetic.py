@@ -0,0 +1,217 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+
+# Column order of dataset/global_traffic_accidents.csv
+COLUMNS = [
+    'Accident ID', 'Date', 'Time', 'Location', 'Latitude', 'Longitude',
+    'Weather Condition', 'Road Condition', 'Vehicles Involved', 'Casualties', 'Cause'
+]
+
+# "City, Country" locations of the dataset with their (latitude, longitude)
+LOCATIONS = {
+    'Beijing, China': (39.9042, 116.4074),
+    'Berlin, Germany': (52.5200, 13.4050),
+    'London, UK': (51.5074, -0.1278),
+    'Mumbai, India': (19.0760, 72.8777),
+    'New York, USA': (40.7128, -74.0060),
+    'Paris, France': (48.8566, 2.3522),
+    'Sydney, Australia': (-33.8688, 151.2093),
+    'São Paulo, Brazil': (-23.5505, -46.6333),
+    'Tokyo, Japan': (35.6762, 139.6503),
+    'Toronto, Canada': (43.6532, -79.3832),
+}
+
+WEATHER_CONDITIONS = ['Clear', 'Fog', 'Hail', 'Rain', 'Snow', 'Storm']
+ROAD_CONDITIONS = ['Dry', 'Gravel', 'Icy', 'Snowy', 'Under Construction', 'Wet']
+CAUSES = ['Distracted Driving', 'Drunk Driving', 'Mechanical Failure', 'Reckless Driving', 'Speeding', 'Weather Conditions']
+
+# Relative accident frequency per hour of day (night lull, morning and evening rush)
+HOUR_WEIGHTS = np.array([
+    2, 1.5, 1.2, 1, 1.2, 2, 4, 7, 8, 6, 5, 5,
+    5.5, 5.5, 5.5, 6, 7.5, 8.5, 8, 6, 4.5, 3.5, 3, 2.5
+])
+
+# Spread (degrees) of incident coordinates around their city centre
+LOCATION_SPREAD = 0.15
+
+# Hex digits used to format Accident IDs
+_HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype='S1')
+
+
+
+
+def _accident_ids(start, n_rows, seed):
+
+    # Unique 8-digit hex IDs: an odd multiplier is a bijection modulo 2**32
+    counter = (np.arange(start, start + n_rows, dtype=np.uint64) + np.uint64(seed)) * np.uint64(2654435761)
+    values = (counter & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+    shifts = np.arange(28, -4, -4, dtype=np.uint32)
+    digits = _HEX_DIGITS[(values[:, None] >> shifts) & 0xF]
+    return digits.view('S8').ravel().astype(str)
+
+
+
+
+def generate_chunk(n_rows, rng, start_date='2023-01-01', end_date='2024-12-31', id_offset=0, seed=0):
+
+    """
+    Generate `n_rows` synthetic accidents with the columns of the bundled dataset.
+
+    Args:
+
+    n_rows : int
+        The number of incidents to generate.
+
+    rng : numpy.random.Generator
+        The random generator to draw from.
+
+    start_date, end_date : str
+        The (inclusive) date range of the incidents.
+
+    id_offset : int
+        The position of the first row in the whole dataset, which keeps
+        Accident IDs unique across chunks.
+
+    seed : int
+        Mixed into the Accident IDs so that datasets built with different seeds differ.
+
+    Returns:
+
+    chunk : pandas.DataFrame
+        The generated incidents, in the column order of the CSV.
+
+    Notes
+    -----
+    - Every column is drawn with vectorized NumPy operations; no Python-level loop runs per row.
+    - Vehicles Involved (1-5) are mostly one or two cars, and Casualties (0-10) grow
+      with the number of vehicles, mirroring the severity rules of `data.determine_severity`.
+    """
+
+    # Dates and times are drawn as indices into small lookup tables of formatted strings
+    days = pd.date_range(start_date, end_date, freq='D').strftime('%Y-%m-%d').to_numpy(dtype=str)
+    minutes = np.array([f"{h:02d}:{m:02d}" for h in range(24) for m in range(60)])
+    hours = rng.choice(24, size=n_rows, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+
+    names = np.array(list(LOCATIONS))
+    centres = np.array(list(LOCATIONS.values()))
+    location_codes = rng.integers(0, len(names), n_rows)
+    latitude = np.clip(centres[location_codes, 0] + rng.normal(0, LOCATION_SPREAD, n_rows), -90, 90)
+    longitude = centres[location_codes, 1] + rng.normal(0, LOCATION_SPREAD, n_rows)
+    longitude = (longitude + 180) % 360 - 180
+
+    vehicles = np.minimum(1 + rng.poisson(0.9, n_rows), 5)
+    casualties = np.minimum(rng.poisson(0.4 + 0.9 * vehicles), 10)
+
+    return pd.DataFrame({
+        'Accident ID': _accident_ids(id_offset, n_rows, seed),
+        'Date': days[rng.integers(0, len(days), n_rows)],
+        'Time': minutes[hours * 60 + rng.integers(0, 60, n_rows)],
+        'Location': names[location_codes],
+        'Latitude': latitude.round(6),
+        'Longitude': longitude.round(6),
+        'Weather Condition': np.array(WEATHER_CONDITIONS)[rng.integers(0, len(WEATHER_CONDITIONS), n_rows)],
+        'Road Condition': np.array(ROAD_CONDITIONS)[rng.integers(0, len(ROAD_CONDITIONS), n_rows)],
+        'Vehicles Involved': vehicles,
+        'Casualties': casualties,
+        'Cause': np.array(CAUSES)[rng.integers(0, len(CAUSES), n_rows)],
+    }, columns=COLUMNS)
+
+
+
+
+def iter_chunks(n_rows, chunk_size=1_000_000, seed=0, start_date='2023-01-01', end_date='2024-12-31'):
+
+    """
+    Yield the synthetic dataset as DataFrames of at most `chunk_size` rows.
+    """
+
+    rng = np.random.default_rng(seed)
+    for offset in range(0, max(n_rows, 1), chunk_size):
+        yield generate_chunk(min(chunk_size, n_rows - offset), rng, start_date, end_date, offset, seed)
+
+
+
+
+def write_synthetic(path, n_rows, chunk_size=1_000_000, seed=0, start_date='2023-01-01', end_date='2024-12-31', file_format=None):
+
+    """
+    Write a synthetic accidents dataset of `n_rows` rows to a CSV or Parquet file.
+
+    Args:
+
+    path : str
+        The output file; the format is taken from its extension ('.csv' or '.parquet')
+        unless `file_format` is given.
+
+    n_rows : int
+        The total number of incidents.
+
+    chunk_size : int
+        The number of rows generated and written at a time, which bounds memory use.
+
+    seed : int
+        The random seed; the same seed always produces the same dataset.
+
+    start_date, end_date : str
+        The (inclusive) date range of the incidents.
+
+    file_format : str, optional
+        'csv' or 'parquet'.
+
+    Notes
+    -----
+    - The file is written to a temporary name and renamed once complete.
+    - Parquet output requires pyarrow; CSV output uses pyarrow's faster writer when it is installed.
+    """
+
+    file_format = file_format or os.path.splitext(path)[1].lstrip('.').lower()
+    if file_format not in ('csv', 'parquet'):
+        raise ValueError(f"Unsupported format '{file_format}', expected 'csv' or 'parquet'")
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        if file_format == 'parquet':
+            raise
+        pa = None
+
+    tmp_path = path + '.tmp'
+    writer = None
+    try:
+        for index, chunk in enumerate(iter_chunks(n_rows, chunk_size, seed, start_date, end_date)):
+            if pa is None:
+                chunk.to_csv(tmp_path, mode='w' if index == 0 else 'a', header=index == 0, index=False)
+                continue
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None and file_format == 'csv':
+                import pyarrow.csv as pa_csv
+                writer = pa_csv.CSVWriter(tmp_path, table.schema, write_options=pa_csv.WriteOptions(quoting_style='needed'))
+            elif writer is None:
+                import pyarrow.parquet as pq
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    os.replace(tmp_path, path)
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic accidents dataset.")
+    parser.add_argument('rows', type=int, help="number of incidents to generate")
+    parser.add_argument('path', help="output file (.csv or .parquet)")
+    parser.add_argument('--chunk-size', type=int, default=1_000_000, help="rows generated per chunk")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    parser.add_argument('--start', default='2023-01-01', help="first date (YYYY-MM-DD)")
+    parser.add_argument('--end', default='2024-12-31', help="last date (YYYY-MM-DD)")
+    parser.add_argument('--format', choices=['csv', 'parquet'], help="output format (default: from the extension)")
+    args = parser.parse_args()
+    write_synthetic(args.path, args.rows, args.chunk_size, args.seed, args.start, args.end, args.format)
@@ -0,0 +1,158 @@
+import calendar
+import threading
+
+import numpy as np
+
+from data import DATASET_PATH, get_data_version, load_accidents
+from profiling import stage
+from metrics import phase
+
+
+# Time axes of the histograms: name -> (number of bins, bin labels); Weekday 0 is Monday, Month 1 is January
+AXES = {
+    'Month': (12, list(calendar.month_abbr[1:])),
+    'Weekday': (7, list(calendar.day_abbr)),
+    'Hour': (24, [f'{hour:02d}:00' for hour in range(24)]),
+}
+
+# Number of packed time keys: key = (month * 7 + weekday) * 24 + hour, with the month counted from 0
+N_KEYS = 12 * 7 * 24
+
+# Columns a histogram can sum besides counting the incidents
+SUM_COLUMNS = ['Casualties', 'Vehicles Involved']
+
+# Cache of temporal indexes keyed by path -> (data version, keys)
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+
+
+def time_keys(dates, hours):
+    # Packed (month, weekday, hour) key of each incident; 1970-01-01 was a Thursday (weekday 3)
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    month = dates.astype('datetime64[M]').astype(np.int64) % 12
+    weekday = (dates.astype('datetime64[D]').astype(np.int64) + 3) % 7
+    return ((month * 7 + weekday) * 24 + np.asarray(hours, dtype=np.int64)).astype(np.int16)
+
+
+
+
+def build_temporal_index(accidents_df):
+
+    """
+    Pack the month, weekday and hour of every incident into one small integer.
+
+    Args:
+
+    accidents_df : pandas.DataFrame
+        The preprocessed DataFrame returned by `data_preprocess`.
+
+    Returns:
+
+    keys : numpy.ndarray
+        The time key of every row (int16, below `N_KEYS`).
+
+    Notes
+    -----
+    - A histogram is then one `np.bincount` of the keys of the selected rows into
+      `N_KEYS` bins, summed over the axes it does not show.
+    """
+
+    return time_keys(accidents_df['Date'].to_numpy(), accidents_df['Hour'].to_numpy())
+
+
+
+
+def get_temporal_index(path=DATASET_PATH):
+
+    """
+    Return the time keys of the dataset, building them once per data version.
+    """
+
+    version = get_data_version(path)
+    cached = _index_cache.get(path)
+    if cached is None or cached[0] != version:
+        with _index_lock:
+            cached = _index_cache.get(path)
+            if cached is None or cached[0] != version:
+                accidents_df = load_accidents(path)
+                with stage('temporal index build'):
+                    cached = _index_cache[path] = (version, build_temporal_index(accidents_df))
+    return cached[1]
+
+
+
+
+def histogram(x='Hour', y='Weekday', start_date=None, end_date=None, countries=None, weather=None, sums=()):
+
+    """
+    Count the incidents matching the dashboard filters per cell of two time axes.
+
+    Args:
+
+    x, y : str
+        Two different `AXES`: 'Hour', 'Weekday' or 'Month'.
+
+    start_date, end_date, countries, weather :
+        The dashboard filters, as for `query.aggregate`.
+
+    sums : list of str, optional
+        `SUM_COLUMNS` to total per cell.
+
+    Returns:
+
+    cells : pandas.DataFrame
+        The columns `y`, `x`, 'Count' and `sums`, one row per cell sorted by `y`
+        then `x`, empty cells included. Weekdays run from 0 (Monday) and months
+        from 1, like 'Month_Num'.
+
+    Notes
+    -----
+    - With the 'parquet' query backend the dates and hours of the matching
+      incidents are scanned from the store and packed on the fly instead of read
+      from the index.
+    """
+
+    import pandas as pd
+    from query import get_backend, filter_accidents
+
+    if x not in AXES or y not in AXES or x == y:
+        raise ValueError(f"No histogram of '{y}' by '{x}'")
+    for column in sums:
+        if column not in SUM_COLUMNS:
+            raise ValueError(f"Cannot sum column '{column}'")
+
+    if get_backend() == 'parquet':
+        from store import scan
+        with phase('filter'):
+            table = scan(['Date', 'Hour', *sums], start_date, end_date, countries, weather)
+            keys = time_keys(table['Date'].to_numpy(), table['Hour'].to_numpy())
+            weights = {column: table[column].to_numpy() for column in sums}
+    else:
+        index = get_temporal_index()
+        filtered = filter_accidents(start_date, end_date, countries, weather)
+        with phase('filter'):
+            # The preprocessed frame keeps its default RangeIndex, so labels are row positions
+            keys = index[filtered.index.to_numpy()]
+            weights = {column: filtered[column].to_numpy() for column in sums}
+
+    with phase('aggregate'):
+        # (month, weekday, hour) cubes, summed over the axis not shown and laid out as (y, x)
+        names = list(AXES)
+        hidden = tuple(position for position, name in enumerate(names) if name not in (x, y))
+        order = [name for name in names if name in (x, y)]
+        shape = [AXES[name][0] for name in names]
+
+        def cells(counts):
+            counts = counts.reshape(shape).sum(axis=hidden)
+            return (counts if order == [y, x] else counts.T).ravel()
+
+        result = pd.DataFrame({
+            y: np.repeat(np.arange(AXES[y][0]), AXES[x][0]) + (y == 'Month'),
+            x: np.tile(np.arange(AXES[x][0]), AXES[y][0]) + (x == 'Month'),
+            'Count': cells(np.bincount(keys, minlength=N_KEYS)),
+        })
+        for column in sums:
+            result[column] = cells(np.bincount(keys, weights=weights[column], minlength=N_KEYS)).round().astype(np.int64)
+        return result
@@ -1,5 +1,5 @@
-import pandas as pd
-import plotly.express as px
+# pandas and plotly.express are imported inside the functions, on first use,
+# to keep them out of the dashboard's cold start
 
 
 
@@ -30,6 +30,8 @@ def monthly_casualties(accidents_df, country):
     """
 
 
+    import plotly.express as px
+
     if country != '':
         monthly_counts = accidents_df[accidents_df['Country'] == country].copy()
 
@@ -65,7 +67,7 @@ def monthly_casualties(accidents_df, country):
 
 
 
-def forecast_interval(model, monthly_counts, n_forecast, last_known):
+def forecast_interval(model, monthly_counts, n_forecast, last_known, on_step=None):
 
     """
     Forecasts future monthly accident counts using a trained model and lagged inputs.
@@ -89,6 +91,10 @@ def forecast_interval(model, monthly_counts, n_forecast, last_known):
           from which the model will generate lag-based forecasts. 
           Must contain at least 3 values.
 
+      on_step : callable, optional
+          Called as `on_step(done, n_forecast)` after each forecasted month,
+          e.g. to report the progress of a background job.
+
     Returns:
       future_dates : pandas.DatetimeIndex
           A datetime index corresponding to the forecasted months.
@@ -103,6 +109,8 @@ def forecast_interval(model, monthly_counts, n_forecast, last_known):
     - `last_known` is modified in-place by appending the predictions.
     """
 
+    import pandas as pd
+
     future_predictions = []
 
     for i in range(n_forecast):
@@ -119,6 +127,9 @@ def forecast_interval(model, monthly_counts, n_forecast, last_known):
         # Append prediction to last_known to roll forward
         last_known.append(y_pred)
 
+        if on_step is not None:
+            on_step(i + 1, n_forecast)
+
     # Build future dates index for plotting
     last_date = monthly_counts['YearMonth'].iloc[-1]
     future_dates = pd.date_range(start=last_date + pd.offsets.MonthBegin(1), periods=n_forecast, freq='MS')
@@ -131,6 +142,97 @@ def forecast_interval(model, monthly_counts, n_forecast, last_known):
 
 
 
+
+def forecast_paths(model, monthly_counts, n_forecast, last_known, n_paths=2000, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), seed=0, on_step=None):
+
+    """
+    Simulates many future paths of the recursive forecast to get its uncertainty bands.
+
+    Every path starts from the last 3 known monthly values. At each month, the model
+    predicts the next value of all paths at once, and a residual drawn from the model's
+    errors on the historical months is added before the value is fed back as a lag.
+
+    Args:
+      model : sklearn.models
+          The trained model on our historical data.
+
+      monthly_counts : pandas.DataFrame
+          The DataFrame returned by `get_accidents_features` or `get_casualties_features`:
+          'YearMonth', the target column and the 'lag_1', 'lag_2', 'lag_3' features.
+
+      n_forecast : int
+          The number of future months to forecast.
+
+      last_known : list of float
+          The most recent known values; the last 3 seed every path. It is not modified.
+
+      n_paths : int, optional
+          The number of simulated paths.
+
+      quantiles : tuple of float, optional
+          The quantiles of the simulated values returned for every month.
+
+      seed : int, optional
+          Seed of the residual draws, so that a forecast is reproducible.
+
+      on_step : callable, optional
+          Called as `on_step(done, n_forecast)` after each simulated month.
+
+    Returns:
+      future_dates : pandas.DatetimeIndex
+          A datetime index corresponding to the forecasted months.
+
+      bands : dict of float -> numpy.ndarray
+          For each quantile, its value at each forecasted month.
+
+    Notes:
+    ------
+    - Each month is one `model.predict` call over all the paths, so 2000 paths cost
+      about as much as a handful of single-row predictions.
+    - Residuals are resampled from the in-sample errors (a residual bootstrap) and
+      propagate to the following months through the lags.
+    - Simulated values are floored at 0, since counts cannot be negative.
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    lag_columns = ['lag_1', 'lag_2', 'lag_3']
+    target_column = [column for column in monthly_counts.columns if column not in ['YearMonth', *lag_columns]][0]
+    residuals = (monthly_counts[target_column] - model.predict(monthly_counts[lag_columns])).to_numpy(dtype=float)
+
+    rng = np.random.default_rng(seed)
+
+    # Lags of every path, most recent first
+    lags = np.tile(np.asarray(last_known[-3:][::-1], dtype=float), (n_paths, 1))
+    simulated = np.empty((n_forecast, n_paths))
+
+    for i in range(n_forecast):
+
+        # One batched prediction for all the paths
+        predictions = model.predict(pd.DataFrame(lags, columns=lag_columns))
+        simulated[i] = np.maximum(predictions + rng.choice(residuals, n_paths), 0)
+
+        # Roll the lags forward
+        lags = np.column_stack([simulated[i], lags[:, :2]])
+
+        if on_step is not None:
+            on_step(i + 1, n_forecast)
+
+    bands = dict(zip(quantiles, np.quantile(simulated, quantiles, axis=1)))
+
+    # Build future dates index for plotting
+    last_date = monthly_counts['YearMonth'].iloc[-1]
+    future_dates = pd.date_range(start=last_date + pd.offsets.MonthBegin(1), periods=n_forecast, freq='MS')
+
+    return future_dates, bands
+
+
+
+
+
+
+
 def get_casualties_features(accidents_df):
 
     """
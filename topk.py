@@ -0,0 +1,201 @@
+import threading
+
+import numpy as np
+
+from data import DATASET_PATH, get_data_version
+from profiling import stage
+from metrics import phase
+from coalescing import shared
+from live import catch_up
+
+
+# Columns whose rankings are served from a top-K index
+TOPK_COLUMNS = ['Location', 'City']
+
+# Built indexes keyed by (path, column) -> (data version, TopKIndex)
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+
+
+class TopKIndex:
+
+    """
+    Exact incident counts of one column per day bucket, merged over any date range.
+
+    Each entry counts the incidents of one (Date, Weather Condition, Country, value)
+    combination. A query selects the entries of its days with a binary search, keeps
+    those of the selected weather and countries, and merges them with one `np.bincount`
+    per value, so its cost depends on the number of days and distinct values, not on
+    the number of incidents.
+
+    Args:
+
+    column : str
+        The ranked column (one of `TOPK_COLUMNS`).
+    """
+
+    def __init__(self, column):
+        self.column = column
+        # Names of each dimension, and their codes in the entries
+        self.names = {'Weather Condition': [], 'Country': [], column: []}
+        self._codes = {dimension: {} for dimension in self.names}
+        # (bucket dates, day, weather, country, value, count) arrays, entries sorted by day;
+        # replaced as a whole on every add, so queries never see a half-merged state
+        empty = np.empty(0, dtype=np.int32)
+        self._entries = (np.empty(0, dtype='datetime64[ns]'), empty, empty, empty, empty, np.empty(0, dtype=np.int64))
+        # Number of the last live batch counted (see live.catch_up)
+        self.live_sequence = 0
+        self._lock = threading.Lock()
+
+    def _encode(self, dimension, values):
+        # Codes of `values`, giving new names the next free codes
+        import pandas as pd
+
+        codes, uniques = pd.factorize(values)
+        known = self._codes[dimension]
+        for name in uniques:
+            if name not in known:
+                known[name] = len(self.names[dimension])
+                self.names[dimension].append(name)
+        return np.array([known[name] for name in uniques], dtype=np.int32)[codes]
+
+    def add(self, incidents):
+
+        """
+        Count new incidents into the index.
+
+        Args:
+
+        incidents : pandas.DataFrame
+            Rows with 'Date', 'Weather Condition', 'Country' and the ranked column, and
+            optionally a 'Count' column when the rows are already grouped.
+        """
+
+        with self._lock:
+            old_dates, old_day, old_weather, old_country, old_value, old_count = self._entries
+
+            new_dates = incidents['Date'].to_numpy(dtype='datetime64[ns]')
+            dates = np.union1d(old_dates, new_dates)
+            if not np.array_equal(dates[:len(old_dates)], old_dates):
+                # Days inserted before known days shift the positions of the later ones
+                old_day = np.searchsorted(dates, old_dates).astype(np.int32)[old_day]
+            day = np.searchsorted(dates, new_dates)
+            weather = self._encode('Weather Condition', incidents['Weather Condition'])
+            country = self._encode('Country', incidents['Country'])
+            value = self._encode(self.column, incidents[self.column])
+            count = incidents['Count'].to_numpy(dtype=np.int64) if 'Count' in incidents else np.ones(len(incidents), dtype=np.int64)
+
+            # Only the entries of the days the incidents fall on are merged again; the
+            # merged entries then go back in day order between the untouched ones. The
+            # entries before the first of these days (all of them, for new days) are copied as is
+            old = [old_day, old_weather, old_country, old_value, old_count]
+            start = np.searchsorted(old_day, day.min()) if len(day) else len(old_day)
+            touched = np.zeros(len(dates), dtype=bool)
+            touched[day] = True
+            inside = touched[old_day[start:]]
+            merged = self._merge(*[np.concatenate([column[start:][inside], new]) for column, new in zip(old, [day, weather, country, value, count])])
+            kept = [column[start:][~inside] for column in old]
+            positions = np.searchsorted(kept[0], merged[0])
+
+            self._entries = (dates, *[np.concatenate([column[:start], np.insert(rest, positions, new)])
+                                      for column, rest, new in zip(old, kept, merged)])
+
+    def _merge(self, day, weather, country, value, count):
+        # Merge duplicate entries; the packed key sorts the entries by day first
+        sizes = [len(self.names['Weather Condition']), len(self.names['Country']), len(self.names[self.column])]
+        key = ((day.astype(np.int64) * sizes[0] + weather) * sizes[1] + country) * sizes[2] + value
+        key, inverse = np.unique(key, return_inverse=True)
+        count = np.bincount(inverse, weights=count, minlength=len(key)).astype(np.int64)
+        key, value = np.divmod(key, sizes[2])
+        key, country = np.divmod(key, sizes[1])
+        day, weather = np.divmod(key, sizes[0])
+        return day.astype(np.int32), weather.astype(np.int32), country.astype(np.int32), value.astype(np.int32), count
+
+    def top(self, k, start_date=None, end_date=None, countries=None, weather=None):
+
+        """
+        Return the `k` values with the most incidents matching the dashboard filters.
+
+        Returns:
+
+        result : pandas.DataFrame
+            The columns `column` and 'Count', by decreasing count (ties by value), as
+            `query.aggregate([column], ..., top=k)` returns them.
+        """
+
+        import pandas as pd
+
+        dates, day, weather_code, country_code, value, count = self._entries
+
+        # Entries of the selected days
+        first = np.searchsorted(dates, np.datetime64(pd.Timestamp(start_date)), 'left') if start_date else 0
+        last = np.searchsorted(dates, np.datetime64(pd.Timestamp(end_date)), 'right') if end_date else len(dates)
+        selected = slice(np.searchsorted(day, first, 'left'), np.searchsorted(day, last, 'left'))
+        value, count = value[selected], count[selected]
+
+        keep = np.ones(len(value), dtype=bool)
+        for dimension, codes, names in [('Weather Condition', weather_code, weather), ('Country', country_code, countries)]:
+            if names:
+                known = self._codes[dimension]
+                keep &= np.isin(codes[selected], [known[name] for name in names if name in known])
+
+        totals = np.bincount(value[keep], weights=count[keep], minlength=len(self.names[self.column])).astype(np.int64)
+        candidates = np.flatnonzero(totals)
+        if len(candidates) > k:
+            # Every value tied with the k-th largest count, so that ties still break by name
+            threshold = np.partition(totals[candidates], len(candidates) - k)[len(candidates) - k]
+            candidates = candidates[totals[candidates] >= threshold]
+
+        names = np.array(self.names[self.column], dtype=object)[candidates]
+        order = np.lexsort((names, -totals[candidates]))[:k]
+        return pd.DataFrame({self.column: names[order].astype(str), 'Count': totals[candidates][order]})
+
+
+
+
+def get_topk_index(column, path=DATASET_PATH):
+
+    """
+    Return the top-K index of `column`, built once per data version.
+
+    The index is filled from one grouped query of the query backend, so it also
+    builds from the Parquet store without loading the dataset in memory.
+    """
+
+    from query import aggregate
+
+    version = get_data_version(path)
+    cached = _index_cache.get((path, column))
+    if cached is None or cached[0] != version:
+        with _index_lock:
+            cached = _index_cache.get((path, column))
+            if cached is None or cached[0] != version:
+                with stage(f'top-k index build: {column}'):
+                    index = TopKIndex(column)
+                    index.add(aggregate(['Date', 'Weather Condition', 'Country', column]))
+                cached = _index_cache[(path, column)] = (version, index)
+    return cached[1]
+
+
+
+
+@shared
+def top_k(column, k, start_date=None, end_date=None, countries=None, weather=None):
+
+    """
+    Return the `k` values of `column` with the most incidents matching the filters.
+
+    Same result as `query.aggregate([column], start_date, end_date, countries, weather, top=k)`,
+    in a time independent of the number of incidents. In live mode the index first
+    counts the live incidents received since the last call.
+    """
+
+    if column not in TOPK_COLUMNS:
+        raise ValueError(f"No top-K index for column '{column}'")
+
+    index = get_topk_index(column)
+    catch_up(index)
+    with phase('aggregate'):
+        return index.top(k, start_date, end_date, countries, weather)
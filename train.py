@@ -0,0 +1,368 @@
+import os
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+from data import DATASET_PATH, get_data_version
+from artifacts import MODELS_DIR
+
+
+# Trained models: name -> (model artifact, feature-columns artifact)
+TRAIN_MODELS = {
+    'assessment': ('assessment_model', 'assessment_feature_columns'),
+    'accidents': ('accidents_forecasting_model', 'xgboost_accidents_forecasting_feature_columns'),
+    'casualties': ('casualties_forecasting_model', 'casualties_feature_columns'),
+}
+
+# Hyperparameters searched for each model (every combination is evaluated)
+PARAM_GRIDS = {
+    'assessment': {
+        'n_estimators': [200, 400],
+        'learning_rate': [0.01, 0.05, 0.1],
+        'max_depth': [3, 5, 7],
+        'subsample': [0.8],
+        'colsample_bytree': [0.8],
+    },
+    'accidents': {
+        'n_estimators': [100, 200],
+        'learning_rate': [0.001, 0.01, 0.05],
+        'max_depth': [1, 2, 3],
+    },
+    'casualties': {
+        'n_estimators': [100, 200],
+        'learning_rate': [0.001, 0.01, 0.05],
+        'max_depth': [1, 2, 3],
+    },
+}
+
+# Assessment features: numeric columns, then one-hot columns of the categorical ones
+ASSESSMENT_NUMERIC = ['Year', 'Month', 'Day', 'DayOfWeek', 'Hour', 'Latitude', 'Longitude', 'Vehicles Involved']
+ASSESSMENT_CATEGORICAL = ['City', 'Country', 'Weather Condition', 'Road Condition', 'Cause']
+
+# Share of the rows held out to score the hyperparameters (the last months for forecasts)
+VALIDATION_SHARE = 0.2
+
+# Seed of the assessment split and of the models
+SEED = 42
+
+# Record of the trained models (parameters, scores, last month), next to the artifacts
+MANIFEST_FILE = 'training_manifest.json'
+
+# Training data of the worker process: model name -> (features, target, is_time_series)
+_worker_data = {}
+
+
+
+
+def assessment_data(accidents_df):
+
+    """
+    Build the casualty assessment features from the preprocessed accidents.
+
+    Returns:
+
+    features : pandas.DataFrame
+        The numeric date, time, position and vehicle columns and the one-hot encoded
+        city, country, weather, road and cause (first category dropped), in the column
+        order `predict_casualties` rebuilds with the feature-columns artifact.
+
+    target : pandas.Series
+        The casualties.
+
+    months : pandas.Series
+        The month of every row.
+    """
+
+    import pandas as pd
+
+    numeric = pd.DataFrame({
+        'Year': accidents_df['Year'],
+        'Month': accidents_df['Date'].dt.month,
+        'Day': accidents_df['Date'].dt.day,
+        'DayOfWeek': accidents_df['Date'].dt.dayofweek,
+        'Hour': accidents_df['Hour'],
+        'Latitude': accidents_df['Latitude'],
+        'Longitude': accidents_df['Longitude'],
+        'Vehicles Involved': accidents_df['Vehicles Involved'],
+    })
+    encoded = pd.get_dummies(accidents_df[ASSESSMENT_CATEGORICAL], drop_first=True, dtype='uint8')
+    return pd.concat([numeric, encoded], axis=1), accidents_df['Casualties'], accidents_df['YearMonth'].dt.to_timestamp()
+
+
+
+
+def forecasting_data(accidents_df, model):
+
+    """
+    Build the lag_1..lag_3 features of a forecasting model, with `tools.get_*_features`.
+
+    Returns the features, the monthly target and the month of every row.
+    """
+
+    import tools
+
+    if model == 'accidents':
+        monthly_counts, _ = tools.get_accidents_features(accidents_df)
+        target = monthly_counts['AccidentsCount']
+    else:
+        monthly_counts, _ = tools.get_casualties_features(accidents_df)
+        target = monthly_counts['Casualties']
+    return monthly_counts[['lag_1', 'lag_2', 'lag_3']], target, monthly_counts['YearMonth']
+
+
+
+
+def split(features, target, time_series):
+    # Hold out the last months of a time series, or a seeded random share of the incidents
+    import numpy as np
+
+    n_validation = max(int(len(features) * VALIDATION_SHARE), 1)
+    if time_series:
+        train = np.arange(len(features) - n_validation)
+    else:
+        train = np.sort(np.random.default_rng(SEED).permutation(len(features))[n_validation:])
+    validation = np.setdiff1d(np.arange(len(features)), train)
+    return (features.iloc[train], target.iloc[train]), (features.iloc[validation], target.iloc[validation])
+
+
+
+
+def _init_worker(datasets):
+    # Runs once per pool process: the training frames are received once, not per candidate
+    _worker_data.update(datasets)
+
+
+
+
+def _score_candidate(model, params):
+    # Fit one hyperparameter combination on the training split and return its validation RMSE
+    import numpy as np
+    import xgboost as xgb
+
+    features, target, time_series = _worker_data[model]
+    (train_x, train_y), (validation_x, validation_y) = split(features, target, time_series)
+    estimator = xgb.XGBRegressor(**params, random_state=SEED, n_jobs=1)
+    estimator.fit(train_x, train_y)
+    rmse = float(np.sqrt(np.mean((estimator.predict(validation_x) - validation_y.to_numpy()) ** 2)))
+    return params, rmse
+
+
+
+
+def search(datasets, workers=None):
+
+    """
+    Score every combination of `PARAM_GRIDS` of the given models across worker processes.
+
+    Args:
+
+    datasets : dict
+        Model name -> (features, target, is_time_series).
+
+    workers : int, optional
+        The number of worker processes (default: one per CPU).
+
+    Returns:
+
+    best : dict
+        Model name -> (best parameters, their validation RMSE).
+    """
+
+    tasks = []
+    for model in datasets:
+        grid = PARAM_GRIDS[model]
+        for values in itertools.product(*grid.values()):
+            tasks.append((model, dict(zip(grid, values))))
+
+    best = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(datasets,)) as pool:
+        futures = [(model, pool.submit(_score_candidate, model, params)) for model, params in tasks]
+        for model, future in futures:
+            params, rmse = future.result()
+            if model not in best or rmse < best[model][1]:
+                best[model] = (params, rmse)
+    return best
+
+
+
+
+def save_artifact(value, name, models_dir=MODELS_DIR):
+    # Replace the artifact atomically; the dashboard reloads it when the file changes
+    import joblib
+
+    path = os.path.join(models_dir, f'{name}.pkl')
+    tmp_path = f'{path}.tmp'
+    joblib.dump(value, tmp_path)
+    os.replace(tmp_path, path)
+
+
+
+
+def load_manifest(models_dir=MODELS_DIR):
+    try:
+        with open(os.path.join(models_dir, MANIFEST_FILE)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+
+
+def save_manifest(manifest, models_dir=MODELS_DIR):
+    path = os.path.join(models_dir, MANIFEST_FILE)
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+
+
+
+def build_datasets(accidents_df, models):
+    # Features, target, months and time-series flag of every model
+    datasets = {}
+    for model in models:
+        if model == 'assessment':
+            features, target, months = assessment_data(accidents_df)
+            datasets[model] = (features, target, months, False)
+        else:
+            features, target, months = forecasting_data(accidents_df, model)
+            datasets[model] = (features, target, months, True)
+    return datasets
+
+
+
+
+def train(models=tuple(TRAIN_MODELS), path=DATASET_PATH, models_dir=MODELS_DIR, workers=None):
+
+    """
+    Rebuild the models from scratch with a parallel hyperparameter search.
+
+    Every combination of `PARAM_GRIDS` is fitted on the training split and scored on
+    the held-out split (the last months for the forecasting models); the best one is
+    refitted on all the rows and written with its feature columns.
+
+    Returns:
+
+    manifest : dict
+        Model name -> its parameters, validation RMSE, rows and last trained month.
+    """
+
+    import xgboost as xgb
+    from data import data_preprocess
+
+    accidents_df = data_preprocess(path)
+    datasets = build_datasets(accidents_df, models)
+
+    best = search({model: (features, target, time_series) for model, (features, target, _, time_series) in datasets.items()}, workers)
+
+    os.makedirs(models_dir, exist_ok=True)
+    manifest = load_manifest(models_dir)
+    for model, (features, target, months, _) in datasets.items():
+        params, rmse = best[model]
+        estimator = xgb.XGBRegressor(**params, random_state=SEED)
+        estimator.fit(features, target)
+
+        model_artifact, columns_artifact = TRAIN_MODELS[model]
+        save_artifact(estimator, model_artifact, models_dir)
+        save_artifact(features.columns.tolist(), columns_artifact, models_dir)
+        manifest[model] = {
+            'params': params,
+            'validation_rmse': rmse,
+            'rows': len(features),
+            'last_month': str(months.max())[:10],
+            'data_version': get_data_version(path),
+            'trained_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+    save_manifest(manifest, models_dir)
+    return manifest
+
+
+
+
+def train_incremental(models=tuple(TRAIN_MODELS), path=DATASET_PATH, models_dir=MODELS_DIR, rounds=50):
+
+    """
+    Add boosting rounds to the current models, fitted on the months newer than their training.
+
+    The previous model's trees are kept and `rounds` trees are added, fitted on the rows
+    of the months after the 'last_month' of the manifest, with the previous parameters
+    and feature columns (categories unseen at the first training are ignored).
+
+    Returns:
+
+    manifest : dict
+        The updated manifest; models without new months are left unchanged.
+    """
+
+    import pandas as pd
+    import xgboost as xgb
+    from data import data_preprocess
+    from artifacts import load_artifact
+
+    accidents_df = data_preprocess(path)
+    datasets = build_datasets(accidents_df, models)
+    manifest = load_manifest(models_dir)
+
+    for model, (features, target, months, _) in datasets.items():
+        if model not in manifest:
+            print(f"{model}: no manifest entry, train it from scratch first")
+            continue
+
+        new_rows = (months > pd.Timestamp(manifest[model]['last_month'])).to_numpy()
+        if not new_rows.any():
+            print(f"{model}: no month after {manifest[model]['last_month']}")
+            continue
+
+        model_artifact, columns_artifact = TRAIN_MODELS[model]
+        previous = load_artifact(model_artifact, models_dir)
+        columns = load_artifact(columns_artifact, models_dir)
+        params = {**manifest[model]['params'], 'n_estimators': rounds}
+
+        estimator = xgb.XGBRegressor(**params, random_state=SEED)
+        estimator.fit(features[new_rows].reindex(columns=columns, fill_value=0), target[new_rows], xgb_model=previous.get_booster())
+
+        save_artifact(estimator, model_artifact, models_dir)
+        manifest[model] = {
+            **manifest[model],
+            'rows': manifest[model]['rows'] + int(new_rows.sum()),
+            'last_month': str(months.max())[:10],
+            'data_version': get_data_version(path),
+            'boosted_rounds': estimator.get_booster().num_boosted_rounds(),
+            'trained_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+    save_manifest(manifest, models_dir)
+    return manifest
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the assessment and forecasting models from the accidents dataset.")
+    parser.add_argument('--models', nargs='+', choices=list(TRAIN_MODELS), default=list(TRAIN_MODELS), help="models to train")
+    parser.add_argument('--dataset', default=DATASET_PATH, help="accidents CSV to train on")
+    parser.add_argument('--models-dir', default=MODELS_DIR, help="where the artifacts are written")
+    parser.add_argument('--workers', type=int, default=None, help="hyperparameter search processes (default: one per CPU)")
+    parser.add_argument('--incremental', action='store_true', help="boost the current models on the months added since their training")
+    parser.add_argument('--rounds', type=int, default=50, help="boosting rounds added by --incremental")
+    args = parser.parse_args()
+
+    if args.incremental:
+        manifest = train_incremental(args.models, args.dataset, args.models_dir, args.rounds)
+    else:
+        manifest = train(args.models, args.dataset, args.models_dir, args.workers)
+
+    for model in args.models:
+        if model in manifest:
+            entry = manifest[model]
+            print(f"{model}: {entry['params']} validation RMSE {entry['validation_rmse']:.2f}, "
+                  f"{entry['rows']:,} rows up to {entry['last_month']}")
+
+
+
+
+if __name__ == "__main__":
+    main()